@@ -0,0 +1,61 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import dataclass, field
+from typing import Any, List, Tuple
+
+MAX_STDERR_CHARS = 64 * 1024
+
+# Per worker process: botocore's data loader, which caches the parsed service models.
+_data_loader: Any = None
+
+
+def _init_worker():
+  global _data_loader
+  from awscli.clidriver import create_clidriver
+
+  # Importing awscli and building the first driver is the startup cost a subprocess pays on every command.
+  _data_loader = create_clidriver().session.get_component('data_loader')
+
+
+def _run_command(args: List[str], stdout_path: str) -> Tuple[int, str]:
+  from awscli.clidriver import create_clidriver
+
+  # A fresh driver per command so no per-command state (profile, region, argument handlers) leaks into the next one,
+  # but sharing the loader means service models are only read from disk once per worker.
+  driver = create_clidriver()
+  driver.session.register_component('data_loader', _data_loader)
+
+  stderr = io.StringIO()
+  with open(stdout_path, 'w') as stdout, redirect_stdout(stdout), redirect_stderr(stderr):
+    try:
+      returncode = driver.main(args)
+    except SystemExit as e:
+      # argparse exits on usage errors, with the same code the aws executable would.
+      returncode = e.code if isinstance(e.code, int) else 255
+  return returncode, stderr.getvalue()[:MAX_STDERR_CHARS]
+
+
+@dataclass(kw_only=True)
+class AwsDriverPool:
+  """Runs aws cli commands in long-lived worker processes through awscli.clidriver instead of a new interpreter per command."""
+
+  workers: int = 4
+  _executor: ProcessPoolExecutor | None = field(default=None, repr=False)
+
+  @property
+  def executor(self) -> ProcessPoolExecutor:
+    if self._executor is None:
+      self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+    return self._executor
+
+  async def run(self, args: List[str], stdout_path: str) -> Tuple[int, str]:
+    """Run args (without the leading "aws") writing stdout to stdout_path, returning the exit code and stderr."""
+    return await asyncio.get_running_loop().run_in_executor(self.executor, _run_command, args, os.fspath(stdout_path))
+
+  def shutdown(self):
+    if self._executor is not None:
+      self._executor.shutdown(wait=False, cancel_futures=True)
+      self._executor = None
@@ -1,12 +1,25 @@
+import asyncio
+import os
 import subprocess
-from typing import List, Tuple
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Deque, List, Optional, Tuple
+
+from alxai.base.aws_driver import AwsDriverPool
+from alxai.trace import span
+
+CHUNK_SIZE = 64 * 1024
+MAX_STDERR_BYTES = 64 * 1024
 
 
 class CliError(Exception):
   pass
 
 
-def invoke_cli(args: List[str], expect_first_arg: str = '', unquote: bool = True) -> Tuple[subprocess.CompletedProcess[str], List[str]]:
+def prepare_args(args: List[str], expect_first_arg: str = '', unquote: bool = True) -> List[str]:
   if expect_first_arg and args[0] != expect_first_arg:
     args = [expect_first_arg] + args
 
@@ -18,21 +31,199 @@ def invoke_cli(args: List[str], expect_first_arg: str = '', unquote: bool = True
         args[i] = arg[1:-1]
 
   print(f'🛠️ {" ".join(args)}')
+  return args
 
+
+def invoke_cli(args: List[str], expect_first_arg: str = '', unquote: bool = True) -> Tuple[subprocess.CompletedProcess[str], List[str]]:
+  """Blocking variant of run_cli for callers outside an event loop."""
+  args = prepare_args(args, expect_first_arg, unquote)
   return subprocess.run(args, capture_output=True, text=True), args
 
 
+@dataclass(kw_only=True)
+class CliResult:
+  args: List[str]
+  returncode: int
+  # stdout is streamed to this file rather than held in memory, the caller owns it.
+  stdout_path: Path
+  stdout_bytes: int
+  stderr: str
+  duration: float
+
+  def read_stdout(self) -> str:
+    with open(self.stdout_path, 'r') as f:
+      return f.read()
+
+  def remove(self):
+    self.stdout_path.unlink(missing_ok=True)
+
+
+@dataclass(kw_only=True)
+class CommandTiming:
+  command: str
+  duration: float
+  queue_wait: float
+  returncode: int | None
+  stdout_bytes: int
+
+
+@dataclass(kw_only=True)
+class CliMetrics:
+  commands: int = 0
+  failures: int = 0
+  timeouts: int = 0
+  oversized: int = 0
+  total_time: float = 0
+  max_time: float = 0
+  total_queue_wait: float = 0
+  stdout_bytes: int = 0
+  recent: Deque[CommandTiming] = field(default_factory=lambda: deque(maxlen=1000))
+
+  def record(self, timing: CommandTiming):
+    self.commands += 1
+    self.total_time += timing.duration
+    self.max_time = max(self.max_time, timing.duration)
+    self.total_queue_wait += timing.queue_wait
+    self.stdout_bytes += timing.stdout_bytes
+    self.recent.append(timing)
+
+  def report(self) -> str:
+    n = max(self.commands, 1)
+    return (
+      f'commands={self.commands} failures={self.failures} timeouts={self.timeouts} oversized={self.oversized} '
+      f'duration(avg/max)={self.total_time / n:.2f}s/{self.max_time:.2f}s queue wait avg={self.total_queue_wait / n:.2f}s stdout={self.stdout_bytes / 1e6:.1f}MB'
+    )
+
+
+@dataclass(kw_only=True)
+class CliRunner:
+  """Runs commands as asyncio subprocesses, at most max_concurrent at a time, each killed after timeout seconds."""
+
+  max_concurrent: int = 8
+  timeout: float = 120.0
+  max_output_bytes: int = 256 * 1024 * 1024
+  output_dir: Optional[Path] = None
+  # When set, aws commands run in its long-lived workers instead of a new aws process each.
+  aws_driver: Optional[AwsDriverPool] = None
+  metrics: CliMetrics = field(default_factory=CliMetrics)
+  _semaphore: asyncio.Semaphore | None = None
+
+  async def _stream(self, stream: asyncio.StreamReader, out, limit: int) -> int:
+    written = 0
+    while chunk := await stream.read(CHUNK_SIZE):
+      written += len(chunk)
+      if written > limit:
+        raise CliError(f'output exceeded {limit} bytes')
+      out.write(chunk)
+    return written
+
+  async def _read_stderr(self, stream: asyncio.StreamReader) -> bytes:
+    stderr = b''
+    while chunk := await stream.read(CHUNK_SIZE):
+      # Keep reading so a chatty process never blocks on a full pipe, but only keep the start.
+      stderr += chunk[: max(MAX_STDERR_BYTES - len(stderr), 0)]
+    return stderr
+
+  async def _spawn(self, args: List[str], fd: int) -> Tuple[int, str, int]:
+    proc = None
+    try:
+      with os.fdopen(fd, 'wb') as out:
+        proc = await asyncio.create_subprocess_exec(*args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        assert proc.stdout is not None and proc.stderr is not None
+        stdout_bytes, stderr, returncode = await asyncio.gather(self._stream(proc.stdout, out, self.max_output_bytes), self._read_stderr(proc.stderr), proc.wait())
+    finally:
+      if proc is not None and proc.returncode is None:
+        proc.kill()
+        await proc.wait()
+    return returncode, stderr.decode(errors='replace'), stdout_bytes
+
+  async def _run_in_process(self, args: List[str], fd: int, path: str) -> Tuple[int, str, int]:
+    assert self.aws_driver is not None
+    os.close(fd)
+    # A worker can't be killed mid-command, on timeout it finishes in the background and its output is discarded.
+    returncode, stderr = await self.aws_driver.run(args[1:], path)
+    stdout_bytes = os.path.getsize(path)
+    if stdout_bytes > self.max_output_bytes:
+      raise CliError(f'output exceeded {self.max_output_bytes} bytes')
+    return returncode, stderr, stdout_bytes
+
+  async def run_to_file(self, args: List[str], expect_first_arg: str = '', unquote: bool = True) -> CliResult:
+    args = prepare_args(args, expect_first_arg, unquote)
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+    queued_at = time.monotonic()
+    async with self._semaphore:
+      start = time.monotonic()
+      fd, path = tempfile.mkstemp(prefix='cli_', suffix='.out', dir=self.output_dir)
+      returncode = None
+      stdout_bytes = 0
+      try:
+        async with asyncio.timeout(self.timeout):
+          if self.aws_driver is not None and args[0] == 'aws':
+            returncode, stderr, stdout_bytes = await self._run_in_process(args, fd, path)
+          else:
+            returncode, stderr, stdout_bytes = await self._spawn(args, fd)
+      except TimeoutError:
+        self.metrics.timeouts += 1
+        os.unlink(path)
+        raise CliError(f'timed out after {self.timeout}s')
+      except CliError:
+        self.metrics.oversized += 1
+        os.unlink(path)
+        raise
+      except BaseException:
+        os.unlink(path)
+        raise
+      finally:
+        self.metrics.record(CommandTiming(command=' '.join(args[:3]), duration=time.monotonic() - start, queue_wait=start - queued_at, returncode=returncode, stdout_bytes=stdout_bytes))
+
+    return CliResult(args=args, returncode=returncode, stdout_path=Path(path), stdout_bytes=stdout_bytes, stderr=stderr, duration=time.monotonic() - start)
+
+  async def run_checked(self, args: List[str], expect_first_arg: str = '') -> CliResult:
+    """Like run, but stdout is left in the result's file, which the caller must remove()."""
+    try:
+      with span('run_cli', cat='cli', command=' '.join(args[:3])):
+        result = await self.run_to_file(args, expect_first_arg=expect_first_arg)
+    except CliError:
+      self.metrics.failures += 1
+      raise
+    except Exception as e:
+      self.metrics.failures += 1
+      raise CliError(f'Unknown Error: {e}')
+
+    if result.returncode != 0:
+      self.metrics.failures += 1
+      result.remove()
+      if result.stderr:
+        raise CliError(f'exited with code {result.returncode}: {result.stderr}')
+      else:
+        raise CliError(f'exited with code {result.returncode}')
+    return result
+
+  async def run(self, args: List[str], expect_first_arg: str = '') -> Tuple[str, List[str]]:
+    result = await self.run_checked(args, expect_first_arg)
+    try:
+      return result.read_stdout(), result.args
+    finally:
+      result.remove()
+
+
+_runner = CliRunner()
+
+
+def get_cli_runner() -> CliRunner:
+  return _runner
+
+
+def set_cli_runner(runner: CliRunner) -> None:
+  global _runner
+  _runner = runner
+
+
 async def run_cli(args: List[str], expect_first_arg: str = '') -> Tuple[str, List[str]]:
-  try:
-    result, actual_args = invoke_cli(args, expect_first_arg=expect_first_arg)
-    retcode, stdout, stderr = result.returncode, result.stdout, result.stderr
-  except Exception as e:
-    raise CliError(f'Unknown Error: {e}')
-
-  if retcode != 0:
-    if stderr:
-      raise CliError(f'exited with code {retcode}: {stderr}')
-    else:
-      raise CliError(f'exited with code {retcode}')
-
-  return stdout, actual_args
+  return await get_cli_runner().run(args, expect_first_arg)
+
+
+async def run_cli_to_file(args: List[str], expect_first_arg: str = '') -> CliResult:
+  return await get_cli_runner().run_checked(args, expect_first_arg)
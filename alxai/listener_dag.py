@@ -0,0 +1,125 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, Iterable, List, Set, Tuple
+
+from alxai.listener_queue import ListenerQueue
+
+
+@dataclass(kw_only=True)
+class MessageProgress:
+  published_at: float
+  ready: Dict[str, float] = field(default_factory=dict)
+  dispatched: Set[str] = field(default_factory=set)
+  finished: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass(kw_only=True)
+class CriticalPath:
+  key: Hashable
+  latency: float
+  stages: List[str]
+
+
+@dataclass(kw_only=True)
+class ListenerDag[MessageType]:
+  """Routes each published message through listener stages as soon as the stage's inputs are ready for that message."""
+
+  key: Callable[[MessageType], Hashable]
+  root: str = 'file'
+  stages: Dict[str, ListenerQueue[MessageType]] = field(default_factory=dict)
+  producers: Dict[str, str] = field(default_factory=dict)
+  critical_paths: List[CriticalPath] = field(default_factory=list)
+  # Called with the message key and stage name each time a stage finishes processing a message, e.g. to checkpoint progress.
+  on_stage_complete: Callable[[Hashable, str], None] | None = None
+  _progress: Dict[Hashable, MessageProgress] = field(default_factory=dict)
+
+  def add(self, listener: ListenerQueue[MessageType]) -> None:
+    name = type(listener).__name__
+    if name in self.stages:
+      raise ValueError(f'Stage {name} already added')
+
+    # Stages must be added after the stages producing their inputs, which also rules out cycles.
+    for needed in listener.inputs:
+      if needed != self.root and needed not in self.producers:
+        raise ValueError(f'Stage {name} needs "{needed}" which no earlier stage produces')
+    for output in listener.outputs:
+      if output == self.root or output in self.producers:
+        raise ValueError(f'Stage {name} produces "{output}" which is already produced by {self.producers.get(output, self.root)}')
+      self.producers[output] = name
+
+    listener.on_complete = self._finished
+    self.stages[name] = listener
+
+  async def publish(self, msg: MessageType, finished: Iterable[str] = ()) -> None:
+    """Route msg through the stages, skipping the finished ones when resuming work recorded by on_stage_complete."""
+    progress = MessageProgress(published_at=time.monotonic())
+    progress.ready[self.root] = progress.published_at
+    for name in finished:
+      if name in self.stages:
+        progress.dispatched.add(name)
+        progress.finished[name] = progress.published_at
+        for output in self.stages[name].outputs:
+          progress.ready[output] = progress.published_at
+    if len(progress.finished) == len(self.stages):
+      return
+
+    self._progress[self.key(msg)] = progress
+    await self._dispatch(msg, progress)
+
+  async def _dispatch(self, msg: MessageType, progress: MessageProgress) -> None:
+    for name, stage in self.stages.items():
+      if name in progress.dispatched or not all(needed in progress.ready for needed in stage.inputs):
+        continue
+
+      progress.dispatched.add(name)
+      try:
+        await stage.put(msg)
+      except asyncio.QueueShutDown:
+        await self._finished(stage, msg, processed=False)
+
+  async def _finished(self, stage: ListenerQueue[MessageType], msg: MessageType, processed: bool) -> None:
+    key = self.key(msg)
+    progress = self._progress.get(key)
+    if progress is None:
+      return
+
+    now = time.monotonic()
+    progress.finished[type(stage).__name__] = now
+    # Only stages that processed the message are checkpointed, failed or dropped ones run again on resume.
+    if processed and self.on_stage_complete is not None:
+      self.on_stage_complete(key, type(stage).__name__)
+    for output in stage.outputs:
+      progress.ready[output] = now
+
+    if len(progress.finished) == len(self.stages):
+      del self._progress[key]
+      self.critical_paths.append(CriticalPath(key=key, latency=now - progress.published_at, stages=self._critical_stages(progress)))
+    else:
+      await self._dispatch(msg, progress)
+
+  def _critical_stages(self, progress: MessageProgress) -> List[str]:
+    # Walk back from the last stage to finish, following whichever input became ready last.
+    name = max(progress.finished, key=lambda n: progress.finished[n])
+    path = [name]
+    while True:
+      inputs = self.stages[name].inputs
+      gating = max(inputs, key=lambda i: progress.ready.get(i, 0)) if inputs else self.root
+      if gating == self.root:
+        return path
+      name = self.producers[gating]
+      path.insert(0, name)
+
+  def pending(self) -> List[Tuple[Hashable, Set[str]]]:
+    return [(key, set(self.stages) - set(progress.finished)) for key, progress in self._progress.items()]
+
+  def report(self) -> str:
+    if not self.critical_paths:
+      return 'no messages completed every stage'
+
+    latencies = sorted(p.latency for p in self.critical_paths)
+    slowest = max(self.critical_paths, key=lambda p: p.latency)
+    return (
+      f'{len(latencies)} messages, critical path latency avg={sum(latencies) / len(latencies):.2f}s p50={latencies[len(latencies) // 2]:.2f}s max={slowest.latency:.2f}s '
+      f'(slowest {slowest.key}: {" -> ".join(slowest.stages)})'
+    )
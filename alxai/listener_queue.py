@@ -1,45 +1,299 @@
 import asyncio
-import datetime
-import json
-import os
-import random
-import string
+import time
 from abc import abstractmethod
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
-from pathlib import Path
-from typing import Any, Dict, List, Optional, Self
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Literal, Tuple
 
-import pandas as pd
-from pydantic import BaseModel, ConfigDict, Field
+from alxai.scheduler import Priority, request_priority
+from alxai.trace import counter, span
 
-from alxai.json import json_dumps
-from alxai.openai.conv import oneshot_conv, usermsg
-from alxai.openai.convclass import ConvClass
-from investigation.asset_graph import AssetGraph
+type OverflowPolicy = Literal['block', 'drop_oldest', 'coalesce']
+
+
+@dataclass(kw_only=True)
+class Envelope[MessageType]:
+  msg: MessageType
+  enqueued_at: float = field(default_factory=time.monotonic)
+  # Messages that were folded into this one and complete when it does.
+  covers: List[MessageType] = field(default_factory=list)
+
+
+class ListenerBuffer[T](asyncio.Queue[T]):
+  def replace_newest(self, fn: Callable[[T], T]) -> None:
+    self._queue[-1] = fn(self._queue[-1])  # type: ignore
+
+
+@dataclass(kw_only=True)
+class ListenerMetrics:
+  enqueued: int = 0
+  processed: int = 0
+  failed: int = 0
+  dropped: int = 0
+  coalesced: int = 0
+  skipped: int = 0
+  batches: int = 0
+  total_lag: float = 0
+  max_lag: float = 0
+  total_processing_time: float = 0
+  max_processing_time: float = 0
+  last_error: str | None = None
+
+  def record_failure(self, e: Exception, count: int = 1) -> None:
+    self.failed += count
+    self.last_error = f'{type(e).__name__}: {e}'
+
+  def record(self, lag: float, processing_time: float) -> None:
+    self.processed += 1
+    self.total_lag += lag
+    self.max_lag = max(self.max_lag, lag)
+    self.total_processing_time += processing_time
+    self.max_processing_time = max(self.max_processing_time, processing_time)
+
+  def report(self) -> str:
+    n = max(self.processed, 1)
+    return (
+      f'enqueued={self.enqueued} processed={self.processed} failed={self.failed} dropped={self.dropped} coalesced={self.coalesced} skipped={self.skipped} batches={self.batches} '
+      f'lag(avg/max)={self.total_lag / n:.2f}s/{self.max_lag:.2f}s processing(avg/max)={self.total_processing_time / n:.2f}s/{self.max_processing_time:.2f}s'
+      + (f' last_error={self.last_error}' if self.last_error else '')
+    )
 
 
 @dataclass(kw_only=True)
 class ListenerQueue[MessageType]:
-  queue: asyncio.Queue[MessageType] = field(default_factory=asyncio.Queue)
   done: asyncio.Event
+  workers: int = 1
+  maxsize: int = 0
+  overflow: OverflowPolicy = 'block'
+  order_key: Callable[[MessageType], Hashable] | None = None
+  latest_only: bool = False
+  debounce: float = 0
+  min_interval: float = 0
+  batch_max_tokens: int = 0
+  batch_window: float = 0
+  batch_max_items: int = 16
+  inputs: Tuple[str, ...] = ('file',)
+  outputs: Tuple[str, ...] = ()
+  priority: Priority = 'background'
+  # Called once per message when the listener is finished with it, with whether it was processed rather than failing or being dropped.
+  on_complete: Callable[['ListenerQueue[MessageType]', MessageType, bool], Awaitable[None]] | None = None
+  metrics: ListenerMetrics = field(default_factory=ListenerMetrics)
+  queue: ListenerBuffer[Envelope[MessageType]] = field(init=False)
+  _order_locks: Dict[Hashable, Tuple[asyncio.Lock, int]] = field(default_factory=dict)
+  _last_run: float = 0
+
+  def __post_init__(self):
+    self.queue = ListenerBuffer(maxsize=self.maxsize)
+    if self.overflow == 'coalesce' and type(self).coalesce is ListenerQueue.coalesce:
+      raise ValueError(f"{type(self).__name__} uses overflow='coalesce' but doesn't implement coalesce()")
 
   @abstractmethod
   async def process(self, msg: MessageType):
     pass
 
+  async def process_batch(self, msgs: List[MessageType]) -> List[MessageType]:
+    """Process msgs, returning the ones that failed."""
+    failed = []
+    for msg in msgs:
+      try:
+        await self.process(msg)
+      except Exception as e:
+        self.metrics.record_failure(e)
+        print(f'Error in {type(self).__name__}: {e}')
+        failed.append(msg)
+    return failed
+
+  def coalesce(self, pending: MessageType, msg: MessageType) -> MessageType:
+    """Merge msg into the newest pending message when the queue is full, required for overflow='coalesce'."""
+    raise NotImplementedError
+
+  def message_tokens(self, msg: MessageType) -> int:
+    return 0
+
+  @property
+  def batching(self) -> bool:
+    return self.batch_max_tokens > 0 or self.batch_window > 0
+
+  @property
+  def depth(self) -> int:
+    return self.queue.qsize()
+
+  async def put(self, msg: MessageType) -> None:
+    if self.queue.full():
+      if self.overflow == 'drop_oldest':
+        dropped = self.queue.get_nowait()
+        self.queue.task_done()
+        self.metrics.dropped += 1
+        await self._complete(dropped, processed=False)
+      elif self.overflow == 'coalesce':
+        self.queue.replace_newest(lambda pending: Envelope(msg=self.coalesce(pending.msg, msg), enqueued_at=pending.enqueued_at, covers=pending.covers + [pending.msg]))
+        self.metrics.coalesced += 1
+        return
+
+    await self.queue.put(Envelope(msg=msg))
+    self.metrics.enqueued += 1
+    counter(f'{type(self).__name__}.queue_depth', self.depth)
+
+  def report(self) -> str:
+    return f'{type(self).__name__}: depth={self.depth} {self.metrics.report()}'
+
+  async def _complete(self, envelope: Envelope[MessageType], processed: bool):
+    if self.on_complete is None:
+      return
+    for msg in [envelope.msg] + envelope.covers:
+      await self.on_complete(self, msg, processed)
+
   async def _handle_done(self):
     await self.done.wait()
     self.queue.shutdown()
 
-  async def run(self):
-    done_task = asyncio.create_task(self._handle_done())
+  @asynccontextmanager
+  async def _ordered(self, msg: MessageType) -> AsyncIterator[None]:
+    if self.order_key is None:
+      yield
+      return
 
+    # Messages sharing a key are processed one at a time in arrival order, asyncio.Lock wakes waiters FIFO.
+    key = self.order_key(msg)
+    lock, users = self._order_locks.get(key, (asyncio.Lock(), 0))
+    self._order_locks[key] = (lock, users + 1)
+    try:
+      async with lock:
+        yield
+    finally:
+      lock, users = self._order_locks[key]
+      if users == 1:
+        del self._order_locks[key]
+      else:
+        self._order_locks[key] = (lock, users - 1)
+
+  async def _process_envelope(self, envelope: Envelope[MessageType]):
+    async with self._ordered(envelope.msg):
+      start = time.monotonic()
+      processed = False
+      try:
+        with span(f'{type(self).__name__}.process', cat='listener'):
+          await self.process(envelope.msg)
+        processed = True
+      except Exception as e:
+        self.metrics.record_failure(e)
+        print(f'Error in {type(self).__name__}: {e}')
+      finally:
+        self.metrics.record(start - envelope.enqueued_at, time.monotonic() - start)
+    await self._complete(envelope, processed)
+
+  def _drain_pending(self, envelope: Envelope[MessageType]) -> Envelope[MessageType]:
+    while not self.queue.empty():
+      newest = self.queue.get_nowait()
+      self.queue.task_done()
+      self.metrics.skipped += 1
+      envelope = Envelope(msg=newest.msg, enqueued_at=envelope.enqueued_at, covers=envelope.covers + [envelope.msg] + newest.covers)
+    return envelope
+
+  async def _sleep_unless_done(self, seconds: float) -> None:
+    try:
+      await asyncio.wait_for(self.done.wait(), seconds)
+    except TimeoutError:
+      pass
+
+  async def _latest(self, envelope: Envelope[MessageType]) -> Envelope[MessageType]:
+    # Collapse everything queued behind this message into a single run over the newest one.
+    envelope = self._drain_pending(envelope)
+    if self.debounce:
+      while not self.done.is_set():
+        await self._sleep_unless_done(self.debounce)
+        if self.queue.empty():
+          break
+        envelope = self._drain_pending(envelope)
+
+    # When draining at shutdown the run is the last one, so there's nothing to space it out from.
+    wait = self.min_interval - (time.monotonic() - self._last_run)
+    if wait > 0 and not self.done.is_set():
+      await self._sleep_unless_done(wait)
+      envelope = self._drain_pending(envelope)
+
+    self._last_run = time.monotonic()
+    return envelope
+
+  async def _collect_batch(self, envelope: Envelope[MessageType]) -> Tuple[List[Envelope[MessageType]], Envelope[MessageType] | None]:
+    # Returns the batch plus the message that would have overflowed the token budget, which starts the next batch.
+    batch = [envelope]
+    tokens = self.message_tokens(envelope.msg)
+    deadline = time.monotonic() + self.batch_window
+    while len(batch) < self.batch_max_items:
+      remaining = deadline - time.monotonic()
+      try:
+        if remaining > 0:
+          envelope = await asyncio.wait_for(self.queue.get(), remaining)
+        else:
+          envelope = self.queue.get_nowait()
+      except (TimeoutError, asyncio.QueueEmpty, asyncio.QueueShutDown):
+        break
+
+      msg_tokens = self.message_tokens(envelope.msg)
+      if self.batch_max_tokens and tokens + msg_tokens > self.batch_max_tokens:
+        return batch, envelope
+      batch.append(envelope)
+      tokens += msg_tokens
+    return batch, None
+
+  async def _process_batch(self, batch: List[Envelope[MessageType]]):
+    start = time.monotonic()
+    msgs = [envelope.msg for envelope in batch]
+    try:
+      with span(f'{type(self).__name__}.process_batch', cat='listener', size=len(batch)):
+        failed = await self.process_batch(msgs) or []
+    except Exception as e:
+      failed = msgs
+      self.metrics.record_failure(e, len(batch))
+      print(f'Error in {type(self).__name__}: {e}')
+    finally:
+      elapsed = time.monotonic() - start
+      self.metrics.batches += 1
+      for envelope in batch:
+        self.metrics.record(start - envelope.enqueued_at, elapsed / len(batch))
+        self.queue.task_done()
+    failed_ids = {id(msg) for msg in failed}
+    for envelope in batch:
+      await self._complete(envelope, processed=id(envelope.msg) not in failed_ids)
+
+  async def _worker(self):
+    # Each worker runs in its own task, so LLM requests made while processing are tagged with this listener's priority.
+    request_priority.set(self.priority)
+    carry: Envelope[MessageType] | None = None
     try:
       while True:
-        msg = await self.queue.get()
-        await self.process(msg)
+        envelope = carry or await self.queue.get()
+        carry = None
+        counter(f'{type(self).__name__}.queue_depth', self.depth)
+        if self.batching:
+          batch, carry = await self._collect_batch(envelope)
+          try:
+            await self._process_batch(batch)
+          except Exception as e:
+            self.metrics.record_failure(e)
+            print(f'Error in {type(self).__name__} worker: {e}')
+          continue
+
+        try:
+          if self.latest_only:
+            envelope = await self._latest(envelope)
+          await self._process_envelope(envelope)
+        except Exception as e:
+          # Failures outside process(), e.g. in on_complete, are counted too and don't stop the worker.
+          self.metrics.record_failure(e)
+          print(f'Error in {type(self).__name__} worker: {e}')
+        finally:
+          self.queue.task_done()
     except asyncio.QueueShutDown:
       pass
+
+  async def run(self):
+    done_task = asyncio.create_task(self._handle_done())
+
+    try:
+      # Shutdown is not immediate, so workers keep draining queued messages until the queue is empty.
+      workers = 1 if self.latest_only else max(1, self.workers)
+      await asyncio.gather(*[self._worker() for _ in range(workers)])
     finally:
       await done_task
-
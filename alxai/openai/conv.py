@@ -14,6 +14,8 @@ from openai.types.chat.chat_completion_reasoning_effort import ChatCompletionRea
 from alxai.base.generic_conv import ConvClassBase, ConvID, ConvListener, generate_conv_id
 from alxai.openai.listeners import AgentPrintListener, DefaultConvListener
 from alxai.openai.tool import ToolExecutor, get_tool_descriptions
+from alxai.scheduler import Priority, get_scheduler
+from alxai.trace import span
 
 type MsgFailureHandler = Callable[['Conv', str, ParsedChatCompletionMessage], Awaitable[Optional[Conv]]]
 type MsgHandler = Callable[['Conv', ParsedChatCompletionMessage], Awaitable[Optional[Conv]]]
@@ -67,6 +69,7 @@ class Conv(ConvClassBase):
   response_format: Type | NotGiven
   msg_failure_handler: MsgFailureHandler = default_msg_failure_handler
   reasoning_effort: ChatCompletionReasoningEffort = 'medium'
+  priority: Priority | None = None
 
   def __post_init__(self):
     if not self._listeners:
@@ -89,6 +92,7 @@ class Conv(ConvClassBase):
       _listeners=self._listeners,
       response_format=self.response_format,
       tools=self.tools,
+      priority=self.priority,
     )
 
   def _clone_msgs(self) -> List[ChatCompletionMessageParam]:
@@ -139,6 +143,13 @@ class Conv(ConvClassBase):
       return message.parsed
 
   async def run(self) -> None:
+    with span('Conv.run', cat='conv', model=self.model, conv_id=self._conv_id):
+      nc = await self._step()
+
+    if nc:
+      return await nc.run()
+
+  async def _step(self) -> Optional['Conv']:
     await self._before()
 
     temperature = self.temperature or NOT_GIVEN
@@ -167,9 +178,10 @@ class Conv(ConvClassBase):
       response_format = NOT_GIVEN
       reasoning_effort = NOT_GIVEN
 
-    response = await self.client.beta.chat.completions.parse(
-      model=model, messages=self.messages, reasoning_effort=reasoning_effort, response_format=response_format, tools=get_tool_descriptions(self.tools), temperature=temperature
-    )
+    async with get_scheduler().slot(self.priority):
+      response = await self.client.beta.chat.completions.parse(
+        model=model, messages=self.messages, reasoning_effort=reasoning_effort, response_format=response_format, tools=get_tool_descriptions(self.tools), temperature=temperature
+      )
     choice = response.choices[0]
     assert choice
     nc = self.append(parsedMsgToParam(choice.message))
@@ -195,8 +207,7 @@ class Conv(ConvClassBase):
     else:
       nc = await nc.msg_handler(nc, choice.message)
 
-    if nc:
-      return await nc.run()
+    return nc
 
 
 async def start_conv(
@@ -214,6 +225,7 @@ async def start_conv(
   listeners: Optional[List[ConvListener]] = None,
   response_format: Type | NotGiven | None = None,
   debug: bool = True,
+  priority: Priority | None = None,
 ):
   log = log or logging.getLogger()
   c = Conv(
@@ -230,6 +242,7 @@ async def start_conv(
     _listeners=listeners or [],
     response_format=response_format if response_format is not None else NOT_GIVEN,
     tools=tools or NOT_GIVEN,
+    priority=priority,
   )
   await c.run()
 
@@ -248,6 +261,7 @@ async def oneshot_conv[ResponseType](
   msg_failure_handler: MsgFailureHandler = default_msg_failure_handler,
   listeners: Optional[List[ConvListener]] = None,
   debug: bool = True,
+  priority: Priority | None = None,
 ) -> ResponseType | str | None:
   log = log or logging.getLogger()
 
@@ -270,6 +284,7 @@ async def oneshot_conv[ResponseType](
     _listeners=listeners or [],
     response_format=response_format if response_format is not None else NOT_GIVEN,
     tools=tools or NOT_GIVEN,
+    priority=priority,
   )
   await c.run()
 
@@ -290,6 +305,7 @@ async def structured_oneshot[ResponseType](
   msg_failure_handler: MsgFailureHandler = default_msg_failure_handler,
   listeners: Optional[List[ConvListener]] = None,
   debug: bool = True,
+  priority: Priority | None = None,
 ) -> ResponseType:
   log = log or logging.getLogger()
 
@@ -312,6 +328,7 @@ async def structured_oneshot[ResponseType](
     _listeners=listeners or [],
     response_format=response_format,
     tools=tools or NOT_GIVEN,
+    priority=priority,
   )
   await c.run()
 
@@ -1,7 +1,7 @@
 import copy
 import json
 from dataclasses import dataclass
-from typing import List, Optional, Self, Type
+from typing import List, Optional, Self, Tuple, Type
 
 from openai import NOT_GIVEN, AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam, ParsedChatCompletionMessage
@@ -13,6 +13,8 @@ from alxai.model_quirks import strip_code_prefix
 from alxai.openai.conv import parsedMsgToParam, usermsg
 from alxai.openai.listeners import AgentPrintListener, DefaultConvListener
 from alxai.openai.tool import ToolExecutor, get_tool_descriptions
+from alxai.scheduler import Priority, get_scheduler
+from alxai.trace import span
 
 
 @dataclass(kw_only=True)
@@ -24,6 +26,7 @@ class ConvClass[ResponseType](ConvClassBase):
   temperature: float | None = None
   response_format: Type[ResponseType] | None = None
   reasoning_effort: ChatCompletionReasoningEffort = 'medium'
+  priority: Priority | None = None
 
   def __post_init__(self):
     if not self._listeners:
@@ -83,6 +86,14 @@ class ConvClass[ResponseType](ConvClassBase):
     return self
 
   async def run(self) -> Self:
+    with span(f'{type(self).__name__}.run', cat='conv', model=self.model, conv_id=self._conv_id):
+      nc, run_again = await self._step()
+
+    if run_again:
+      return await nc.run()
+    return nc
+
+  async def _step(self) -> Tuple[Self, bool]:
     await self._before()
 
     ctx = get_conv_context()
@@ -121,9 +132,10 @@ class ConvClass[ResponseType](ConvClassBase):
       else:
         assert False
 
-    response = await client.beta.chat.completions.parse(
-      model=model, messages=self.messages, reasoning_effort=reasoning_effort, response_format=response_format, tools=get_tool_descriptions(self.tools), temperature=temperature
-    )
+    async with get_scheduler().slot(self.priority):
+      response = await client.beta.chat.completions.parse(
+        model=model, messages=self.messages, reasoning_effort=reasoning_effort, response_format=response_format, tools=get_tool_descriptions(self.tools), temperature=temperature
+      )
     choice = response.choices[0]
     assert choice
     nc = self.respond_via_msg(parsedMsgToParam(choice.message))
@@ -169,6 +181,4 @@ class ConvClass[ResponseType](ConvClassBase):
           nc = rnc
           run_again = True
 
-    if run_again:
-      return await nc.run()
-    return nc
+    return nc, run_again
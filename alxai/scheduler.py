@@ -0,0 +1,130 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Iterator, Literal
+
+type Priority = Literal['critical', 'interactive', 'background']
+
+PRIORITIES: tuple[Priority, ...] = ('critical', 'interactive', 'background')
+
+request_priority = ContextVar[Priority]('request_priority', default='interactive')
+
+
+@contextmanager
+def priority(p: Priority) -> Iterator[None]:
+  token = request_priority.set(p)
+  try:
+    yield
+  finally:
+    request_priority.reset(token)
+
+
+@dataclass(kw_only=True)
+class Waiter:
+  future: asyncio.Future[None]
+  enqueued_at: float
+
+
+@dataclass(kw_only=True)
+class PriorityStats:
+  requests: int = 0
+  total_wait: float = 0
+  max_wait: float = 0
+
+  def record(self, wait: float) -> None:
+    self.requests += 1
+    self.total_wait += wait
+    self.max_wait = max(self.max_wait, wait)
+
+
+@dataclass(kw_only=True)
+class RequestScheduler:
+  """Shares provider capacity between priority classes using weighted fair queuing (stride scheduling).
+
+  A class whose oldest request has waited longer than max_wait is served next regardless of weight."""
+
+  capacity: int = 8
+  weights: Dict[Priority, int] = field(default_factory=lambda: {'critical': 8, 'interactive': 4, 'background': 1})
+  max_wait: float = 30.0
+  stats: Dict[Priority, PriorityStats] = field(default_factory=lambda: {p: PriorityStats() for p in PRIORITIES})
+  _waiting: Dict[Priority, Deque[Waiter]] = field(default_factory=lambda: {p: deque() for p in PRIORITIES})
+  _pass: Dict[Priority, float] = field(default_factory=lambda: {p: 0.0 for p in PRIORITIES})
+  _vtime: float = 0
+  _in_flight: int = 0
+
+  @asynccontextmanager
+  async def slot(self, p: Priority | None = None) -> AsyncIterator[None]:
+    p = p or request_priority.get()
+    start = time.monotonic()
+
+    if self._in_flight < self.capacity and not any(self._waiting.values()):
+      self._in_flight += 1
+    else:
+      waiter = Waiter(future=asyncio.get_running_loop().create_future(), enqueued_at=start)
+      if not self._waiting[p]:
+        # A class that was idle rejoins at the current virtual time rather than bursting on old credit.
+        self._pass[p] = max(self._pass[p], self._vtime)
+      self._waiting[p].append(waiter)
+      try:
+        await waiter.future
+      except asyncio.CancelledError:
+        if waiter.future.done() and not waiter.future.cancelled():
+          self._release()
+        elif waiter in self._waiting[p]:
+          self._waiting[p].remove(waiter)
+        raise
+
+    self.stats[p].record(time.monotonic() - start)
+    try:
+      yield
+    finally:
+      self._release()
+
+  def _release(self) -> None:
+    self._in_flight -= 1
+    while self._in_flight < self.capacity:
+      waiter = self._next_waiter()
+      if waiter is None:
+        return
+      if waiter.future.done():
+        continue
+      self._in_flight += 1
+      waiter.future.set_result(None)
+
+  def _next_waiter(self) -> Waiter | None:
+    candidates = [p for p in PRIORITIES if self._waiting[p]]
+    if not candidates:
+      return None
+
+    now = time.monotonic()
+    starving = [p for p in candidates if now - self._waiting[p][0].enqueued_at > self.max_wait]
+    if starving:
+      chosen = min(starving, key=lambda p: self._waiting[p][0].enqueued_at)
+    else:
+      chosen = min(candidates, key=lambda p: self._pass[p])
+
+    self._vtime = self._pass[chosen]
+    self._pass[chosen] += 1 / self.weights[chosen]
+    return self._waiting[chosen].popleft()
+
+  def report(self) -> str:
+    lines = []
+    for p, stats in self.stats.items():
+      avg = stats.total_wait / stats.requests if stats.requests else 0
+      lines.append(f'{p}: requests={stats.requests} queue wait avg={avg:.2f}s max={stats.max_wait:.2f}s')
+    return '\n'.join(lines)
+
+
+_scheduler = RequestScheduler()
+
+
+def get_scheduler() -> RequestScheduler:
+  return _scheduler
+
+
+def set_scheduler(scheduler: RequestScheduler) -> None:
+  global _scheduler
+  _scheduler = scheduler
@@ -0,0 +1,139 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+
+@dataclass(kw_only=True)
+class Span:
+  name: str
+  cat: str
+  start: float
+  tid: int
+  parent: Optional['Span'] = None
+  args: Dict[str, Any] = field(default_factory=dict)
+
+
+current_span = ContextVar[Optional[Span]]('current_span', default=None)
+
+
+@dataclass(kw_only=True)
+class Tracer:
+  """Collects spans as Chrome trace events (viewable in Perfetto or chrome://tracing)."""
+
+  enabled: bool = False
+  events: List[Dict[str, Any]] = field(default_factory=list)
+  _origin: float = field(default_factory=time.perf_counter)
+  _tids: Dict[int, int] = field(default_factory=dict)
+  _tid_names: Dict[int, str] = field(default_factory=dict)
+
+  def _now_us(self) -> float:
+    return (time.perf_counter() - self._origin) * 1e6
+
+  def _tid(self) -> int:
+    # One track per asyncio task so that overlapping coroutines nest correctly in the viewer.
+    try:
+      task = asyncio.current_task()
+    except RuntimeError:
+      task = None
+
+    key = id(task) if task else threading.get_ident()
+    if key not in self._tids:
+      tid = len(self._tids) + 1
+      self._tids[key] = tid
+      self._tid_names[tid] = task.get_name() if task else threading.current_thread().name
+    return self._tids[key]
+
+  @contextmanager
+  def span(self, name: str, cat: str, args: Dict[str, Any]) -> Iterator[Span]:
+    s = Span(name=name, cat=cat, start=self._now_us(), tid=self._tid(), parent=current_span.get(), args=args)
+    token = current_span.set(s)
+    try:
+      yield s
+    except BaseException as e:
+      s.args['error'] = repr(e)
+      raise
+    finally:
+      current_span.reset(token)
+      if s.parent:
+        s.args['parent'] = s.parent.name
+      self.events.append({'name': s.name, 'cat': s.cat, 'ph': 'X', 'ts': s.start, 'dur': self._now_us() - s.start, 'pid': os.getpid(), 'tid': s.tid, 'args': s.args})
+
+  def counter(self, name: str, value: float) -> None:
+    self.events.append({'name': name, 'ph': 'C', 'ts': self._now_us(), 'pid': os.getpid(), 'args': {name: value}})
+
+  def save(self, path: Path) -> None:
+    metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}} for tid, name in self._tid_names.items()]
+    with open(path, 'w') as f:
+      json.dump({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+  def summary(self) -> str:
+    stages: Dict[str, List[float]] = {}
+    for e in self.events:
+      if e['ph'] == 'X':
+        stages.setdefault(e['name'], []).append(e['dur'] / 1000)
+
+    rows = []
+    for name, durations in sorted(stages.items(), key=lambda kv: -sum(kv[1])):
+      durations.sort()
+      p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+      rows.append(f'{name:<40} {len(durations):>6} {sum(durations):>12.1f} {sum(durations) / len(durations):>10.1f} {p95:>10.1f} {durations[-1]:>10.1f}')
+
+    header = f'{"stage":<40} {"count":>6} {"total ms":>12} {"mean ms":>10} {"p95 ms":>10} {"max ms":>10}'
+    return '\n'.join([header, '-' * len(header)] + rows)
+
+
+_tracer = Tracer(enabled=bool(os.environ.get('ALXAI_TRACE')))
+_NULL_SPAN = nullcontext()
+
+
+def get_tracer() -> Tracer:
+  return _tracer
+
+
+def enable_tracing(enabled: bool = True) -> None:
+  _tracer.enabled = enabled
+
+
+def tracing_enabled() -> bool:
+  return _tracer.enabled
+
+
+def span(name: str, cat: str = 'stage', **args: Any):
+  if not _tracer.enabled:
+    return _NULL_SPAN
+  return _tracer.span(name, cat, args)
+
+
+def counter(name: str, value: float) -> None:
+  if _tracer.enabled:
+    _tracer.counter(name, value)
+
+
+def traced[**P, R](name: str, cat: str = 'stage') -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
+  def decorator(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+    @functools.wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+      if not _tracer.enabled:
+        return await func(*args, **kwargs)
+      with _tracer.span(name, cat, {}):
+        return await func(*args, **kwargs)
+
+    return wrapper
+
+  return decorator
+
+
+def save_trace(path: Path) -> None:
+  _tracer.save(path)
+
+
+def trace_summary() -> str:
+  return _tracer.summary()
@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from alxai.base.aws_driver import AwsDriverPool
+from alxai.base.cli import CliError, CliRunner
+
+
+async def time_commands(runner: CliRunner, args: List[str], runs: int) -> List[float]:
+  durations = []
+  for _ in range(runs):
+    start = time.monotonic()
+    try:
+      await runner.run(list(args))
+    except CliError as e:
+      # Failing with the same error on both backends still measures the per-command overhead.
+      print(f'Error: {e}')
+    durations.append(time.monotonic() - start)
+  return durations
+
+
+def describe(name: str, durations: List[float]) -> str:
+  return f'{name}: mean={statistics.mean(durations) * 1000:.0f}ms median={statistics.median(durations) * 1000:.0f}ms min={min(durations) * 1000:.0f}ms'
+
+
+async def main():
+  parser = argparse.ArgumentParser(description='Compare per-command overhead of aws subprocesses and in-process aws cli workers')
+  parser.add_argument('--runs', type=int, default=20)
+  parser.add_argument('command', nargs='*', default=['aws', 'sts', 'get-caller-identity', '--output', 'json'])
+  args = parser.parse_args()
+
+  subprocess_runner = CliRunner()
+  durations = await time_commands(subprocess_runner, args.command, args.runs)
+
+  pool = AwsDriverPool(workers=1)
+  driver_runner = CliRunner(aws_driver=pool)
+  # The first command pays for the worker's startup, which a long investigation only pays once.
+  await time_commands(driver_runner, args.command, 1)
+  driver_durations = await time_commands(driver_runner, args.command, args.runs)
+  pool.shutdown()
+
+  print(f'\n📊 {args.runs} runs of {" ".join(args.command)}')
+  print(f'📊 {describe("subprocess", durations)}')
+  print(f'📊 {describe("in-process", driver_durations)}')
+  print(f'📊 speedup {statistics.median(durations) / statistics.median(driver_durations):.1f}x')
+
+
+if __name__ == '__main__':
+  asyncio.run(main())
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import copy
+import io
+import random
+import time
+from typing import Any, Dict, List
+
+import pyarrow.parquet as pq
+
+from investigation.json_to_parquet import json_to_dataframes, records_to_tables
+
+
+def synthetic_reservations(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+  """describe-instances shaped records: nested dicts, lists of dicts, and fields that only some records have."""
+  rng = random.Random(seed)
+  records = []
+  for i in range(count):
+    instances = []
+    for j in range(rng.randint(1, 3)):
+      instance: Dict[str, Any] = {
+        'InstanceId': f'i-{i:08x}{j}',
+        'InstanceType': rng.choice(['t3.micro', 'm5.large', 'c6g.xlarge']),
+        'LaunchTime': f'2025-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T00:00:00+00:00',
+        'State': {'Code': 16, 'Name': rng.choice(['running', 'stopped'])},
+        'Placement': {'AvailabilityZone': rng.choice(['us-east-1a', 'us-east-1b']), 'Tenancy': 'default'},
+        'PrivateIpAddress': f'10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)}',
+        'SecurityGroups': [{'GroupId': f'sg-{rng.randint(0, 999):03d}', 'GroupName': 'web'} for _ in range(rng.randint(0, 2))],
+        'Tags': [{'Key': 'Name', 'Value': f'host-{i}'}],
+      }
+      if rng.random() < 0.3:
+        instance['PublicIpAddress'] = f'54.1.{rng.randint(0, 255)}.{rng.randint(0, 255)}'
+      instances.append(instance)
+    records.append({'ReservationId': f'r-{i:08x}', 'OwnerId': '123456789012', 'Groups': [], 'Instances': instances})
+  return records
+
+
+async def legacy(records: List[Dict[str, Any]]) -> int:
+  async def id_key(_):
+    return 'ReservationId'
+
+  dfs = await json_to_dataframes(records, 'Reservations', id_key)
+  size = 0
+  for df in dfs.values():
+    buf = io.BytesIO()
+    df.to_parquet(buf, compression='zstd')
+    size += buf.tell()
+  return size
+
+
+def columnar(records: List[Dict[str, Any]]) -> int:
+  size = 0
+  for table in records_to_tables(records, 'Reservations', 'ReservationId').values():
+    buf = io.BytesIO()
+    pq.write_table(table, buf, compression='zstd')
+    size += buf.tell()
+  return size
+
+
+async def main():
+  parser = argparse.ArgumentParser(description='Compare the legacy pandas flattener with the columnar Arrow one')
+  parser.add_argument('--records', type=int, default=100000)
+  args = parser.parse_args()
+
+  records = synthetic_reservations(args.records)
+  # The legacy flattener writes parent ids into the nested dicts, so it gets its own copy.
+  legacy_records = copy.deepcopy(records)
+
+  start = time.monotonic()
+  legacy_size = await legacy(legacy_records)
+  legacy_time = time.monotonic() - start
+
+  start = time.monotonic()
+  columnar_size = columnar(records)
+  columnar_time = time.monotonic() - start
+
+  print(f'📊 {args.records} records')
+  print(f'📊 legacy (dicts -> pandas -> parquet): {legacy_time:.2f}s, {legacy_size / 1e6:.1f}MB')
+  print(f'📊 columnar (arrow -> parquet): {columnar_time:.2f}s, {columnar_size / 1e6:.1f}MB')
+  print(f'📊 speedup {legacy_time / columnar_time:.1f}x')
+
+
+if __name__ == '__main__':
+  asyncio.run(main())
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Tuple
 
 from pydantic import BaseModel, Field
 
@@ -23,7 +23,7 @@ Determine if the provided user question can be answered definitively using the d
 {investigation.summarize_data_frames()}
 
 # Facts extracted so far
-{investigation.summarize_facts()}
+{investigation.summarize_facts(investigation.prompt)}
 
 # Response
 Respond with a JSON object that conforms to the following JSON Schema: {AreWeDoneModel.model_json_schema()}
@@ -34,8 +34,13 @@ Respond with a JSON object that conforms to the following JSON Schema: {AreWeDon
 class AreWeDoneListener(ListenerQueue[FileMetadata]):
   investigation: Investigation
   client: Any
+  latest_only: bool = True
+  debounce: float = 1.0
+  inputs: Tuple[str, ...] = ('facts', 'assets')
+  outputs: Tuple[str, ...] = ('done',)
 
   async def process(self, fm: FileMetadata):
+    await self.investigation.summary_ready()
     done = await structured_oneshot(self.client, [usermsg(prompt(self.investigation))], model='o3-mini', response_format=AreWeDoneModel)
     if done.we_are_done:
-      self.investigation.done.set()
+      self.investigation.mark_done()
@@ -1,6 +1,7 @@
-from typing import Dict, List
+from itertools import islice
+from typing import Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 AssetID = str
 
@@ -17,13 +18,26 @@ class AssetEdge(BaseModel):
   edge_type: str
 
 
+def node_gml(node: AssetNode) -> str:
+  return f'  node [\n    id {node.asset_id}\n    label {node.asset_name}\n  ]\n'
+
+
 class AssetGraph(BaseModel):
   nodes: Dict[AssetID, AssetNode]
   edges: Dict[AssetID, List[AssetEdge]]
+  # Nodes must change through add_node/update for the cached GML to stay in sync.
+  _gml: Optional[str] = PrivateAttr(default=None)
+  _gml_nodes: int = PrivateAttr(default=0)
+  _version: int = PrivateAttr(default=0)
+
+  @property
+  def version(self) -> int:
+    return self._version
 
   def add_node(self, node: AssetNode) -> None:
     if node.asset_id not in self.nodes:
       self.nodes[node.asset_id] = node
+      self._version += 1
 
   def add_edge(self, edge: AssetEdge) -> None:
     if edge.source_id not in self.edges:
@@ -36,13 +50,25 @@ class AssetGraph(BaseModel):
     self.edges[edge.source_id].append(edge)
 
   def update(self, asset_graph: 'AssetGraph') -> None:
+    for asset_id, node in asset_graph.nodes.items():
+      existing = self.nodes.get(asset_id)
+      if existing is None:
+        self._version += 1
+      elif existing != node:
+        # A relabelled node keeps its position, so the GML is re-rendered rather than appended to.
+        self._gml = None
+        self._version += 1
     self.nodes.update(asset_graph.nodes)
     for edges in asset_graph.edges.values():
       for edge in edges:
         self.add_edge(edge)
 
   def to_gml(self) -> str:
-    gml_string = 'graph [\n'
-    for node in self.nodes.values():
-      gml_string += f'  node [\n    id {node.asset_id}\n    label {node.asset_name}\n  ]\n'
-    return gml_string
+    if self._gml is None or self._gml_nodes > len(self.nodes):
+      self._gml = 'graph [\n'
+      self._gml_nodes = 0
+    if self._gml_nodes < len(self.nodes):
+      # New nodes are always at the end of the dict, so only they need rendering.
+      self._gml += ''.join(node_gml(node) for node in islice(self.nodes.values(), self._gml_nodes, None))
+      self._gml_nodes = len(self.nodes)
+    return self._gml
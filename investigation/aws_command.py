@@ -0,0 +1,168 @@
+from typing import List, Tuple
+
+READ_ONLY_PREFIXES = ('describe-', 'list-', 'get-', 'lookup-', 'search-', 'batch-get-', 'scan', 'query', 'filter-log-events')
+READ_ONLY_COMMANDS = {('s3', 'ls'), ('sts', 'get-caller-identity')}
+# Operations that describe or list resources, cached unless they are sensitive. Other read-only operations, where new
+# secret and credential apis appear, are only cached when they are in CACHEABLE_OPERATIONS.
+CACHEABLE_PREFIXES = ('describe-', 'list-', 'lookup-', 'search-', 'filter-log-events')
+CACHEABLE_OPERATIONS = {
+  ('s3', 'ls'),
+  ('sts', 'get-caller-identity'),
+  ('iam', 'get-account-authorization-details'),
+  ('iam', 'get-account-summary'),
+  ('iam', 'get-account-password-policy'),
+  ('iam', 'get-group'),
+  ('iam', 'get-group-policy'),
+  ('iam', 'get-instance-profile'),
+  ('iam', 'get-policy'),
+  ('iam', 'get-policy-version'),
+  ('iam', 'get-role'),
+  ('iam', 'get-role-policy'),
+  ('iam', 'get-user'),
+  ('iam', 'get-user-policy'),
+  ('s3api', 'get-bucket-acl'),
+  ('s3api', 'get-bucket-encryption'),
+  ('s3api', 'get-bucket-location'),
+  ('s3api', 'get-bucket-logging'),
+  ('s3api', 'get-bucket-policy'),
+  ('s3api', 'get-bucket-policy-status'),
+  ('s3api', 'get-bucket-tagging'),
+  ('s3api', 'get-bucket-versioning'),
+  ('s3api', 'get-public-access-block'),
+  ('lambda', 'get-function'),
+  ('lambda', 'get-function-configuration'),
+  ('lambda', 'get-policy'),
+  ('ec2', 'get-ebs-encryption-by-default'),
+  ('kms', 'get-key-policy'),
+  ('kms', 'get-key-rotation-status'),
+  ('sns', 'get-topic-attributes'),
+  ('sqs', 'get-queue-attributes'),
+  ('sqs', 'get-queue-url'),
+  ('ecr', 'get-repository-policy'),
+  ('ecr', 'get-lifecycle-policy'),
+  ('guardduty', 'get-findings'),
+  ('securityhub', 'get-findings'),
+  ('cloudtrail', 'get-trail-status'),
+  ('cloudtrail', 'get-event-selectors'),
+}
+# Their output is a credential or secret that must never be written to disk, even when they look like a describe or list.
+SENSITIVE_OPERATIONS = {
+  ('secretsmanager', 'get-secret-value'),
+  ('secretsmanager', 'batch-get-secret-value'),
+  ('ssm', 'get-parameter'),
+  ('ssm', 'get-parameters'),
+  ('ssm', 'get-parameters-by-path'),
+  ('ssm', 'get-parameter-history'),
+  ('ecr', 'get-login-password'),
+  ('ecr', 'get-authorization-token'),
+  ('ecr-public', 'get-login-password'),
+  ('ecr-public', 'get-authorization-token'),
+  ('sts', 'get-session-token'),
+  ('sts', 'get-federation-token'),
+  ('sso', 'get-role-credentials'),
+  ('codeartifact', 'get-authorization-token'),
+  ('redshift', 'get-cluster-credentials'),
+  ('redshift', 'get-cluster-credentials-with-iam'),
+  ('cognito-identity', 'get-credentials-for-identity'),
+  ('cognito-idp', 'describe-user-pool-client'),
+  ('lightsail', 'get-relational-database-master-user-password'),
+  ('ec2', 'get-password-data'),
+}
+IGNORED_FLAGS = {'--no-cli-pager', '--no-paginate'}
+BOOLEAN_FLAGS = IGNORED_FLAGS | {'--debug', '--no-verify-ssl', '--no-sign-request', '--cli-auto-prompt', '--no-cli-auto-prompt', '--dry-run', '--no-dry-run', '--recursive'}
+
+# Seconds an output stays fresh, by how quickly that service's state usually changes.
+SERVICE_TTLS = {
+  'sts': 24 * 3600,
+  'organizations': 24 * 3600,
+  'iam': 3600,
+  'route53': 3600,
+  's3': 1800,
+  's3api': 1800,
+  'lambda': 900,
+  'ec2': 600,
+  'elbv2': 600,
+  'elb': 600,
+  'rds': 600,
+  'ecs': 300,
+  'eks': 300,
+  'securityhub': 300,
+  'guardduty': 300,
+  'cloudtrail': 60,
+  'logs': 60,
+  'cloudwatch': 60,
+}
+DEFAULT_TTL = 600
+
+
+def unquote(arg: str) -> str:
+  if len(arg) >= 2 and arg[0] == arg[-1] and arg[0] in '"\'':
+    return arg[1:-1]
+  return arg
+
+
+def _split(args: List[str]) -> Tuple[List[str], List[List[str]]]:
+  args = [unquote(arg) for arg in args]
+  if not args or args[0] != 'aws':
+    args = ['aws'] + args
+
+  command: List[str] = []
+  options: List[List[str]] = []
+  for arg in args:
+    if arg.startswith('--'):
+      options.append([arg])
+    elif options and options[-1][0] not in BOOLEAN_FLAGS and (len(command) >= 3 or len(options[-1]) == 1):
+      # Global options before the service and operation (e.g. --region) take a single value.
+      options[-1].append(arg)
+    else:
+      command.append(arg)
+  return command, [option for option in options if option[0] not in IGNORED_FLAGS]
+
+
+def normalize_args(args: List[str]) -> List[str]:
+  """Canonical form of an aws cli command, so the same request written differently compares equal.
+
+  Quotes are stripped, the leading "aws" is added, and options are sorted by name keeping their values in order."""
+  command, options = _split(args)
+  return command + [part for option in sorted(options, key=lambda o: o[0]) for part in option]
+
+
+def cache_key(args: List[str]) -> str:
+  """Like normalize_args, but also sorts the values of multi-value options (e.g. --group-ids), which don't change what is returned."""
+  command, options = _split(args)
+  options = [[option[0], *sorted(option[1:])] for option in options]
+  return ' '.join(command + [part for option in sorted(options, key=lambda o: o[0]) for part in option])
+
+
+def option_value(args: List[str], name: str) -> str | None:
+  _, options = _split(args)
+  for option in options:
+    if option[0] == name and len(option) > 1:
+      return option[1]
+  return None
+
+
+def service_operation(args: List[str]) -> Tuple[str, str]:
+  command, _ = _split(args)
+  return (command[1] if len(command) > 1 else '', command[2] if len(command) > 2 else '')
+
+
+def is_read_only(args: List[str]) -> bool:
+  service, operation = service_operation(args)
+  return (service, operation) in READ_ONLY_COMMANDS or operation.startswith(READ_ONLY_PREFIXES)
+
+
+def is_sensitive(args: List[str]) -> bool:
+  return service_operation(args) in SENSITIVE_OPERATIONS
+
+
+def is_cacheable(args: List[str]) -> bool:
+  """Whether args is known not to return a secret, so its output may be cached and written to disk."""
+  service, operation = service_operation(args)
+  known_safe = (service, operation) in CACHEABLE_OPERATIONS or operation.startswith(CACHEABLE_PREFIXES)
+  return known_safe and is_read_only(args) and not is_sensitive(args)
+
+
+def command_ttl(args: List[str]) -> float:
+  service, _ = service_operation(args)
+  return SERVICE_TTLS.get(service, DEFAULT_TTL)
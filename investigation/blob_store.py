@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import io
+import mmap
+import os
+import struct
+import uuid
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Dict
+
+import pyarrow as pa
+
+BLOB_DIR = Path('output/blobs')
+
+# magic, codec, uncompressed size
+HEADER = struct.Struct('<4sBQ')
+MAGIC = b'ALXB'
+CODEC_RAW = 0
+CODEC_ZSTD = 1
+COPY_CHUNK = 1024 * 1024
+
+type Digest = str
+
+
+def digest_of(data: bytes) -> Digest:
+  return hashlib.sha256(data).hexdigest()
+
+
+def encode_blob(data: bytes, compress: bool) -> bytes:
+  if compress:
+    return HEADER.pack(MAGIC, CODEC_ZSTD, len(data)) + pa.Codec('zstd').compress(data, asbytes=True)
+  return HEADER.pack(MAGIC, CODEC_RAW, len(data)) + data
+
+
+def decode_blob(buf: memoryview) -> memoryview:
+  magic, codec, size = HEADER.unpack_from(buf)
+  if magic != MAGIC:
+    raise ValueError('Not a blob')
+  payload = buf[HEADER.size :]
+  if codec == CODEC_RAW:
+    return payload
+  return memoryview(pa.Codec('zstd').decompress(payload, decompressed_size=size))
+
+
+class BlobStore:
+  """Content-addressed storage for investigation artifacts, keyed by the sha256 of the uncompressed content."""
+
+  @abstractmethod
+  async def put(self, data: bytes, compress: bool = True) -> Digest:
+    pass
+
+  @abstractmethod
+  def read(self, digest: Digest) -> memoryview:
+    pass
+
+  @abstractmethod
+  def size(self, digest: Digest) -> int:
+    pass
+
+  async def get(self, digest: Digest) -> memoryview:
+    return self.read(digest)
+
+  async def put_file(self, path: Path) -> Digest:
+    """Store a file's content uncompressed, without reading it all into memory where the store allows."""
+    return await self.put(path.read_bytes(), compress=False)
+
+  def open_stream(self, digest: Digest) -> BinaryIO:
+    return io.BytesIO(self.read(digest))
+
+  def read_text(self, digest: Digest) -> str:
+    return str(self.read(digest), 'utf-8')
+
+
+@dataclass(kw_only=True)
+class MemoryBlobStore(BlobStore):
+  blobs: Dict[Digest, bytes] = field(default_factory=dict)
+
+  async def put(self, data: bytes, compress: bool = True) -> Digest:
+    digest = digest_of(data)
+    self.blobs.setdefault(digest, bytes(data))
+    return digest
+
+  def read(self, digest: Digest) -> memoryview:
+    return memoryview(self.blobs[digest])
+
+  def size(self, digest: Digest) -> int:
+    return len(self.blobs[digest])
+
+
+@dataclass(kw_only=True)
+class FileBlobStore(BlobStore):
+  root: Path = BLOB_DIR
+  executor: ThreadPoolExecutor = field(default_factory=lambda: ThreadPoolExecutor(max_workers=4, thread_name_prefix='blob_store'))
+
+  def path(self, digest: Digest) -> Path:
+    return self.root / digest[:2] / digest[2:]
+
+  def _put(self, data: bytes, compress: bool) -> Digest:
+    digest = digest_of(data)
+    path = self.path(digest)
+    if path.exists():
+      return digest
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'wb') as f:
+      f.write(encode_blob(data, compress))
+    # Concurrent writers of the same content race harmlessly, the rename is atomic and the bytes are identical.
+    os.replace(tmp_path, path)
+    return digest
+
+  async def put(self, data: bytes, compress: bool = True) -> Digest:
+    return await asyncio.get_running_loop().run_in_executor(self.executor, self._put, data, compress)
+
+  def _put_file(self, source: Path) -> Digest:
+    sha = hashlib.sha256()
+    size = 0
+    with open(source, 'rb') as f:
+      while chunk := f.read(COPY_CHUNK):
+        sha.update(chunk)
+        size += len(chunk)
+    digest = sha.hexdigest()
+    path = self.path(digest)
+    if path.exists():
+      return digest
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{uuid.uuid4().hex}.tmp')
+    with open(source, 'rb') as src, open(tmp_path, 'wb') as dst:
+      dst.write(HEADER.pack(MAGIC, CODEC_RAW, size))
+      while chunk := src.read(COPY_CHUNK):
+        dst.write(chunk)
+    os.replace(tmp_path, path)
+    return digest
+
+  async def put_file(self, path: Path) -> Digest:
+    return await asyncio.get_running_loop().run_in_executor(self.executor, self._put_file, path)
+
+  def open_stream(self, digest: Digest) -> BinaryIO:
+    f = open(self.path(digest), 'rb')
+    _, codec, _ = HEADER.unpack(f.read(HEADER.size))
+    if codec == CODEC_RAW:
+      return f
+    f.close()
+    return io.BytesIO(self.read(digest))
+
+  def read(self, digest: Digest) -> memoryview:
+    with open(self.path(digest), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+      decoded = decode_blob(view)
+      if decoded.obj is not mapped:
+        return decoded
+      # A raw payload is a view into the mapping, copy it out so the mapping can be closed.
+      with decoded:
+        return memoryview(bytes(decoded))
+
+  async def get(self, digest: Digest) -> memoryview:
+    return await asyncio.get_running_loop().run_in_executor(self.executor, self.read, digest)
+
+  def size(self, digest: Digest) -> int:
+    with open(self.path(digest), 'rb') as f:
+      _, _, size = HEADER.unpack(f.read(HEADER.size))
+    return size
+
+
+_blob_store: BlobStore | None = None
+
+
+def get_blob_store() -> BlobStore:
+  global _blob_store
+  if _blob_store is None:
+    _blob_store = FileBlobStore()
+  return _blob_store
+
+
+def set_blob_store(store: BlobStore) -> None:
+  global _blob_store
+  _blob_store = store
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from alxai.base.cli import run_cli_to_file
+from investigation.aws_command import cache_key, command_ttl, is_cacheable, option_value
+from investigation.blob_store import Digest, get_blob_store
+
+MAX_ENTRIES = 1000
+# Outputs larger than this go straight from the cli's output file to the blob store instead of into memory.
+STREAM_BYTES = 16 * 1024 * 1024
+
+
+@dataclass(kw_only=True)
+class LargeOutput:
+  digest: Digest
+  size: int
+
+
+type CommandOutput = str | LargeOutput
+
+
+async def run_aws_cli(args: List[str]) -> CommandOutput:
+  result = await run_cli_to_file(args, expect_first_arg='aws')
+  try:
+    if result.stdout_bytes > STREAM_BYTES:
+      return LargeOutput(digest=await get_blob_store().put_file(result.stdout_path), size=result.stdout_bytes)
+    return result.read_stdout()
+  finally:
+    result.remove()
+
+
+@dataclass(kw_only=True)
+class CachedResult:
+  stdout: CommandOutput
+  stored_at: float
+  ttl: float
+
+  def fresh(self, now: float) -> bool:
+    return now - self.stored_at < self.ttl
+
+
+def command_key(args: List[str]) -> str:
+  """cache_key plus the profile and region the command runs with, including those that come from the environment."""
+  profile = option_value(args, '--profile') or os.environ.get('AWS_PROFILE') or os.environ.get('AWS_DEFAULT_PROFILE') or ''
+  region = option_value(args, '--region') or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or ''
+  return f'{cache_key(args)} profile={profile} region={region}'
+
+
+@dataclass(kw_only=True)
+class CommandCache:
+  """Caches the output of read-only aws cli commands for their service's TTL, shared by every investigation in the process.
+
+  Concurrent identical commands share a single run. Failures aren't cached."""
+
+  enabled: bool = True
+  max_entries: int = MAX_ENTRIES
+  hits: int = 0
+  coalesced: int = 0
+  misses: int = 0
+  bypassed: int = 0
+  _entries: Dict[str, CachedResult] = field(default_factory=dict)
+  _inflight: Dict[str, asyncio.Task[CommandOutput]] = field(default_factory=dict)
+
+  async def _fetch(self, args: List[str], key: str) -> CommandOutput:
+    stdout = await run_aws_cli(args)
+    self._entries.pop(key, None)
+    self._entries[key] = CachedResult(stdout=stdout, stored_at=time.monotonic(), ttl=command_ttl(args))
+    while len(self._entries) > self.max_entries:
+      # Entries are kept in insertion order, so the first is the oldest.
+      del self._entries[next(iter(self._entries))]
+    return stdout
+
+  def _done(self, key: str, task: asyncio.Task[CommandOutput]):
+    if self._inflight.get(key) is task:
+      del self._inflight[key]
+    # Retrieve the exception so it isn't logged as unhandled when every waiter was cancelled.
+    task.cancelled() or task.exception()
+
+  async def run_streamed(self, args: List[str], bypass: bool = False) -> Tuple[CommandOutput, bool]:
+    """Run an aws cli command, returning its output and whether it came from the cache instead of a new run.
+
+    Outputs over STREAM_BYTES are returned as a LargeOutput in the blob store. bypass always runs the command, and caches
+    the new output for later callers."""
+    if not self.enabled or not is_cacheable(args):
+      return await run_aws_cli(args), False
+
+    key = command_key(args)
+    if bypass:
+      self.bypassed += 1
+    else:
+      entry = self._entries.get(key)
+      if entry is not None and entry.fresh(time.monotonic()):
+        self.hits += 1
+        print(f'♻️ Cached {" ".join(args)}')
+        return entry.stdout, True
+      task = self._inflight.get(key)
+      if task is not None:
+        self.coalesced += 1
+        return await asyncio.shield(task), True
+      self.misses += 1
+
+    task = asyncio.create_task(self._fetch(args, key))
+    task.add_done_callback(lambda t: self._done(key, t))
+    self._inflight[key] = task
+    # Shielded so one waiter being cancelled doesn't fail the others sharing the run.
+    return await asyncio.shield(task), False
+
+  async def run(self, args: List[str], bypass: bool = False) -> Tuple[str, bool]:
+    """Like run_streamed, but always returns the output as a string."""
+    stdout, cache_hit = await self.run_streamed(args, bypass)
+    if isinstance(stdout, LargeOutput):
+      return get_blob_store().read_text(stdout.digest), cache_hit
+    return stdout, cache_hit
+
+  def report(self) -> str:
+    total = self.hits + self.coalesced + self.misses
+    hit_rate = (self.hits + self.coalesced) / max(total, 1)
+    return f'command cache: {self.hits} hits, {self.coalesced} coalesced, {self.misses} misses, {self.bypassed} bypassed ({hit_rate:.0%} hit rate), {len(self._entries)} entries'
+
+
+_command_cache: CommandCache | None = None
+
+
+def get_command_cache() -> CommandCache:
+  global _command_cache
+  if _command_cache is None:
+    _command_cache = CommandCache()
+  return _command_cache
+
+
+def set_command_cache(cache: CommandCache) -> None:
+  global _command_cache
+  _command_cache = cache
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Any, List
+from typing import Any, Dict, List, Tuple
 
 from pydantic import BaseModel, Field
 
@@ -13,16 +13,28 @@ class ExtractPrimaryIdsModel(BaseModel):
   primary_ids: List[str] = Field(description='A list of IDs (ARNs or other types).')
 
 
-def prompt(investigation: Investigation, content: str):
-  return f"""# Goal:
-Extract an asset graph from the provided AWS cli output. Ensure that all assets referenced by ID in the output are represented in the Graph, even if they have no known edges associated with them.
+class FileAssetGraph(BaseModel):
+  filename: str = Field(description='The filename of the AWS cli output the graph was extracted from.')
+  graph: AssetGraph
+
 
-# Instructions:
+class BatchAssetGraph(BaseModel):
+  graphs: List[FileAssetGraph] = Field(description='The asset graph extracted from each AWS cli output, one entry per file.')
+
+
+INSTRUCTIONS = """# Instructions:
 - Use full ARNs as the asset_id for each asset node, do not confuse the name with the id.
 - Only if an ARN is not used by a specific AWS resource should youuse the AWS resource name as the asset_id.
 - The asset_name should be a short. human readable name for the asset.
 - the edge_type should be a short single verb.
-- The asset_type should be a single noun describing the aws object type.
+- The asset_type should be a single noun describing the aws object type."""
+
+
+def prompt(investigation: Investigation, content: str):
+  return f"""# Goal:
+Extract an asset graph from the provided AWS cli output. Ensure that all assets referenced by ID in the output are represented in the Graph, even if they have no known edges associated with them.
+
+{INSTRUCTIONS}
 
 # Response:
 Respond with a JSON object that conforms to the following JSON Schema: {AssetGraph.model_json_schema()}
@@ -32,25 +44,65 @@ Respond with a JSON object that conforms to the following JSON Schema: {AssetGra
 """
 
 
+def batch_prompt(investigation: Investigation, contents: Dict[str, str]):
+  prompt = f"""# Goal:
+Extract an asset graph from each of the provided AWS cli outputs. Ensure that all assets referenced by ID in an output are represented in that output's Graph, even if they have no known edges associated with them.
+
+{INSTRUCTIONS}
+
+# Response:
+Respond with a JSON object that conforms to the following JSON Schema, with one entry per filename: {BatchAssetGraph.model_json_schema()}
+
+# CLI Outputs to analyze:
+"""
+  for filename, content in contents.items():
+    prompt += f'\n## {filename}\n{content}\n'
+  return prompt
+
+
 @dataclass(kw_only=True)
 class AssetGraphListener(ListenerQueue[FileMetadata]):
   investigation: Investigation
   client: Any
+  outputs: Tuple[str, ...] = ('assets',)
+
+  def message_tokens(self, fm: FileMetadata) -> int:
+    return self.investigation.estimate_tokens(fm)
 
   async def process(self, fm: FileMetadata):
     if not fm.filename.startswith('aws_cli_output'):
       return
 
-    filepath = self.investigation.dir / fm.filename
-    with open(filepath, 'r') as f:
-      content = f.read()
+    content = await self.investigation.load_text(fm)
 
     try:
       asset_graph = await oneshot_conv(self.client, [usermsg(prompt(self.investigation, content))], model='o3-mini')
       asset_graph = AssetGraph.model_validate_json(asset_graph or '')
     except Exception as e:
-      print(f'Error extracting asset graph: {e}')
-      return
+      raise RuntimeError(f'Error extracting asset graph: {e}') from e
+
+    self.investigation.add_assets(asset_graph, fm.reason_created)
+
+  async def process_batch(self, fms: List[FileMetadata]) -> List[FileMetadata]:
+    fms = [fm for fm in fms if fm.filename.startswith('aws_cli_output')]
+    if len(fms) <= 1:
+      return await super().process_batch(fms)
+
+    contents = {fm.filename: await self.investigation.load_text(fm) for fm in fms}
+
+    try:
+      batch = await oneshot_conv(self.client, [usermsg(batch_prompt(self.investigation, contents))], model='o3-mini')
+      batch = BatchAssetGraph.model_validate_json(batch or '')
+    except Exception as e:
+      print(f'Error extracting asset graph from batch, falling back to one file at a time: {e}')
+      return await super().process_batch(fms)
+
+    reasons = {fm.filename: fm.reason_created for fm in fms}
+    answered = set()
+    for file_graph in batch.graphs:
+      if file_graph.filename in contents:
+        answered.add(file_graph.filename)
+        self.investigation.add_assets(file_graph.graph, reasons[file_graph.filename])
 
-    self.investigation.assets.update(asset_graph)
-    self.investigation._save_master_index()
+    # Files the model left out of its response get their own call rather than being dropped.
+    return await super().process_batch([fm for fm in fms if fm.filename not in answered])
@@ -1,10 +1,12 @@
 import json
-from dataclasses import dataclass
-from typing import Any
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
 
+import numpy as np
 from pydantic import BaseModel, Field
 
 from alxai.listener_queue import ListenerQueue
+from alxai.openai.client import count_tokens
 from alxai.openai.conv import structured_oneshot
 from alxai.openai.convclass import usermsg
 from investigation.investigation import FileMetadata, Investigation
@@ -14,7 +16,16 @@ class FactualStatements(BaseModel):
   statements: list[str] = Field(description='A list of factual statements about the account being inspected.')
 
 
-def prompt(investigation: Investigation, content: str) -> str:
+class FileFactualStatements(BaseModel):
+  filename: str = Field(description='The filename of the AWS cli output the statements were extracted from.')
+  statements: list[str] = Field(description='A list of factual statements about the account being inspected.')
+
+
+class BatchFactualStatements(BaseModel):
+  files: list[FileFactualStatements] = Field(description='The factual statements extracted from each AWS cli output, one entry per file.')
+
+
+def instructions(investigation: Investigation, response_format: type[BaseModel], content: str) -> str:
   prompt = f"""# Goal
 Your goal is to summarize the information contained in the output of the AWS cli tool into a set of factual statements about the account being inspected.
 
@@ -29,12 +40,24 @@ Your goal is to summarize the information contained in the output of the AWS cli
 - do not use relative references e.g. "the query" is bad "the ec2 describe-instances query" is good.
 
 # Response
-Respond with a JSON object that conforms to the JSON schema {json.dumps(FactualStatements.model_json_schema(), indent=2)}.
+Respond with a JSON object that conforms to the JSON schema {json.dumps(response_format.model_json_schema(), indent=2)}.
 """
-  if investigation.facts:
-    prompt += f'\n# Facts so far\n{["- " + fact for fact in sorted(investigation.facts)]}'
+  # Only the facts about what is being analyzed, so the prompt doesn't grow with every file gathered.
+  facts = investigation.fact_store.relevant(content)
+  if facts:
+    prompt += f'\n# Facts so far\n{["- " + fact for fact in sorted(facts)]}'
+  return prompt
+
+
+def prompt(investigation: Investigation, content: str) -> str:
+  return instructions(investigation, FactualStatements, content) + f'\n# AWS cli output to analyze:\n{content}'
+
 
-  prompt += f'\n# AWS cli output to analyze:\n{content}'
+def batch_prompt(investigation: Investigation, contents: Dict[str, str]) -> str:
+  prompt = instructions(investigation, BatchFactualStatements, '\n'.join(contents.values()))
+  prompt += '\n# AWS cli outputs to analyze (respond with one entry per filename):\n'
+  for filename, content in contents.items():
+    prompt += f'\n## {filename}\n{content}\n'
   return prompt
 
 
@@ -42,20 +65,58 @@ Respond with a JSON object that conforms to the JSON schema {json.dumps(FactualS
 class ExtractFactsListener(ListenerQueue[FileMetadata]):
   investigation: Investigation
   client: Any
+  outputs: Tuple[str, ...] = ('facts',)
+  # (files gathered, prompt tokens) per extraction call
+  prompt_sizes: List[Tuple[int, int]] = field(default_factory=list)
+
+  def message_tokens(self, fm: FileMetadata) -> int:
+    return self.investigation.estimate_tokens(fm)
+
+  def _measure(self, prompt: str) -> str:
+    self.prompt_sizes.append((len(self.investigation.files), count_tokens(prompt)))
+    return prompt
+
+  def report(self) -> str:
+    report = super().report()
+    if len({files for files, _ in self.prompt_sizes}) > 1:
+      files, tokens = zip(*self.prompt_sizes)
+      growth = np.polyfit(files, tokens, 1)[0]
+      report += f' facts={len(self.investigation.facts)} duplicates dropped={self.investigation.fact_store.duplicates} prompt growth={growth:.0f} tokens/file'
+    return report
 
   async def process(self, fm: FileMetadata):
     if not fm.filename.startswith('aws_cli_output'):
       return
 
-    filepath = self.investigation.dir / fm.filename
-    with open(filepath, 'r') as f:
-      content = f.read()
+    content = await self.investigation.load_text(fm)
 
     try:
-      facts = await structured_oneshot(self.client, [usermsg(prompt(self.investigation, content))], model='o3-mini', response_format=FactualStatements)
+      facts = await structured_oneshot(self.client, [usermsg(self._measure(prompt(self.investigation, content)))], model='o3-mini', response_format=FactualStatements)
     except Exception as e:
-      print(f'Error extracting facts: {e}')
-      return
+      # Raised so the queue counts the failure and the stage isn't checkpointed as done.
+      raise RuntimeError(f'Error extracting facts: {e}') from e
+
+    self.investigation.add_facts(facts.statements, fm.reason_created)
+
+  async def process_batch(self, fms: List[FileMetadata]) -> List[FileMetadata]:
+    fms = [fm for fm in fms if fm.filename.startswith('aws_cli_output')]
+    if len(fms) <= 1:
+      return await super().process_batch(fms)
+
+    contents = {fm.filename: await self.investigation.load_text(fm) for fm in fms}
+
+    try:
+      batch = await structured_oneshot(self.client, [usermsg(self._measure(batch_prompt(self.investigation, contents)))], model='o3-mini', response_format=BatchFactualStatements)
+    except Exception as e:
+      print(f'Error extracting facts from batch, falling back to one file at a time: {e}')
+      return await super().process_batch(fms)
+
+    reasons = {fm.filename: fm.reason_created for fm in fms}
+    answered = set()
+    for file_facts in batch.files:
+      if file_facts.filename in contents:
+        answered.add(file_facts.filename)
+        self.investigation.add_facts(file_facts.statements, reasons[file_facts.filename])
 
-    self.investigation.facts.extend(facts.statements)
-    self.investigation._save_master_index()
+    # Files the model left out of its response get their own call rather than being dropped.
+    return await super().process_batch([fm for fm in fms if fm.filename not in answered])
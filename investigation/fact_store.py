@@ -0,0 +1,127 @@
+import hashlib
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+from alxai.openai.client import count_tokens
+from investigation.retrieval import tokenize
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+DUPLICATE_THRESHOLD = 0.8
+FACT_TOKEN_BUDGET = 3000
+MAX_FACTS = 100
+
+MERSENNE_PRIME = (1 << 61) - 1
+# Fixed seeds keep signatures stable between runs.
+PERMUTATIONS = [
+  (int.from_bytes(hashlib.sha256(f'a{i}'.encode()).digest()[:8], 'little') % MERSENNE_PRIME or 1, int.from_bytes(hashlib.sha256(f'b{i}'.encode()).digest()[:8], 'little') % MERSENNE_PRIME)
+  for i in range(NUM_PERM)
+]
+
+RESOURCE_ID_RE = re.compile(
+  r'arn:aws[\w-]*:[^\s,;()\'"]+'
+  r'|\b(?:i|sg|sgr|vpc|subnet|eni|vol|snap|ami|igw|nat|rtb|acl|eipalloc|pcx|tgw|vpce|lt|r)-[0-9a-f]{8,17}\b'
+  r'|\b\d{12}\b'
+)
+
+
+def normalize(statement: str) -> str:
+  return ' '.join(statement.split()).rstrip('.')
+
+
+def resource_ids(text: str) -> FrozenSet[str]:
+  return frozenset(RESOURCE_ID_RE.findall(text))
+
+
+def minhash(terms: List[str]) -> Tuple[int, ...]:
+  shingles = {' '.join(terms[i : i + SHINGLE_SIZE]) for i in range(max(len(terms) - SHINGLE_SIZE + 1, 1))}
+  hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'little') for s in shingles]
+  return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS)
+
+
+@dataclass(kw_only=True)
+class Fact:
+  text: str
+  terms: Set[str]
+  ids: FrozenSet[str]
+  signature: Tuple[int, ...]
+  tokens: int
+
+
+@dataclass(kw_only=True)
+class FactStore:
+  """Deduplicated facts, indexed by the resource IDs they mention.
+
+  Near duplicates are found with MinHash LSH over word shingles. Statements that mention different resources are never
+  merged, "sg-1 allows port 22" and "sg-2 allows port 22" are both kept."""
+
+  facts: List[Fact] = field(default_factory=list)
+  by_id: Dict[str, List[int]] = field(default_factory=lambda: defaultdict(list))
+  _buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = field(default_factory=lambda: defaultdict(list))
+  _exact: Set[str] = field(default_factory=set)
+  duplicates: int = 0
+
+  def _is_duplicate(self, fact: Fact) -> bool:
+    key = fact.text.lower()
+    if key in self._exact:
+      return True
+    candidates = {i for band in range(BANDS) for i in self._buckets.get((band, fact.signature[band * ROWS : (band + 1) * ROWS]), [])}
+    for i in candidates:
+      other = self.facts[i]
+      if other.ids != fact.ids:
+        continue
+      similarity = sum(a == b for a, b in zip(other.signature, fact.signature)) / NUM_PERM
+      if similarity >= DUPLICATE_THRESHOLD:
+        return True
+    return False
+
+  def add(self, statements: List[str]) -> List[str]:
+    """Index the statements and return the ones that were not duplicates."""
+    accepted = []
+    for statement in statements:
+      text = normalize(statement)
+      if not text:
+        continue
+      terms = tokenize(text)
+      fact = Fact(text=text, terms=set(terms), ids=resource_ids(text), signature=minhash(terms), tokens=count_tokens(text))
+      if self._is_duplicate(fact):
+        self.duplicates += 1
+        continue
+
+      index = len(self.facts)
+      self.facts.append(fact)
+      self._exact.add(text.lower())
+      for band in range(BANDS):
+        self._buckets[(band, fact.signature[band * ROWS : (band + 1) * ROWS])].append(index)
+      for resource_id in fact.ids:
+        self.by_id[resource_id].append(index)
+      accepted.append(text)
+    return accepted
+
+  def about(self, resource_id: str) -> List[str]:
+    return [self.facts[i].text for i in self.by_id.get(resource_id, [])]
+
+  def relevant(self, query: str, token_budget: int = FACT_TOKEN_BUDGET, max_facts: int = MAX_FACTS) -> List[str]:
+    """A bounded subset of facts for a prompt: those about resources named in the query first, then by shared terms, then the newest."""
+    query_ids = resource_ids(query)
+    query_terms = set(tokenize(query))
+
+    def score(i: int) -> Tuple[int, float, int]:
+      fact = self.facts[i]
+      shared = len(fact.terms & query_terms) / len(fact.terms) if fact.terms else 0
+      return len(fact.ids & query_ids), shared, i
+
+    selected = []
+    tokens = 0
+    for i in sorted(range(len(self.facts)), key=score, reverse=True):
+      if len(selected) >= max_facts:
+        break
+      if tokens + self.facts[i].tokens > token_budget:
+        continue
+      selected.append(i)
+      tokens += self.facts[i].tokens
+    return [self.facts[i].text for i in sorted(selected)]
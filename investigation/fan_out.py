@@ -0,0 +1,229 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import textwrap
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from alxai.base.cli import CliError
+from investigation.aws_command import is_cacheable, option_value, service_operation
+from investigation.blob_store import get_blob_store
+from investigation.command_cache import STREAM_BYTES, CommandOutput, LargeOutput, get_command_cache
+from investigation.stream_ingest import iter_top_level
+
+PER_REGION_CONCURRENCY = 4
+# Services whose api isn't regional, they only fan out across accounts.
+GLOBAL_SERVICES = {'iam', 'sts', 'organizations', 'route53', 'cloudfront', 's3', 's3api'}
+
+
+@dataclass(kw_only=True)
+class Target:
+  profile: Optional[str] = None
+  region: Optional[str] = None
+
+  def args(self, args: List[str]) -> List[str]:
+    scoped = list(args)
+    if self.profile:
+      scoped += ['--profile', self.profile]
+    if self.region:
+      scoped += ['--region', self.region]
+    return scoped
+
+
+def _tagged(item: Any, region: str, account: str) -> Dict[str, Any]:
+  if isinstance(item, dict):
+    return {'region': region, 'account': account, **item}
+  return {'region': region, 'account': account, 'value': item}
+
+
+def _tag(output: Any, region: str, account: str) -> Dict[str, List[Any]]:
+  # Items in the response's lists get region/account fields, so they become columns when the output is made a data frame.
+  # Other top-level values become one tagged item per target, so e.g. an Owner or a count isn't lost in the merge.
+  if isinstance(output, dict) and any(isinstance(value, list) for value in output.values()):
+    return {key: [_tagged(item, region, account) for item in value] if isinstance(value, list) else [_tagged(value, region, account)] for key, value in output.items()}
+  return {'Results': [_tagged(output, region, account)]}
+
+
+def merge_outputs(outputs: List[Tuple[Target, str, str]]) -> str:
+  """Merge (target, account, stdout) outputs of the same command into one, every item tagged with where it came from."""
+  try:
+    parsed = [(target, account, json.loads(stdout)) for target, account, stdout in outputs]
+  except json.JSONDecodeError:
+    return '\n'.join(f'# region={target.region or "default"} account={account}\n{stdout}' for target, account, stdout in outputs)
+
+  merged: Dict[str, List[Any]] = defaultdict(list)
+  for target, account, output in parsed:
+    for key, items in _tag(output, target.region or 'default', account).items():
+      merged[key].extend(items)
+  return json.dumps(merged, indent=2)
+
+
+def _part_keys(stream: BinaryIO) -> Optional[List[str]]:
+  """A part's top-level keys when its items can be merged one at a time, None when it is tagged whole like _tag does."""
+  keys: List[str] = []
+  has_list = False
+  for key, _, kind in iter_top_level(stream):
+    if key == '':
+      return None
+    if kind != 'item':
+      keys.append(key)
+    has_list = has_list or kind == 'list'
+  return keys if has_list else None
+
+
+def write_merged(out: BinaryIO, parts: List[Tuple[Target, str, Callable[[], BinaryIO]]]) -> None:
+  """Write what merge_outputs returns for the parts, byte for byte, reading them an item at a time instead of whole."""
+  try:
+    layouts = []
+    for _, _, open_part in parts:
+      with open_part() as stream:
+        layouts.append(_part_keys(stream))
+  except (ValueError, json.JSONDecodeError):
+    for i, (target, account, open_part) in enumerate(parts):
+      out.write(f'{chr(10) if i else ""}# region={target.region or "default"} account={account}\n'.encode())
+      with open_part() as stream:
+        shutil.copyfileobj(stream, out)
+    return
+
+  keys = list(dict.fromkeys(key for layout in layouts for key in (layout if layout is not None else ['Results'])))
+  out.write(b'{')
+  for i, key in enumerate(keys):
+    out.write(f'{"," if i else ""}\n  {json.dumps(key)}: ['.encode())
+    written = 0
+    for (target, account, open_part), layout in zip(parts, layouts, strict=True):
+      if (layout is None and key != 'Results') or (layout is not None and key not in layout):
+        continue
+      with open_part() as stream:
+        if layout is None:
+          items: Iterator[Any] = iter([json.load(stream)])
+        else:
+          items = (value for part_key, value, kind in iter_top_level(stream) if part_key == key and kind != 'list')
+        for item in items:
+          # Indented the way json.dumps(merged, indent=2) indents an item two levels down.
+          out.write(f'{"," if written else ""}\n{textwrap.indent(json.dumps(_tagged(item, target.region or "default", account), indent=2), "    ")}'.encode())
+          written += 1
+    out.write(b'\n  ]' if written else b']')
+  out.write(b'\n}' if keys else b'}')
+
+
+async def merge_large_outputs(outputs: List[Tuple[Target, str, CommandOutput]]) -> LargeOutput:
+  """merge_outputs for outputs too large to merge in memory, written to a file and stored in the blob store."""
+  blobs = get_blob_store()
+
+  def opener(stdout: CommandOutput) -> Callable[[], BinaryIO]:
+    if isinstance(stdout, LargeOutput):
+      return lambda: blobs.open_stream(stdout.digest)
+    return lambda: io.BytesIO(stdout.encode())
+
+  fd, path = tempfile.mkstemp(prefix='fan_out_', suffix='.json')
+  try:
+    with os.fdopen(fd, 'wb') as out:
+      await asyncio.to_thread(write_merged, out, [(target, account, opener(stdout)) for target, account, stdout in outputs])
+    return LargeOutput(digest=await blobs.put_file(Path(path)), size=os.path.getsize(path))
+  finally:
+    os.unlink(path)
+
+
+@dataclass(kw_only=True)
+class FanOut:
+  """Expands a read-only aws command that doesn't name a region or profile across the configured ones."""
+
+  regions: List[str] = field(default_factory=list)
+  profiles: List[str] = field(default_factory=list)
+  per_region_concurrency: int = PER_REGION_CONCURRENCY
+  commands: int = 0
+  runs: int = 0
+  failures: int = 0
+  _semaphores: Dict[str, asyncio.Semaphore] = field(default_factory=dict)
+  _accounts: Dict[Optional[str], str] = field(default_factory=dict)
+
+  def targets(self, args: List[str]) -> List[Target]:
+    if not is_cacheable(args):
+      return []
+    regional = service_operation(args)[0] not in GLOBAL_SERVICES
+    regions = self.regions if regional and option_value(args, '--region') is None else []
+    profiles = self.profiles if option_value(args, '--profile') is None else []
+    targets = [Target(profile=profile, region=region) for profile in profiles or [None] for region in regions or [None]]
+    return targets if len(targets) > 1 else []
+
+  def applies(self, args: List[str]) -> bool:
+    return bool(self.targets(args))
+
+  def describe(self) -> str:
+    """A note for the gather prompt, so it doesn't ask for each region or account in its own turn."""
+    lines = []
+    if self.regions:
+      lines.append(f"- Read-only commands without --region are run in each of these regions: {', '.join(self.regions)}. Don't repeat a command per region.")
+    if self.profiles:
+      lines.append(f"- Read-only commands without --profile are run in each of these profiles: {', '.join(self.profiles)}. Don't repeat a command per profile.")
+    if lines:
+      lines.append('- The results of those commands are merged, every item tagged with "region" and "account".')
+    return '\n'.join(lines)
+
+  async def account(self, profile: Optional[str]) -> str:
+    if profile not in self._accounts:
+      try:
+        stdout, _ = await get_command_cache().run(Target(profile=profile).args(['aws', 'sts', 'get-caller-identity', '--output', 'json']))
+        self._accounts[profile] = json.loads(stdout)['Account']
+      except (CliError, json.JSONDecodeError, KeyError):
+        self._accounts[profile] = profile or 'default'
+    return self._accounts[profile]
+
+  async def _run(self, target: Target, args: List[str], bypass: bool) -> Tuple[CommandOutput, bool]:
+    region = target.region or 'default'
+    if region not in self._semaphores:
+      self._semaphores[region] = asyncio.Semaphore(self.per_region_concurrency)
+    # Throttled per region, that's the scope of most aws api rate limits.
+    async with self._semaphores[region]:
+      return await get_command_cache().run_streamed(target.args(args), bypass)
+
+  async def run(self, args: List[str], bypass: bool = False) -> Tuple[CommandOutput, bool]:
+    """Run args in every target, returning the merged output and whether every part came from the command cache.
+
+    Targets that fail (e.g. regions that aren't enabled) are left out, it only fails when all of them do."""
+    targets = self.targets(args)
+    self.commands += 1
+    self.runs += len(targets)
+    results = await asyncio.gather(*[self._run(target, args, bypass) for target in targets], return_exceptions=True)
+    accounts = await asyncio.gather(*[self.account(target.profile) for target in targets])
+
+    outputs = []
+    errors = []
+    for target, account, result in zip(targets, accounts, results, strict=True):
+      if isinstance(result, CliError):
+        errors.append(f'region={target.region or "default"} account={account}: {result}')
+      elif isinstance(result, BaseException):
+        raise result
+      else:
+        outputs.append((target, account, result[0]))
+    self.failures += len(errors)
+    for error in errors:
+      print(f'⚠️ {" ".join(args)} failed in {error}')
+    if not outputs:
+      raise CliError(f'failed in every region and account: {"; ".join(errors)}')
+
+    print(f'🌐 Fanned out {" ".join(args)} to {len(targets)} regions/accounts')
+    cache_hit = all(result[1] for result in results if not isinstance(result, BaseException))
+    if sum(stdout.size if isinstance(stdout, LargeOutput) else len(stdout) for _, _, stdout in outputs) > STREAM_BYTES:
+      return await merge_large_outputs(outputs), cache_hit
+    return merge_outputs([(target, account, stdout) for target, account, stdout in outputs if isinstance(stdout, str)]), cache_hit
+
+  def report(self) -> str:
+    return f'fan out: {self.commands} commands run {self.runs} times across {len(self.regions) or 1} regions and {len(self.profiles) or 1} profiles, {self.failures} failed'
+
+
+_fan_out: FanOut | None = None
+
+
+def get_fan_out() -> FanOut | None:
+  return _fan_out
+
+
+def set_fan_out(fan_out: FanOut | None) -> None:
+  global _fan_out
+  _fan_out = fan_out
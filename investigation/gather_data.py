@@ -1,23 +1,84 @@
+import asyncio
 import json
+import tempfile
+import time
 import uuid
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Self, Set, Tuple
 
 from pydantic import BaseModel, Field
 
-from alxai.base.cli import CliError, run_cli
-from alxai.openai.client import count_tokens
+from alxai.base.cli import CliError
 from alxai.openai.conv import oneshot_conv
 from alxai.openai.convclass import ConvClass, usermsg
+from investigation.command_cache import CommandOutput, LargeOutput, get_command_cache
+from investigation.fan_out import get_fan_out
 from investigation.investigation import Investigation, InvestigationConv
-from investigation.json_to_parquet import extract_dataframes_from_json
+from investigation.json_to_parquet import extract_tables_from_json
+from investigation.stream_ingest import estimate_tokens, first_record, stream_to_parquet
 from investigation.summarize_as_html import save_investigation_html
+from investigation.summarize_json import find_id_key
 
 
 class AWSCliToolArguments(BaseModel):
   command_arguments: List[str] = Field(description='A single AWS CLI command to run including the command name and any arguments. Do not quote the arguments. e.g. ["aws", "s3", "ls"].')
 
 
+class PlannedCommand(BaseModel):
+  id: str = Field(description='A short unique id for this command, e.g. "1".')
+  command_arguments: List[str] = Field(description='A single AWS CLI command to run including the command name and any arguments. Do not quote the arguments. e.g. ["aws", "s3", "ls"].')
+  depends_on: List[str] = Field(default_factory=list, description='Ids of commands in this batch that must finish before this one runs.')
+
+
+class CommandPlan(BaseModel):
+  commands: List[PlannedCommand] = Field(description='A small batch of AWS CLI commands to run next, at most 5.')
+
+
+PLAN_CONCURRENCY = 4
+
+
+@dataclass(kw_only=True)
+class StepTiming:
+  commands: int
+  llm: float
+  cli: float
+  store: float
+
+  @property
+  def total(self) -> float:
+    return self.llm + self.cli + self.store
+
+
+step_timings: List[StepTiming] = []
+
+
+def step_report() -> str:
+  if not step_timings:
+    return 'no gather steps'
+  n = len(step_timings)
+  commands = sum(t.commands for t in step_timings)
+  return (
+    f'{n} gather steps ran {commands} commands, wall time per step avg={sum(t.total for t in step_timings) / n:.2f}s '
+    f'(llm={sum(t.llm for t in step_timings) / n:.2f}s cli={sum(t.cli for t in step_timings) / n:.2f}s store={sum(t.store for t in step_timings) / n:.2f}s) '
+    f'total={sum(t.total for t in step_timings):.2f}s'
+  )
+
+
+def plan_waves(commands: List[PlannedCommand]) -> List[List[PlannedCommand]]:
+  """Group commands into waves that only depend on earlier waves. Unknown ids are ignored and a cycle runs as one wave."""
+  ids = {c.id for c in commands}
+  finished: Set[str] = set()
+  remaining = list(commands)
+  waves = []
+  while remaining:
+    wave = [c for c in remaining if all(d in finished or d not in ids for d in c.depends_on)] or remaining
+    waves.append(wave)
+    finished.update(c.id for c in wave)
+    remaining = [c for c in remaining if c.id not in finished]
+  return waves
+
+
 async def get_primary_id_key(client, data: Dict) -> str:
   result = await oneshot_conv(
     client, [usermsg(f'What is the primary id key for the provided data. respond only with a single string containing the exact key used, nothing else. Data: {json.dumps(data)}')], model='o3-mini'
@@ -26,6 +87,12 @@ async def get_primary_id_key(client, data: Dict) -> str:
   return result
 
 
+def fan_out_note() -> str:
+  fan_out = get_fan_out()
+  note = fan_out.describe() if fan_out else ''
+  return f'{note}\n' if note else ''
+
+
 def prompt(investigation: Investigation) -> str:
   prompt = f"""# Goal
 You are a cyber security, devops and infrastructure expert who focuses on conducting investigations into cloud infrastructure environments. You are tasked with proposing AWS cli commands one by one to run (no bash scripting allowed) that will gather additional information to help answer the following question: "{investigation.prompt}"
@@ -37,34 +104,111 @@ You are a cyber security, devops and infrastructure expert who focuses on conduc
 - The command should be a single call to the "aws" cli tool.
 - prefer "--output json" over "--output text"
 - Some commands require ARNs, make sure to suggest commands that will find ARNs before commands that need to use them.
-
+{fan_out_note()}
 As an example:
 aws securityhub get-findings --filters '{{"CreatedAt":[{{"DateRange":{{"Value":10,"Unit":"DAYS"}}}}],"SeverityLabel":[{{"Value":"CRITICAL","Comparison":"EQUALS"}}]' --output json
 
 # Response
 Respond with a JSON object that conforms to the JSON schema {json.dumps(AWSCliToolArguments.model_json_schema(), indent=2)}.
 """
-  if investigation.files:
-    prompt += f'\n# Commands run so far\n{investigation.summarize_files()}'
+  return prompt + investigation.prompt_context()
+
 
-  if investigation.data_frames:
-    prompt += f'\n# Data Frames acquired so far\n{investigation.summarize_data_frames()}'
+def plan_prompt(investigation: Investigation) -> str:
+  prompt = f"""# Goal
+You are a cyber security, devops and infrastructure expert who focuses on conducting investigations into cloud infrastructure environments. You are tasked with proposing a small batch of AWS cli commands to run (no bash scripting allowed) that will gather additional information to help answer the following question: "{investigation.prompt}"
+
+# Approach
+- Propose up to 5 commands that can be run now, the results of all of them will be shown to you together.
+- Each command should do one very specific thing, do not try to merge tasks.
+- Only propose commands whose arguments you already know. If a command needs IDs or ARNs from the output of another command, propose it in a later batch.
+- Use depends_on only when a command must run after another one in the same batch, independent commands run concurrently.
+- Each command should be a single call to the "aws" cli tool.
+- prefer "--output json" over "--output text"
+{fan_out_note()}
+# Response
+Respond with a JSON object that conforms to the JSON schema {json.dumps(CommandPlan.model_json_schema(), indent=2)}.
+"""
+  return prompt + investigation.prompt_context()
 
-  if len(investigation.assets.nodes) > 0:
-    prompt += f'\n# Asset Graph:\n{investigation.assets.to_gml()}'
 
-  return prompt
+async def run_aws(investigation: Investigation, args: List[str], bypass: bool = False, prefetch: bool = True) -> Tuple[CommandOutput, bool]:
+  """Run an aws cli command, using its prefetched or cached output when there is one unless bypass, and prefetch its likely follow-ups.
+
+  Returns the output and whether it came from the command cache. prefetch=False leaves the follow-ups alone."""
+  fan_out = get_fan_out()
+  if fan_out and fan_out.applies(args):
+    # Follow-ups of a merged output would need to be split by region and account again, so they aren't prefetched.
+    return await fan_out.run(args, bypass)
+  stdout: CommandOutput | None = None if bypass else await investigation.prefetcher.fetch(args)
+  cache_hit = False
+  if stdout is None:
+    stdout, cache_hit = await get_command_cache().run_streamed(args, bypass)
+  if prefetch and isinstance(stdout, str):
+    investigation.prefetcher.observe(args, stdout)
+  return stdout, cache_hit
+
+
+async def add_large_cli_output(client, investigation: Investigation, args: List[str], output: LargeOutput, file_prefix: str, reason: str, cache_hit: bool = False):
+  """Stream an output too large to load from the blob store into parquet data frames, a batch of records at a time."""
+
+  def open_stream():
+    return investigation.blobs.open_stream(output.digest)
+
+  first = await asyncio.to_thread(first_record, open_stream)
+  fallback_id_key = None
+  if first and isinstance(first[1], dict) and find_id_key(*first) is None:
+    fallback_id_key = await get_primary_id_key(client, first[1])
+
+  with tempfile.TemporaryDirectory() as out_dir:
+    paths = await asyncio.to_thread(stream_to_parquet, open_stream, Path(out_dir), file_prefix, lambda collection, record: find_id_key(collection, record) or fallback_id_key)
+    for name, path in paths.items():
+      await investigation.add_parquet_file(path, f'{file_prefix}_{name}', reason, command_args=args, source_digest=output.digest, cache_hit=cache_hit)
+
+
+async def add_cli_output(client, investigation: Investigation, args: List[str], stdout: CommandOutput, model: str = 'o3-mini', cache_hit: bool = False) -> bool:
+  """Store a command's output as a file, or as data frames when it is too large for a prompt. Returns whether it was stored as a file."""
+  tool_id = uuid.uuid4()
+  file_prefix = f'aws_cli_output_{tool_id}'
+  reason = f'AWS CLI output for: {" ".join(args)}'
+  if isinstance(stdout, LargeOutput):
+    await add_large_cli_output(client, investigation, args, stdout, file_prefix, reason, cache_hit)
+    return False
+
+  if estimate_tokens(stdout, model) > 10000:
+    # The raw output is kept so a later re-run can tell whether it changed.
+    source_digest = await investigation.blobs.put(stdout.encode())
+    tables = await extract_tables_from_json(json.loads(stdout), file_prefix, lambda data: get_primary_id_key(client, data))
+    for name, table in tables.items():
+      await investigation.add_table(table, f'{file_prefix}_{name}', reason, command_args=args, source_digest=source_digest, cache_hit=cache_hit)
+    # An output without any lists has no rows to make a table of, it is stored as it is.
+    if tables:
+      return False
+
+  await investigation.add_file(client, stdout, file_prefix, reason, command_args=args, cache_hit=cache_hit)
+  return True
 
 
 @dataclass(kw_only=True)
 class GatherData(InvestigationConv):
   failure_count: int = 0
+  step_started: float = field(default_factory=time.monotonic)
+
+  def respond(self, msg: str) -> Self:
+    nc = super().respond(msg)
+    # Checkpoint every turn so a resumed investigation picks the conversation up where it stopped.
+    self.investigation.set_conversation([dict(m) for m in nc.messages])
+    nc.step_started = time.monotonic()
+    return nc
 
   async def response(self, msg: AWSCliToolArguments) -> Optional['ConvClass']:
     args = msg.command_arguments
+    llm = time.monotonic() - self.step_started
+    cli_start = time.monotonic()
     try:
-      stdout, _ = await run_cli(args, expect_first_arg='aws')
+      stdout, cache_hit = await run_aws(self.investigation, args)
     except CliError as e:
+      step_timings.append(StepTiming(commands=1, llm=llm, cli=time.monotonic() - cli_start, store=0))
       self.failure_count += 1
 
       if self.failure_count > 1:
@@ -76,15 +220,10 @@ class GatherData(InvestigationConv):
 Please Fix the command and try again. Respond with a JSON object that conforms to the JSON schema {AWSCliToolArguments.model_json_schema()} No documentation or additional commentary. If the command failed because you didn't provide an ARN then it is likely you should run a different command that would find suitable ARNs."""
       )
 
-    tool_id = uuid.uuid4()
-    file_prefix = f'aws_cli_output_{tool_id}'
-    if count_tokens(stdout, self.model) > 10000:
-      dfs = await extract_dataframes_from_json(json.loads(stdout), file_prefix, lambda data: get_primary_id_key(self.client, data))
-      for name, df in dfs.items():
-        await self.investigation.add_data_frame(self.client, df, f'{file_prefix}_{name}', f'AWS CLI output for: {" ".join(args)}')
-    else:
-      await self.investigation.add_file(self.client, stdout, file_prefix, f'AWS CLI output for: {" ".join(args)}')
-
+    store_start = time.monotonic()
+    stored_as_file = await add_cli_output(self.client, self.investigation, args, stdout, self.model or 'o3-mini', cache_hit)
+    step_timings.append(StepTiming(commands=1, llm=llm, cli=store_start - cli_start, store=time.monotonic() - store_start))
+    if stored_as_file:
       output_path = self.investigation.dir / 'index.html'
       save_investigation_html(self.investigation, output_path)
 
@@ -97,5 +236,89 @@ Please Fix the command and try again. Respond with a JSON object that conforms t
       )
 
 
-async def gather_data(client, investigation: Investigation):
-  await GatherData(client=client, messages=[usermsg(prompt(investigation))], investigation=investigation, model='o3-mini', response_format=AWSCliToolArguments).run()
+@dataclass(kw_only=True)
+class GatherPlan(GatherData):
+  """Asks for a dependency-annotated batch of commands per round trip and runs independent ones concurrently."""
+
+  async def _run_command(self, command: PlannedCommand, semaphore: asyncio.Semaphore) -> Tuple[CommandOutput, bool] | CliError:
+    async with semaphore:
+      try:
+        return await run_aws(self.investigation, command.command_arguments)
+      except CliError as e:
+        return e
+
+  async def _store(self, command: PlannedCommand, stdout: CommandOutput, cache_hit: bool) -> str:
+    # Only outputs held as a string are ever stored as a file.
+    if await add_cli_output(self.client, self.investigation, command.command_arguments, stdout, self.model or 'o3-mini', cache_hit) and isinstance(stdout, str):
+      return f'# command succeeded with output:\n{stdout}'
+    return '# command succeeded, its output was too large to show and was stored as data frames'
+
+  async def response(self, msg: CommandPlan) -> Optional['ConvClass']:  # type: ignore[override]
+    llm = time.monotonic() - self.step_started
+    semaphore = asyncio.Semaphore(PLAN_CONCURRENCY)
+    results: Dict[str, str] = {}
+    failed: Set[str] = set()
+    cli = 0.0
+    store = 0.0
+
+    for wave in plan_waves(msg.commands):
+      runnable = []
+      for command in wave:
+        blocked = [d for d in command.depends_on if d in failed]
+        if blocked:
+          failed.add(command.id)
+          results[command.id] = f'# skipped because {", ".join(blocked)} failed'
+        else:
+          runnable.append(command)
+
+      start = time.monotonic()
+      outputs = await asyncio.gather(*[self._run_command(command, semaphore) for command in runnable])
+      cli += time.monotonic() - start
+
+      start = time.monotonic()
+      succeeded = [(command, output) for command, output in zip(runnable, outputs) if not isinstance(output, CliError)]
+      stored = await asyncio.gather(*[self._store(command, stdout, cache_hit) for command, (stdout, cache_hit) in succeeded])
+      store += time.monotonic() - start
+
+      for command, output in zip(runnable, outputs):
+        if isinstance(output, CliError):
+          failed.add(command.id)
+          results[command.id] = f'# Error\n{output}'
+      for (command, _), result in zip(succeeded, stored):
+        results[command.id] = result
+
+    step_timings.append(StepTiming(commands=len(msg.commands), llm=llm, cli=cli, store=store))
+    save_investigation_html(self.investigation, self.investigation.dir / 'index.html')
+
+    if msg.commands and len(failed) == len(msg.commands):
+      self.failure_count += 1
+      if self.failure_count > 1:
+        raise RuntimeError('Every command in the last two batches failed')
+
+    if self.investigation.done.is_set():
+      return None
+
+    sections = [f'## {" ".join(command.command_arguments)}\n{results[command.id]}' for command in msg.commands]
+    return self.respond(
+      '\n\n'.join(sections)
+      + "\n\nPropose the next batch. Fix any failed commands, if a command failed because you didn't provide an ARN then it is likely you should run a different "
+      + f'command that would find suitable ARNs. Respond with a JSON object that conforms to the JSON schema {CommandPlan.model_json_schema()}'
+    )
+
+
+async def gather_data(client, investigation: Investigation, batch: bool = False):
+  await investigation.summary_ready()
+  # A resumed investigation continues the conversation it was interrupted in.
+  if batch:
+    messages = investigation.conversation or [usermsg(plan_prompt(investigation))]
+    conv = GatherPlan(client=client, messages=messages, investigation=investigation, model='o3-mini', response_format=CommandPlan, priority='critical')  # type: ignore
+  else:
+    messages = investigation.conversation or [usermsg(prompt(investigation))]
+    conv = GatherData(client=client, messages=messages, investigation=investigation, model='o3-mini', response_format=AWSCliToolArguments, priority='critical')  # type: ignore
+  try:
+    await conv.run()
+  except RuntimeError:
+    # The conversation gave up, the next one starts fresh. Any other error leaves it checkpointed for --resume.
+    investigation.set_conversation([])
+    raise
+  investigation.set_conversation([])
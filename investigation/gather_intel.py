@@ -27,16 +27,7 @@ You are a cyber security, devops and infrastructure expert who focuses on conduc
 # Response
 Respond with a JSON object that conforms to the JSON schema {json.dumps(SearchQuery.model_json_schema(), indent=2)}.
 """
-  if investigation.files:
-    prompt += f'\n# Commands run so far\n{investigation.summarize_files()}'
-
-  if investigation.data_frames:
-    prompt += f'\n# Data Frames acquired so far\n{investigation.summarize_data_frames()}'
-
-  if len(investigation.assets.nodes) > 0:
-    prompt += f'\n# Asset Graph:\n{investigation.assets.to_gml()}'
-
-  return prompt
+  return prompt + investigation.prompt_context()
 
 
 @dataclass(kw_only=True)
@@ -58,4 +49,5 @@ class GatherIntel(InvestigationConv):
 
 
 async def gather_intel(client, investigation: Investigation):
+  await investigation.summary_ready()
   await GatherIntel(client=client, messages=[usermsg(prompt(investigation))], investigation=investigation, model='o3-mini', response_format=SearchQuery).run()
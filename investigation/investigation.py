@@ -1,21 +1,34 @@
 import asyncio
 import datetime
+import io
 import json
 import os
 import random
 import string
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Self
+from typing import Any, Dict, List, Optional, Self, Set
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pydantic import BaseModel, ConfigDict, Field
 
 from alxai.json import json_dumps
+from alxai.listener_dag import ListenerDag
 from alxai.listener_queue import ListenerQueue
 from alxai.openai.conv import oneshot_conv, usermsg
 from alxai.openai.convclass import ConvClass
+from alxai.trace import traced
 from investigation.asset_graph import AssetGraph
+from investigation.blob_store import BlobStore, get_blob_store
+from investigation.fact_store import FACT_TOKEN_BUDGET, FactStore
+from investigation.journal import EventType, Journal, JournalEvent, atomic_write
+from investigation.map_reduce import MAP_REDUCE_TOKENS, map_reduce_summarize
+from investigation.prefetch import Prefetcher
+from investigation.prompt_sections import PromptSection
+from investigation.retrieval import TOKEN_BUDGET, RetrievalIndex
+from investigation.summarize_json import summarize_json
 
 
 class FileMetadata(BaseModel):
@@ -25,12 +38,15 @@ class FileMetadata(BaseModel):
   file_schema: Optional[Dict[str, Any]] = None
   file_summary: Optional[str] = None
   command_args: Optional[list[str]] = None
+  digest: Optional[str] = None
+  # For data frames, the raw command output they were extracted from.
+  source_digest: Optional[str] = None
+  # Whether the output came from the command cache rather than running the command for this investigation.
+  cache_hit: bool = False
 
 
-async def summarize_file(client, reason: str, filepath: Path) -> str:
-  with open(filepath, 'r') as f:
-    content = f.read()
-
+@traced('summarize_file')
+async def summarize_file(client, reason: str, content: str) -> str:
   prompt = f"""# Task: Analyze this - {reason}
 
 # Goal
@@ -47,15 +63,47 @@ async def summarize_file(client, reason: str, filepath: Path) -> str:
   return response
 
 
-async def summarize_dataframe(client, filepath: Path) -> str:
-  df = pd.read_parquet(filepath)
+def file_line(metadata: FileMetadata) -> Optional[str]:
+  if metadata.file_type == 'json':
+    return f'- {metadata.reason_created}: {metadata.file_summary}'
+  elif metadata.file_type == 'txt':
+    return f' - {metadata.reason_created}: {metadata.file_summary}'
+  return None
+
+
+def data_frame_line(metadata: FileMetadata) -> str:
+  assert metadata.file_type == 'parquet', f'Unsupported file type: {metadata.file_type}'
+  return f'- {metadata.reason_created}: {metadata.file_summary}'
+
 
+@traced('summarize_dataframe')
+async def summarize_dataframe(client, df: pd.DataFrame) -> str:
   df_summary = df.describe().to_dict()
 
   return json_dumps(df_summary)
 
 
+def summarize_parquet(source: Path | io.BytesIO) -> str:
+  """Like summarize_dataframe, but from the row group statistics, so the data is never loaded."""
+  metadata = pq.ParquetFile(source).metadata
+  summary: Dict[str, Dict[str, Any]] = {}
+  for i in range(metadata.num_row_groups):
+    row_group = metadata.row_group(i)
+    for j in range(row_group.num_columns):
+      column = row_group.column(j)
+      stats = summary.setdefault(column.path_in_schema, {'count': 0})
+      if column.statistics is None:
+        continue
+      stats['count'] += column.statistics.num_values
+      if column.statistics.has_min_max:
+        stats['min'] = min(stats.get('min', column.statistics.min), column.statistics.min)
+        stats['max'] = max(stats.get('max', column.statistics.max), column.statistics.max)
+  return json_dumps(summary)
+
+
 OUTPUT_DIR = Path('output/investigations')
+MASTER_INDEX = 'master_index.json'
+JOURNAL = 'journal.jsonl'
 
 
 class Investigation(BaseModel):
@@ -71,14 +119,65 @@ class Investigation(BaseModel):
   client: Any = Field(exclude=True, default=None)
   listeners: List[ListenerQueue] = Field(default_factory=list, exclude=True)
   listener_tasks: List[asyncio.Task] = Field(default_factory=list, exclude=True)
+  dag: ListenerDag[FileMetadata] = Field(default_factory=lambda: ListenerDag(key=lambda fm: fm.filename), exclude=True)
   assets: AssetGraph = Field(default_factory=lambda: AssetGraph(nodes={}, edges={}))
   facts: List[str] = Field(default_factory=list)
+  # Where each fact came from, e.g. the command whose output it was extracted from.
+  fact_sources: Dict[str, str] = Field(default_factory=dict)
+  # The part of the asset graph each source contributed, so a re-run can carry over only what unchanged outputs found.
+  asset_sources: Dict[str, AssetGraph] = Field(default_factory=dict)
+  journal_seq: int = 0
+  conversation: List[Dict[str, Any]] = Field(default_factory=list)
+  listener_progress: Dict[str, List[str]] = Field(default_factory=dict)
+  completed: bool = False
+  changes: List[str] = Field(default_factory=list)
+  journal: Journal | None = Field(default=None, exclude=True)
+  blobs: BlobStore = Field(default_factory=get_blob_store, exclude=True)
+  summary_tasks: Set[asyncio.Task] = Field(default_factory=set, exclude=True)
+  summary_counts: Dict[str, int] = Field(default_factory=lambda: {'deterministic': 0, 'llm': 0}, exclude=True)
+  snapshot_every: int = Field(default=100, exclude=True)
+  events_since_snapshot: int = Field(default=0, exclude=True)
+  retrieval: RetrievalIndex = Field(default_factory=RetrievalIndex, exclude=True)
+  fact_store: FactStore = Field(default_factory=FactStore, exclude=True)
+  file_section: PromptSection = Field(default_factory=PromptSection, exclude=True)
+  data_frame_section: PromptSection = Field(default_factory=PromptSection, exclude=True)
+  fact_section: PromptSection = Field(default_factory=PromptSection, exclude=True)
+  context_version: tuple = Field(default=(), exclude=True)
+  context: str = Field(default='', exclude=True)
+  prefetcher: Prefetcher = Field(default_factory=Prefetcher, exclude=True)
+
+  def model_post_init(self, __context: Any):
+    self.dag.on_stage_complete = self._stage_completed
+    for metadata in self.files.values():
+      self.file_section.set(metadata.filename, file_line(metadata))
+    for name, metadata in self.data_frames.items():
+      self.data_frame_section.set(name, data_frame_line(metadata))
+    for i, fact in enumerate(self.facts):
+      self.fact_section.set(str(i), f'- {fact}')
 
   @classmethod
   def create(cls, prompt: str, client: Any = None) -> Self:
     investigation = cls(prompt=prompt, client=client)
     investigation._create_random_directory()
-    investigation._save_master_index()
+    investigation.journal = Journal(path=investigation.dir / JOURNAL)
+    investigation.save_snapshot()
+    return investigation
+
+  @classmethod
+  def load(cls, dir: Path, client: Any = None) -> Self:
+    """Load the master_index.json snapshot and replay any journal events recorded after it."""
+    with open(dir / MASTER_INDEX, 'r') as f:
+      investigation = cls.model_validate_json(f.read(), strict=False)
+    investigation.dir = dir
+    investigation.client = client
+    investigation.journal = Journal(path=dir / JOURNAL)
+    investigation.fact_store.add(investigation.facts)
+
+    for event in investigation.journal.read():
+      if event.seq > investigation.journal_seq:
+        investigation._apply(event)
+        investigation.journal_seq = event.seq
+        investigation.events_since_snapshot += 1
     return investigation
 
   def _create_random_directory(self):
@@ -90,38 +189,183 @@ class Investigation(BaseModel):
     self.dir = OUTPUT_DIR / dir_name
     os.makedirs(self.dir, exist_ok=True)
 
-  def _save_master_index(self):
-    master_index_path = self.dir / 'master_index.json'
-    with open(master_index_path, 'w') as f:
-      f.write(self.model_dump_json(indent=2))
+  def save_snapshot(self):
+    # The snapshot records the last journal seq it covers, so a crash before the journal is truncated is harmless.
+    atomic_write(self.dir / MASTER_INDEX, self.model_dump_json(indent=2))
+    if self.journal:
+      self.journal.truncate()
+    self.events_since_snapshot = 0
+
+  def _record(self, event_type: EventType, data: Dict[str, Any]):
+    self.journal_seq += 1
+    if self.journal:
+      self.journal.append(JournalEvent(seq=self.journal_seq, type=event_type, data=data))
+    self.events_since_snapshot += 1
+    if self.events_since_snapshot >= self.snapshot_every:
+      self.save_snapshot()
+
+  def _apply(self, event: JournalEvent):
+    match event.type:
+      case 'file_added' | 'file_updated':
+        self._set_file(FileMetadata.model_validate(event.data))
+      case 'data_frame_added':
+        self._set_data_frame(event.data['name'], FileMetadata.model_validate(event.data['metadata']))
+      case 'facts_added':
+        self._extend_facts(self.fact_store.add(event.data['statements']), event.data.get('source'))
+      case 'graph_delta':
+        self._update_assets(AssetGraph.model_validate(event.data), event.data.get('source'))
+      case 'summary_set':
+        self.summary = event.data['summary']
+      case 'conversation_set':
+        self.conversation = event.data['messages']
+      case 'conversation_appended':
+        self.conversation.extend(event.data['messages'])
+      case 'listener_done':
+        self.listener_progress.setdefault(event.data['filename'], []).append(event.data['stage'])
+      case 'investigation_done':
+        self.completed = True
+      case 'changes_detected':
+        self.changes.extend(event.data['changes'])
+
+  def _set_file(self, metadata: FileMetadata):
+    self.files[metadata.filename] = metadata
+    self.file_section.set(metadata.filename, file_line(metadata))
+
+  def _set_data_frame(self, name: str, metadata: FileMetadata):
+    self.data_frames[name] = metadata
+    self.data_frame_section.set(name, data_frame_line(metadata))
+
+  def _extend_facts(self, facts: List[str], source: Optional[str] = None):
+    for fact in facts:
+      self.fact_section.set(str(len(self.facts)), f'- {fact}')
+      self.facts.append(fact)
+      if source:
+        self.fact_sources[fact] = source
+
+  def add_facts(self, statements: List[str], source: Optional[str] = None):
+    accepted = self.fact_store.add(statements)
+    if accepted:
+      self._extend_facts(accepted, source)
+      self._record('facts_added', {'statements': accepted, 'source': source})
+
+  def _update_assets(self, asset_graph: AssetGraph, source: Optional[str] = None):
+    self.assets.update(asset_graph)
+    if source:
+      self.asset_sources.setdefault(source, AssetGraph(nodes={}, edges={})).update(asset_graph)
+
+  def add_assets(self, asset_graph: AssetGraph, source: Optional[str] = None):
+    self._update_assets(asset_graph, source)
+    self._record('graph_delta', {**asset_graph.model_dump(), 'source': source})
+
+  def set_summary(self, summary: str):
+    self.summary = summary
+    self._record('summary_set', {'summary': summary})
+
+  def set_conversation(self, messages: List[Dict[str, Any]]):
+    """Checkpoint the gather conversation so a resumed investigation continues it."""
+    if not messages and not self.conversation:
+      return
+    if self.conversation and len(messages) > len(self.conversation) and messages[0] == self.conversation[0]:
+      new_messages = messages[len(self.conversation) :]
+      self.conversation.extend(new_messages)
+      self._record('conversation_appended', {'messages': new_messages})
+    else:
+      self.conversation = list(messages)
+      self._record('conversation_set', {'messages': self.conversation})
+
+  def _stage_completed(self, filename: str, stage: str):
+    self.listener_progress.setdefault(filename, []).append(stage)
+    self._record('listener_done', {'filename': filename, 'stage': stage})
+
+  def add_changes(self, changes: List[str]):
+    self.changes.extend(changes)
+    self._record('changes_detected', {'changes': changes})
+
+  def seed_file(self, metadata: FileMetadata):
+    """Carry over an unchanged file from a previous run, keeping its summary and without sending it to listeners."""
+    self._set_file(metadata)
+    self._record('file_added', metadata.model_dump())
+
+  def seed_data_frame(self, name: str, metadata: FileMetadata):
+    self._set_data_frame(name, metadata)
+    self._record('data_frame_added', {'name': name, 'metadata': metadata.model_dump()})
+
+  def mark_done(self):
+    if not self.completed:
+      self.completed = True
+      self._record('investigation_done', {})
+    self.done.set()
 
-  def summarize_files(self) -> str:
-    summary = []
-    for file, metadata in self.files.items():
-      if metadata.file_type == 'json':
-        summary.append(f'- {metadata.reason_created}: {metadata.file_summary}')
-      elif metadata.file_type == 'txt':
-        summary.append(f' - {metadata.reason_created}: {metadata.file_summary}')
-    return '\n'.join(summary)
+  async def resume(self):
+    """Re-queue the work a crashed run left unfinished: file summaries that never arrived and listener stages that never processed a file.
 
-  def summarize_facts(self) -> str:
-    return '\n'.join([f'- {fact}' for fact in self.facts])
+    Listeners must be added first."""
+    resumed = 0
+    for metadata in self.files.values():
+      if metadata.file_summary is None and file_line(metadata) is not None:
+        self._start_summary(self.client, metadata, await self.load_text(metadata))
+      finished = self.listener_progress.get(metadata.filename, [])
+      if any(stage not in finished for stage in self.dag.stages):
+        resumed += 1
+      await self.dag.publish(metadata, finished=finished)
+    print(f'🗄️ Resumed {self.dir} with {len(self.files)} files, {resumed} re-queued for listeners and {len(self.summary_tasks)} summaries')
 
-  def summarize_data_frames(self) -> str:
-    summary = []
-    for file, metadata in self.data_frames.items():
-      if metadata.file_type == 'parquet':
-        summary.append(f'- {metadata.reason_created}: {metadata.file_summary}')
-      else:
-        assert False, f'Unsupported file type: {metadata.file_type}'
-    return '\n'.join(summary)
+  def summarize_files(self) -> str:
+    return self.file_section.text
+
+  def estimate_tokens(self, metadata: FileMetadata) -> int:
+    # Roughly four bytes per token, good enough for sizing batches without reading the file.
+    if metadata.digest:
+      return self.blobs.size(metadata.digest) // 4
+    return os.path.getsize(self.dir / metadata.filename) // 4
+
+  def read_text(self, metadata: FileMetadata) -> str:
+    if metadata.digest:
+      return self.blobs.read_text(metadata.digest)
+    # Investigations saved before the blob store kept their files next to master_index.json.
+    with open(self.dir / metadata.filename, 'r') as f:
+      return f.read()
+
+  async def load_text(self, metadata: FileMetadata) -> str:
+    if metadata.digest:
+      return str(await self.blobs.get(metadata.digest), 'utf-8')
+    return await asyncio.to_thread(self.read_text, metadata)
+
+  def read_data_frame(self, metadata: FileMetadata) -> pd.DataFrame:
+    if metadata.digest:
+      return pq.read_table(pa.BufferReader(pa.py_buffer(self.blobs.read(metadata.digest)))).to_pandas()
+    return pd.read_parquet(self.dir / metadata.filename)
+
+  def summarize_facts(self, query: Optional[str] = None, token_budget: int = FACT_TOKEN_BUDGET) -> str:
+    """All facts, or with a query only the most relevant ones that fit in token_budget."""
+    if query is None:
+      return self.fact_section.text
+    facts = self.fact_store.relevant(query, token_budget)
+    summary = '\n'.join([f'- {fact}' for fact in facts])
+    if len(facts) < len(self.facts):
+      summary += f'\n(showing {len(facts)} of {len(self.facts)} facts)'
+    return summary
 
-  def _new_file_added(self, file: FileMetadata):
-    try:
-      for listener in self.listeners:
-        listener.queue.put_nowait(file)
-    except asyncio.QueueShutDown:
-      pass
+  def summarize_data_frames(self) -> str:
+    return self.data_frame_section.text
+
+  def prompt_context(self) -> str:
+    """The commands, data frames and asset graph sections shared by the gather prompts, rebuilt only when one of them changed."""
+    version = (self.file_section.version, self.data_frame_section.version, self.assets.version)
+    if version != self.context_version:
+      context = ''
+      if self.files:
+        context += f'\n# Commands run so far\n{self.summarize_files()}'
+      if self.data_frames:
+        context += f'\n# Data Frames acquired so far\n{self.summarize_data_frames()}'
+      if len(self.assets.nodes) > 0:
+        context += f'\n# Asset Graph:\n{self.assets.to_gml()}'
+      self.context = context
+      self.context_version = version
+    return self.context
+
+  async def _new_file_added(self, file: FileMetadata):
+    await self.dag.publish(file)
     self.new_files.set()
     self.new_files.clear()
 
@@ -131,22 +375,40 @@ class Investigation(BaseModel):
     self.new_data_frames.set()
     self.new_data_frames.clear()
 
-  def file_dump(self) -> str:
+  async def file_dump(self) -> str:
     summary = []
-    for file, metadata in self.files.items():
-      if metadata.file_type == 'json':
-        with open(self.dir / file, 'r') as f:
-          contents = json.load(f)
+    for file, metadata in list(self.files.items()):
+      if self.estimate_tokens(metadata) > MAP_REDUCE_TOKENS:
+        contents = metadata.file_summary or await self.summarize_large_file(self.client, metadata)
+        summary.append(f' * We ran the following command {metadata.reason_created}. The output was too large to include, it is summarized as: {contents}')
+      elif metadata.file_type == 'json':
+        contents = json.loads(self.read_text(metadata))
         summary.append(f' * We ran the following command {metadata.reason_created}. And got the following data: {contents}')
       elif metadata.file_type == 'txt':
-        with open(self.dir / file, 'r') as f:
-          contents = f.read()
+        contents = self.read_text(metadata)
         summary.append(f' * We ran the following command {metadata.reason_created}. And got the following data: {contents}')
       else:
         assert False, f'Unsupported file type: {metadata.file_type}'
     return '\n\n'.join(summary)
 
-  async def add_file(self, client, content: str, filename: str, reason: str = ''):
+  @traced('Investigation.relevant_context')
+  async def relevant_context(self, client, token_budget: int = TOKEN_BUDGET) -> str:
+    """The chunks of gathered files most relevant to the prompt, instead of every file in full like file_dump."""
+    for filename, metadata in list(self.files.items()):
+      if filename not in self.retrieval.filenames:
+        # Investigations loaded from disk are indexed on first use.
+        await self.retrieval.add_file(filename, await self.load_text(metadata))
+
+    # Facts name the resources found so far, so they pull in the chunks that describe them.
+    query = '\n'.join([self.prompt, *self.fact_store.relevant(self.prompt)])
+    sections = []
+    for chunk in await self.retrieval.search(query, client=client, token_budget=token_budget):
+      metadata = self.files[chunk.filename]
+      sections.append(f' * Excerpt {chunk.index + 1} of the output of the command {metadata.reason_created}:\n{chunk.text}')
+    return '\n\n'.join(sections)
+
+  @traced('Investigation.add_file')
+  async def add_file(self, client, content: str, filename: str, reason: str = '', command_args: Optional[List[str]] = None, cache_hit: bool = False):
     file_type = 'txt'
     try:
       json.loads(content)
@@ -157,33 +419,129 @@ class Investigation(BaseModel):
     print(f'🗄️ Adding file {filename} with type {file_type}')
 
     filename = f'{filename}.{file_type}'
-    filepath = self.dir / filename
-    with open(filepath, 'w') as f:
-      f.write(content)
-    metadata = FileMetadata(filename=filename, file_type=file_type, reason_created=reason, file_summary=await summarize_file(client, reason, filepath))
-    self.files[filename] = metadata
-    self._save_master_index()
-    self._new_file_added(metadata)
-
-  async def add_data_frame(self, client, content: pd.DataFrame, df_name: str, reason: str = ''):
+    digest = await self.blobs.put(content.encode())
+    metadata = FileMetadata(filename=filename, file_type=file_type, reason_created=reason, digest=digest, command_args=command_args, cache_hit=cache_hit)
+    if file_type == 'json':
+      metadata.file_summary = summarize_json(reason, content)
+    self._set_file(metadata)
+    self._record('file_added', metadata.model_dump())
+    await self.retrieval.add_file(filename, content)
+
+    if metadata.file_summary is not None:
+      self.summary_counts['deterministic'] += 1
+    else:
+      # Listeners and the next gather turn don't need the summary, so it is attached when it arrives.
+      self.summary_counts['llm'] += 1
+      self._start_summary(client, metadata, content)
+
+    await self._new_file_added(metadata)
+
+  def _start_summary(self, client, metadata: FileMetadata, content: str):
+    task = asyncio.create_task(self._summarize(client, metadata, content))
+    self.summary_tasks.add(task)
+    task.add_done_callback(self.summary_tasks.discard)
+
+  async def summarize_large_file(self, client, metadata: FileMetadata) -> str:
+    if metadata.digest:
+      buf = await self.blobs.get(metadata.digest)
+    else:
+      buf = (await self.load_text(metadata)).encode()
+    return await map_reduce_summarize(client, metadata.reason_created or '', buf)
+
+  async def _summarize(self, client, metadata: FileMetadata, content: str):
+    try:
+      if self.estimate_tokens(metadata) > MAP_REDUCE_TOKENS:
+        metadata.file_summary = await self.summarize_large_file(client, metadata)
+      else:
+        metadata.file_summary = await summarize_file(client, metadata.reason_created or '', content)
+    except Exception as e:
+      print(f'Error summarizing {metadata.filename}: {e}')
+      return
+    self._set_file(metadata)
+    self._record('file_updated', metadata.model_dump())
+
+  def summary_ratio(self) -> str:
+    total = sum(self.summary_counts.values())
+    deterministic = self.summary_counts['deterministic']
+    return f'{deterministic}/{total} file summaries were deterministic, {self.summary_counts["llm"]} needed an LLM'
+
+  async def summary_ready(self):
+    """Wait for every pending file summary, for prompts built from summarize_files()."""
+    while self.summary_tasks:
+      await asyncio.gather(*self.summary_tasks, return_exceptions=True)
+
+  @traced('Investigation.add_data_frame')
+  async def add_data_frame(self, client, content: pd.DataFrame, df_name: str, reason: str = '', command_args: Optional[List[str]] = None, source_digest: Optional[str] = None, cache_hit: bool = False):
     file_type = 'parquet'
     print(f'🗄️ Adding dataframe {df_name} with type {file_type}')
 
     filename = f'{df_name}.{file_type}'
-    filepath = self.dir / filename
-    content.to_parquet(filepath, compression='zstd')
-    metadata = FileMetadata(filename=filename, file_type=file_type, reason_created=reason, file_summary=await summarize_dataframe(client, filepath))
-    self.data_frames[df_name] = metadata
-    self._save_master_index()
+    buf = io.BytesIO()
+    await asyncio.to_thread(content.to_parquet, buf, compression='zstd')
+    # Parquet is already zstd compressed, storing it raw lets reads memory-map it.
+    digest = await self.blobs.put(buf.getvalue(), compress=False)
+    metadata = FileMetadata(
+      filename=filename,
+      file_type=file_type,
+      reason_created=reason,
+      digest=digest,
+      file_summary=await summarize_dataframe(client, content),
+      command_args=command_args,
+      source_digest=source_digest,
+      cache_hit=cache_hit,
+    )
+    self._set_data_frame(df_name, metadata)
+    self._record('data_frame_added', {'name': df_name, 'metadata': metadata.model_dump()})
+    self._new_data_frame_added(metadata)
+
+  async def add_parquet_file(self, path: Path, df_name: str, reason: str = '', command_args: Optional[List[str]] = None, source_digest: Optional[str] = None, cache_hit: bool = False):
+    """Add a data frame already written to a parquet file, without loading it."""
+    print(f'🗄️ Adding dataframe {df_name} with type parquet')
+    metadata = FileMetadata(
+      filename=f'{df_name}.parquet',
+      file_type='parquet',
+      reason_created=reason,
+      digest=await self.blobs.put_file(path),
+      file_summary=await asyncio.to_thread(summarize_parquet, path),
+      command_args=command_args,
+      source_digest=source_digest,
+      cache_hit=cache_hit,
+    )
+    self._set_data_frame(df_name, metadata)
+    self._record('data_frame_added', {'name': df_name, 'metadata': metadata.model_dump()})
+    self._new_data_frame_added(metadata)
+
+  async def add_table(self, table: pa.Table, df_name: str, reason: str = '', command_args: Optional[List[str]] = None, source_digest: Optional[str] = None, cache_hit: bool = False):
+    """Add a data frame built as an Arrow table, written to parquet without going through pandas."""
+    buf = io.BytesIO()
+    await asyncio.to_thread(pq.write_table, table, buf, compression='zstd')
+    print(f'🗄️ Adding dataframe {df_name} with type parquet')
+    metadata = FileMetadata(
+      filename=f'{df_name}.parquet',
+      file_type='parquet',
+      reason_created=reason,
+      # Parquet is already zstd compressed, storing it raw lets reads memory-map it.
+      digest=await self.blobs.put(buf.getvalue(), compress=False),
+      file_summary=summarize_parquet(buf),
+      command_args=command_args,
+      source_digest=source_digest,
+      cache_hit=cache_hit,
+    )
+    self._set_data_frame(df_name, metadata)
+    self._record('data_frame_added', {'name': df_name, 'metadata': metadata.model_dump()})
     self._new_data_frame_added(metadata)
 
   def add_listener(self, listener: ListenerQueue):
+    self.dag.add(listener)
     self.listeners.append(listener)
     self.listener_tasks.append(asyncio.create_task(listener.run()))
 
   async def shutdown(self):
     self.done.set()
+    self.prefetcher.cancel()
     await asyncio.gather(*self.listener_tasks)
+    await self.summary_ready()
+    self.save_snapshot()
 
 
 @dataclass(kw_only=True)
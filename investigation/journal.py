@@ -0,0 +1,71 @@
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, Literal, Optional
+
+from pydantic import BaseModel, ValidationError
+
+type EventType = Literal[
+  'file_added',
+  'file_updated',
+  'data_frame_added',
+  'facts_added',
+  'graph_delta',
+  'summary_set',
+  'conversation_set',
+  'conversation_appended',
+  'listener_done',
+  'investigation_done',
+  'changes_detected',
+]
+
+
+class JournalEvent(BaseModel):
+  seq: int
+  type: EventType
+  data: Dict[str, Any]
+
+
+def atomic_write(path: Path, content: str) -> None:
+  tmp_path = path.with_name(f'.{path.name}.tmp')
+  with open(tmp_path, 'w') as f:
+    f.write(content)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp_path, path)
+
+
+@dataclass(kw_only=True)
+class Journal:
+  """Append-only log of investigation events, one JSON object per line."""
+
+  path: Path
+  _file: Optional[IO[str]] = field(default=None, repr=False)
+
+  def append(self, event: JournalEvent) -> None:
+    if self._file is None:
+      self._file = open(self.path, 'a')
+    # A single write per line keeps events from interleaving between coroutines.
+    self._file.write(event.model_dump_json() + '\n')
+    self._file.flush()
+
+  def read(self) -> Iterator[JournalEvent]:
+    if not self.path.exists():
+      return
+    with open(self.path, 'r') as f:
+      for line in f:
+        try:
+          yield JournalEvent.model_validate_json(line)
+        except ValidationError:
+          # A crash mid-append can leave a torn final line.
+          return
+
+  def truncate(self) -> None:
+    self.close()
+    with open(self.path, 'w'):
+      pass
+
+  def close(self) -> None:
+    if self._file is not None:
+      self._file.close()
+      self._file = None
@@ -0,0 +1,73 @@
+import difflib
+import json
+from typing import Any, List
+
+from investigation.summarize_json import find_id_key
+
+MAX_CHANGES = 50
+
+
+def _list_ids(name: str, items: List[Any]) -> List[str] | None:
+  # Lists of resources are matched by their ID so a reordered or shifted list isn't reported as every item changing.
+  if not items or not all(isinstance(item, dict) for item in items):
+    return None
+  key = find_id_key(name, items[0])
+  if key is None or not all(isinstance(item.get(key), (str, int)) for item in items):
+    return None
+  ids = [str(item[key]) for item in items]
+  return ids if len(set(ids)) == len(ids) else None
+
+
+def _diff(old: Any, new: Any, path: str, name: str, changes: List[str]) -> None:
+  if len(changes) >= MAX_CHANGES or old == new:
+    return
+
+  if isinstance(old, dict) and isinstance(new, dict):
+    for key in old.keys() - new.keys():
+      changes.append(f'{path}.{key} removed')
+    for key in new.keys() - old.keys():
+      changes.append(f'{path}.{key} added: {json.dumps(new[key])[:200]}')
+    for key in old.keys() & new.keys():
+      _diff(old[key], new[key], f'{path}.{key}', key, changes)
+    return
+
+  if isinstance(old, list) and isinstance(new, list):
+    old_ids, new_ids = _list_ids(name, old), _list_ids(name, new)
+    if old_ids is not None and new_ids is not None:
+      old_items, new_items = dict(zip(old_ids, old)), dict(zip(new_ids, new))
+      for item_id in old_items.keys() - new_items.keys():
+        changes.append(f'{path}[{item_id}] removed')
+      for item_id in new_items.keys() - old_items.keys():
+        changes.append(f'{path}[{item_id}] added')
+      for item_id in old_items.keys() & new_items.keys():
+        _diff(old_items[item_id], new_items[item_id], f'{path}[{item_id}]', name, changes)
+      return
+
+    for i, (old_item, new_item) in enumerate(zip(old, new)):
+      _diff(old_item, new_item, f'{path}[{i}]', name, changes)
+    for i in range(len(new), len(old)):
+      changes.append(f'{path}[{i}] removed')
+    for i in range(len(old), len(new)):
+      changes.append(f'{path}[{i}] added: {json.dumps(new[i])[:200]}')
+    return
+
+  changes.append(f'{path} changed from {json.dumps(old)[:100]} to {json.dumps(new)[:100]}')
+
+
+def json_diff(old: Any, new: Any) -> List[str]:
+  """Structural differences between two parsed JSON documents, one line per change, at most MAX_CHANGES."""
+  changes: List[str] = []
+  _diff(old, new, '$', '', changes)
+  return sorted(changes)
+
+
+def text_diff(old: str, new: str) -> List[str]:
+  lines = difflib.unified_diff(old.splitlines(), new.splitlines(), lineterm='', n=0)
+  return [line for line in lines if line[:1] in '+-' and line[:3] not in ('+++', '---')][:MAX_CHANGES]
+
+
+def output_diff(old: str, new: str) -> List[str]:
+  try:
+    return json_diff(json.loads(old), json.loads(new))
+  except json.JSONDecodeError:
+    return text_diff(old, new)
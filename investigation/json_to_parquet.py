@@ -1,6 +1,13 @@
-from typing import Any, Awaitable, Callable, Dict, List
+import asyncio
+import json
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from investigation.summarize_json import find_id_key
 
 
 def flatten_dict(d: Dict[str, Any], parent_key: str = '', sep: str = '_') -> Dict[str, Any]:
@@ -81,3 +88,251 @@ async def extract_dataframes_from_json(obj: Dict | List, name: str, get_id_key:
     return await json_to_dataframes(obj, name, get_id_key)
   else:
     assert False, f'Expected a dictionary or list, got {type(obj)}'
+
+
+def merge_types(a: pa.DataType, b: pa.DataType) -> pa.DataType:
+  if a == b or pa.types.is_null(b):
+    return a
+  if pa.types.is_null(a):
+    return b
+  if (pa.types.is_integer(a) or pa.types.is_floating(a)) and (pa.types.is_integer(b) or pa.types.is_floating(b)):
+    return pa.float64()
+  # Anything else that disagrees, between records or batches, is kept as text.
+  return pa.string()
+
+
+# A value's shape: a dict of field shapes for objects, a one item list of the item shape for lists, None for null, else its type.
+type Shape = Dict[str, 'Shape'] | List['Shape'] | pa.DataType | None
+
+SCALAR_TYPES = {bool: pa.bool_(), int: pa.int64(), float: pa.float64(), str: pa.string()}
+
+
+def _shape(value: Any) -> Shape:
+  if value is None:
+    return None
+  if isinstance(value, dict):
+    return {k: _shape(v) for k, v in value.items()}
+  if isinstance(value, list):
+    item: Shape = None
+    for v in value:
+      item = _merge_shapes(item, _shape(v))
+    return [item]
+  return SCALAR_TYPES.get(type(value), pa.string())
+
+
+def _merge_shapes(a: Shape, b: Shape) -> Shape:
+  if a is None:
+    return b
+  if b is None:
+    return a
+  if isinstance(a, dict) and isinstance(b, dict):
+    merged = dict(a)
+    for k, shape in b.items():
+      merged[k] = _merge_shapes(merged.get(k), shape)
+    return merged
+  if isinstance(a, list) and isinstance(b, list):
+    return [_merge_shapes(a[0], b[0])]
+  if isinstance(a, pa.DataType) and isinstance(b, pa.DataType):
+    return merge_types(a, b)
+  # An object in one record and a list or scalar in another.
+  return pa.string()
+
+
+def _arrow_type(shape: Shape) -> pa.DataType:
+  if shape is None:
+    return pa.null()
+  if isinstance(shape, dict):
+    return pa.struct([(k, _arrow_type(v)) for k, v in shape.items()])
+  if isinstance(shape, list):
+    return pa.list_(_arrow_type(shape[0]))
+  return shape
+
+
+def _conform(value: Any, shape: Shape) -> Any:
+  if value is None:
+    return None
+  if isinstance(shape, dict):
+    return {k: _conform(value.get(k), v) for k, v in shape.items()}
+  if isinstance(shape, list):
+    return [_conform(v, shape[0]) for v in value]
+  if shape == pa.string() and not isinstance(value, str):
+    return json.dumps(value) if isinstance(value, (dict, list, bool)) else str(value)
+  return value
+
+
+def _as_record(value: Any) -> Dict[str, Any]:
+  # Lists of scalars, e.g. sqs list-queues' QueueUrls, become a value column.
+  return value if isinstance(value, dict) else {'value': value}
+
+
+def records_shape(records: Iterable[Any], shape: Shape = None) -> Shape:
+  """The shape of every record merged into shape, so records seen a batch at a time can share one."""
+  for record in records:
+    shape = _merge_shapes(shape, _shape(_as_record(record)))
+  return shape
+
+
+def _records_table(records: List[Dict[str, Any]], shape: Shape = None) -> pa.Table:
+  try:
+    # Inferred in one pass, with the union of every record's keys, unless the shape is known from other batches.
+    return pa.Table.from_struct_array(pa.array(records, type=None if shape is None else _arrow_type(shape)))
+  except (pa.ArrowInvalid, pa.ArrowTypeError):
+    pass
+  # Some field's type differs between records, only the values where they differ become text so nested lists are kept.
+  shape = shape or records_shape(records)
+  return pa.Table.from_struct_array(pa.array([_conform(record, shape) for record in records], type=_arrow_type(shape)))
+
+
+def _flatten_structs(table: pa.Table, sep: str = '_') -> pa.Table:
+  while any(pa.types.is_struct(f.type) for f in table.schema):
+    names, columns = [], []
+    for f, column in zip(table.schema, table.columns):
+      if pa.types.is_struct(f.type):
+        for i, child in enumerate(f.type):
+          names.append(f'{f.name}{sep}{child.name}')
+          columns.append(pc.struct_field(column, [i]))
+      else:
+        names.append(f.name)
+        columns.append(column)
+    table = pa.table(columns, names=names)
+  return table
+
+
+def merge_schemas(schemas: List[pa.Schema]) -> pa.Schema:
+  types: Dict[str, pa.DataType] = {}
+  for schema in schemas:
+    for f in schema:
+      types[f.name] = merge_types(types.get(f.name, pa.null()), f.type)
+  return pa.schema(list(types.items()))
+
+
+def conform_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+  """Cast table to schema, adding the columns it doesn't have as nulls."""
+  return pa.table({f.name: table[f.name].cast(f.type) if f.name in table.column_names else pa.nulls(len(table), f.type) for f in schema})
+
+
+def unify_tables(tables: List[pa.Table]) -> pa.Table:
+  """Concatenate tables whose columns may differ, or have types that differ, between them."""
+  try:
+    return pa.concat_tables(tables, promote_options='permissive')
+  except (pa.ArrowInvalid, pa.ArrowTypeError):
+    pass
+  schema = merge_schemas([table.schema for table in tables])
+  return pa.concat_tables([conform_table(table, schema) for table in tables])
+
+
+def _index_column(name: str) -> str:
+  return f'{name}_index' if name else 'index'
+
+
+@dataclass(kw_only=True)
+class RecordFlattener:
+  """Flattens batches of records into one table for the records and one per list field, at any depth.
+
+  Every table has the records' id_key column, and tables nested deeper also have their immediate parent's id (e.g.
+  Instances_Tags has InstanceId), or its row index when the parent has no id. The key columns are chosen from the first
+  batch that needs them and row indices continue across batches, so every batch's tables line up. Given the shape of
+  all the records, see records_shape, a field whose type differs between batches is flattened the same way in each."""
+
+  id_key: Optional[str]
+  shape: Shape = None
+  parent_keys: Dict[str, str] = field(default_factory=dict)
+  row_counts: Dict[str, int] = field(default_factory=dict)
+
+  def _parent_key(self, name: str, table: pa.Table, inherited: List[str]) -> str:
+    if name not in self.parent_keys:
+      # The keys copied in from ancestors don't identify this table's rows.
+      own = dict.fromkeys([column for column in table.column_names if column not in inherited], '')
+      key = self.id_key if name == '' else find_id_key(name.rsplit('_', 1)[-1], own)
+      self.parent_keys[name] = key or _index_column(name)
+    return self.parent_keys[name]
+
+  def _explode(self, table: pa.Table, name: str, tables: Dict[str, pa.Table], inherited: List[str]):
+    table = _flatten_structs(table)
+    offset = self.row_counts.get(name, 0)
+    self.row_counts[name] = offset + len(table)
+    list_fields = [f.name for f in table.schema if pa.types.is_list(f.type) or pa.types.is_large_list(f.type)]
+    if list_fields:
+      self._parent_key(name, table, inherited)
+    parent_key = self.parent_keys.get(name)
+    if parent_key is not None and parent_key not in table.column_names:
+      # Rows without an id of their own are numbered, a batch missing the id column gets nulls.
+      ids = pa.array(range(offset, offset + len(table)), pa.int64()) if parent_key == _index_column(name) else pa.nulls(len(table), pa.string())
+      table = table.append_column(parent_key, ids)
+
+    # Children are keyed by the records' id and, below the top level, by this table's own id too.
+    keys = list(dict.fromkeys([self.parent_keys[''], parent_key])) if list_fields else []
+    children = []
+    for field_name in list_fields:
+      column = table[field_name].combine_chunks()
+      table = table.drop_columns([field_name])
+      values = pc.list_flatten(column)
+      if len(values) == 0 or pa.types.is_null(values.type):
+        continue
+      parents = pc.list_parent_indices(column)
+      child = pa.Table.from_struct_array(values) if pa.types.is_struct(values.type) else pa.table({'value': values})
+      for key in keys:
+        if key in child.column_names:
+          child = child.drop_columns([key])
+        child = child.append_column(key, table[key].combine_chunks().take(parents))
+      # Lists nested in list items are named after the path to them, e.g. Instances_Tags.
+      children.append((field_name if name == '' else f'{name}_{field_name}', child))
+
+    tables[name] = table
+    for child_name, child in children:
+      self._explode(child, child_name, tables, keys)
+
+  def flatten(self, records: List[Any]) -> Dict[str, pa.Table]:
+    """One batch of records' tables, keyed by their path with the records' own table under ''. The records aren't modified."""
+    if not all(isinstance(record, dict) for record in records):
+      records = [_as_record(record) for record in records]
+    table = _records_table(records, self.shape)
+    if self.id_key and self.id_key not in table.column_names:
+      raise ValueError(f"ID key '{self.id_key}' not found in record")
+    tables: Dict[str, pa.Table] = {}
+    self._explode(table, '', tables, [])
+    return tables
+
+
+def records_to_tables(records: List[Any], name: str, id_key: Optional[str], batch_size: int = 50000) -> Dict[str, pa.Table]:
+  """Columnar replacement for json_to_dataframes, see RecordFlattener. Columns are built directly from the records and
+  flattened and exploded with Arrow compute."""
+  # Batches are flattened with the shape of all the records, a single batch infers it itself.
+  flattener = RecordFlattener(id_key=id_key, shape=records_shape(records) if len(records) > batch_size else None)
+  tables: Dict[str, List[pa.Table]] = {}
+  for start in range(0, len(records), batch_size):
+    for table_name, table in flattener.flatten(records[start : start + batch_size]).items():
+      tables.setdefault(table_name, []).append(table)
+
+  return {name if table_name == '' else table_name: unify_tables(parts) for table_name, parts in tables.items()}
+
+
+async def json_to_tables(json_data: List[Dict], name: str, get_id_key: Callable[[Dict], Awaitable[str]]) -> Dict[str, pa.Table]:
+  if len(json_data) == 0:
+    return {}
+  # Like stream_to_parquet, the model is only asked when the collection's id key can't be recognized.
+  id_key = (find_id_key(name, json_data[0]) or await get_id_key(json_data[0])) if isinstance(json_data[0], dict) else None
+  return await asyncio.to_thread(records_to_tables, json_data, name, id_key)
+
+
+async def extract_tables_from_json(obj: Any, name: str, get_id_key: Callable[[Dict], Awaitable[str]]) -> Dict[str, pa.Table]:
+  """Tables for every top-level list of an output, named the way stream_to_parquet names them.
+
+  Other top-level values, like NextToken or s3api list-buckets' Owner, are left out. A document that is itself a list is
+  a collection named name."""
+  if isinstance(obj, list):
+    collections = {'': obj}
+  elif isinstance(obj, dict):
+    collections = {key: value for key, value in obj.items() if isinstance(value, list)}
+  else:
+    collections = {}
+
+  tables: Dict[str, pa.Table] = {}
+  owners: Dict[str, str] = {}
+  for collection, records in collections.items():
+    for table_name, table in (await json_to_tables(records, collection or name, get_id_key)).items():
+      # A document with several top-level lists could have the same list field in each.
+      if owners.setdefault(table_name, collection) != collection:
+        table_name = f'{collection}_{table_name}'
+      tables[table_name] = table
+  return tables
@@ -0,0 +1,129 @@
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Self, Set
+
+from pydantic import BaseModel, Field
+
+from alxai.base.cli import CliError, run_cli
+from investigation.asset_graph import AssetGraph
+from investigation.aws_command import command_ttl, is_cacheable, normalize_args
+from investigation.command_cache import command_key
+from investigation.fan_out import get_fan_out
+from investigation.investigation import FileMetadata, Investigation
+from investigation.journal import atomic_write
+
+KNOWLEDGE_DIR = Path('output/knowledge')
+FACT_MAX_AGE = 24 * 3600
+OUTPUT_MAX_AGE = 7 * 24 * 3600
+MAX_FACTS = 2000
+
+
+class KnownFact(BaseModel):
+  text: str
+  source: Optional[str] = None
+  investigation: Optional[str] = None
+  observed_at: float
+
+
+class CachedOutput(BaseModel):
+  args: List[str]
+  observed_at: float
+  ttl: float
+  metadata: FileMetadata
+
+  def fresh(self, now: float) -> bool:
+    return now - self.observed_at < self.ttl
+
+
+class AccountKnowledge(BaseModel):
+  """What previous investigations learned about an AWS account, used to warm-start new ones."""
+
+  account: str
+  facts: Dict[str, KnownFact] = Field(default_factory=dict)
+  assets: AssetGraph = Field(default_factory=lambda: AssetGraph(nodes={}, edges={}))
+  outputs: Dict[str, CachedOutput] = Field(default_factory=dict)
+  seeded_files: Set[str] = Field(default_factory=set, exclude=True)
+  seeded_facts: Set[str] = Field(default_factory=set, exclude=True)
+
+  @staticmethod
+  def path(account: str) -> Path:
+    return KNOWLEDGE_DIR / f'{account}.json'
+
+  @classmethod
+  def load(cls, account: str) -> Self:
+    path = cls.path(account)
+    if not path.exists():
+      return cls(account=account)
+    with open(path, 'r') as f:
+      return cls.model_validate_json(f.read())
+
+  def save(self):
+    KNOWLEDGE_DIR.mkdir(parents=True, exist_ok=True)
+    atomic_write(self.path(self.account), self.model_dump_json(indent=2))
+
+  def warm_start(self, investigation: Investigation) -> str:
+    """Seed investigation with still-fresh command outputs and facts and the merged asset graph.
+
+    Stale entries are left out rather than refreshed up front, if the investigation needs them it runs the command
+    again and merge() replaces them."""
+    now = time.time()
+    fan_out = get_fan_out()
+    for key, output in self.outputs.items():
+      # Outputs that ran with another profile or region from the environment, or that fan out now, don't answer this run's commands.
+      if not output.fresh(now) or command_key(output.args) != key or (fan_out and fan_out.applies(output.args)):
+        continue
+      investigation.seed_file(output.metadata.model_copy())
+      self.seeded_files.add(output.metadata.filename)
+
+    facts = [fact for fact in self.facts.values() if now - fact.observed_at < FACT_MAX_AGE]
+    by_source: Dict[Optional[str], List[str]] = {}
+    for fact in facts:
+      by_source.setdefault(fact.source, []).append(fact.text)
+      self.seeded_facts.add(fact.text)
+    # One call per source, every add_facts call is a journal record.
+    for source, texts in by_source.items():
+      investigation.add_facts(texts, source)
+
+    if self.assets.nodes:
+      investigation.add_assets(self.assets.model_copy(deep=True))
+
+    return f'🧠 Warm start for account {self.account}: {len(self.seeded_files)}/{len(self.outputs)} outputs, {len(facts)}/{len(self.facts)} facts, {len(self.assets.nodes)} assets'
+
+  def merge(self, investigation: Investigation):
+    now = time.time()
+    fan_out = get_fan_out()
+    for metadata in investigation.files.values():
+      if metadata.filename in self.seeded_files or not metadata.command_args or not is_cacheable(metadata.command_args):
+        continue
+      # Merged outputs span several accounts, they don't belong to this one's knowledge.
+      if fan_out and fan_out.applies(metadata.command_args):
+        continue
+      args = normalize_args(metadata.command_args)
+      self.outputs[command_key(args)] = CachedOutput(args=args, observed_at=now, ttl=command_ttl(args), metadata=metadata)
+    self.outputs = {key: output for key, output in self.outputs.items() if now - output.observed_at < OUTPUT_MAX_AGE}
+
+    for fact in investigation.facts:
+      if fact not in self.seeded_facts:
+        self.facts[fact] = KnownFact(text=fact, source=investigation.fact_sources.get(fact), investigation=investigation.dir.name, observed_at=now)
+    if len(self.facts) > MAX_FACTS:
+      newest = sorted(self.facts.values(), key=lambda f: f.observed_at, reverse=True)[:MAX_FACTS]
+      self.facts = {fact.text: fact for fact in newest}
+
+    self.assets.update(investigation.assets)
+
+
+async def current_account() -> Optional[str]:
+  try:
+    stdout, _ = await run_cli(['aws', 'sts', 'get-caller-identity', '--output', 'json'])
+    return json.loads(stdout)['Account']
+  except (CliError, json.JSONDecodeError, KeyError) as e:
+    print(f'Error finding the current AWS account: {e}')
+    return None
+
+
+async def load_account_knowledge() -> Optional[AccountKnowledge]:
+  account = await current_account()
+  if account is None:
+    return None
+  return AccountKnowledge.load(account)
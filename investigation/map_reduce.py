@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from alxai.openai.client import count_tokens
+from alxai.openai.conv import oneshot_conv, usermsg
+from alxai.trace import traced
+
+CHUNK_TOKENS = 8000
+MAP_REDUCE_TOKENS = 20000
+# Lines that leave the JSON nesting at or above this depth end a top-level item and make good cut points.
+CUT_DEPTH = 2
+# First guess at how many bytes of a line fit in a chunk, per token, when splitting a line too long for one.
+BYTES_PER_TOKEN = 4
+CACHE_DIR = Path('output/cache/chunk_summaries')
+PROMPT_VERSION = 'v2'
+
+
+def _char_boundary(view: memoryview, start: int, stop: int) -> int:
+  # Back off utf-8 continuation bytes so a piece doesn't end in the middle of a character.
+  cut = stop
+  while cut > start and cut < len(view) and view[cut] & 0xC0 == 0x80:
+    cut -= 1
+  return cut if cut > start else stop
+
+
+def _line_pieces(view: memoryview, start: int, end: int, max_tokens: int) -> Iterator[Tuple[str, int]]:
+  """(text, tokens) for view[start:end], split into pieces of at most max_tokens when the line alone is longer, e.g. minified JSON."""
+  while start < end:
+    stop = min(end, start + max_tokens * BYTES_PER_TOKEN)
+    while True:
+      stop = _char_boundary(view, start, stop)
+      text = str(view[start:stop], 'utf-8', errors='replace')
+      tokens = count_tokens(text)
+      # A token is at least a byte, so a piece of max_tokens bytes always fits.
+      if tokens <= max_tokens or stop - start <= max_tokens:
+        break
+      stop = start + max(max_tokens, int((stop - start) * max_tokens / tokens))
+    yield text, tokens
+    start = stop
+
+
+def iter_chunks(buf: memoryview | bytes, max_tokens: int = CHUNK_TOKENS) -> Iterator[str]:
+  """Split a (memory-mapped) buffer on line boundaries, preferring cuts between JSON items, keeping each chunk under max_tokens."""
+  data = np.frombuffer(buf, dtype=np.uint8)
+  newlines = np.flatnonzero(data == ord('\n'))
+  view = memoryview(buf)
+
+  chunk: List[str] = []
+  line_tokens: List[int] = []
+  chunk_tokens = 0
+  last_cut = 0
+  depth = 0
+  start = 0
+  for end in [*newlines.tolist(), len(data)]:
+    pieces = _line_pieces(view, start, min(end + 1, len(data)), max_tokens)
+    start = end + 1
+    for line, tokens in pieces:
+      # Bracket counting ignores string quoting, braces inside values are almost always balanced so depth stays right.
+      depth += line.count('{') + line.count('[') - line.count('}') - line.count(']')
+
+      while chunk and chunk_tokens + tokens > max_tokens:
+        cut = last_cut or len(chunk)
+        yield ''.join(chunk[:cut])
+        chunk, line_tokens = chunk[cut:], line_tokens[cut:]
+        chunk_tokens = sum(line_tokens)
+        last_cut = 0
+
+      chunk.append(line)
+      line_tokens.append(tokens)
+      chunk_tokens += tokens
+      if depth <= CUT_DEPTH:
+        last_cut = len(chunk)
+
+  if chunk:
+    yield ''.join(chunk)
+
+
+def _cache_path(*parts: str) -> Path:
+  sha = hashlib.sha256(PROMPT_VERSION.encode())
+  for part in parts:
+    sha.update(hashlib.sha256(part.encode()).digest())
+  key = sha.hexdigest()
+  return CACHE_DIR / key[:2] / f'{key}.txt'
+
+
+async def _cached_summary(client, prompt: str, *key: str) -> str:
+  """key is what the prompt is built from, without a chunk's position, so adding or removing a chunk doesn't invalidate the others."""
+  path = _cache_path(*key)
+  if path.exists():
+    return path.read_text()
+
+  response = await oneshot_conv(client, [usermsg(prompt)], model='o3-mini')
+  assert isinstance(response, str)
+
+  path.parent.mkdir(parents=True, exist_ok=True)
+  path.write_text(response)
+  return response
+
+
+def map_prompt(reason: str, chunk: str) -> str:
+  return f"""# Task: Analyze one part of the output of this - {reason}
+
+# Goal
+- extract the most relevant information to form a summary of what this part of the output explains.
+- if the output describes certain objects then be sure to explain how many there are and what their ID/ARN is exactly
+- keep your summary concise. one paragraph with no formatting.
+
+# Partial command output:
+{chunk}"""
+
+
+def reduce_prompt(reason: str, summaries: List[str]) -> str:
+  parts = '\n\n'.join(f'## Part {i + 1}\n{summary}' for i, summary in enumerate(summaries))
+  return f"""# Task: Combine the summaries of consecutive parts of this - {reason}
+
+# Goal
+- merge the partial summaries into one summary of what the whole output explains.
+- add up counts of objects across parts and keep their exact IDs/ARNs.
+- keep your summary concise. one paragraph with no formatting.
+
+# Partial summaries:
+{parts}"""
+
+
+def _group(summaries: List[str], max_tokens: int) -> List[List[str]]:
+  groups: List[List[str]] = [[]]
+  tokens = 0
+  for summary in summaries:
+    summary_tokens = count_tokens(summary)
+    if groups[-1] and tokens + summary_tokens > max_tokens:
+      groups.append([])
+      tokens = 0
+    groups[-1].append(summary)
+    tokens += summary_tokens
+  return groups
+
+
+async def _reduce(client, reason: str, group: List[str]) -> str:
+  if len(group) == 1:
+    return group[0]
+  return await _cached_summary(client, reduce_prompt(reason, group), 'reduce', reason, *group)
+
+
+@traced('map_reduce_summarize')
+async def map_reduce_summarize(client, reason: str, buf: memoryview | bytes, max_tokens: int = CHUNK_TOKENS) -> str:
+  """Summarize chunks concurrently, then reduce the chunk summaries hierarchically until one remains.
+
+  Every intermediate summary is cached by a hash of the reason and its content, so re-runs only redo chunks whose content changed."""
+  chunks = list(iter_chunks(buf, max_tokens))
+  summaries = list(await asyncio.gather(*[_cached_summary(client, map_prompt(reason, chunk), 'map', reason, chunk) for chunk in chunks]))
+
+  while len(summaries) > 1:
+    groups = _group(summaries, max_tokens)
+    if len(groups) == len(summaries):
+      # Summaries too large to pack under max_tokens are reduced in pairs so every level makes progress.
+      groups = [summaries[i : i + 2] for i in range(0, len(summaries), 2)]
+    summaries = list(await asyncio.gather(*[_reduce(client, reason, group) for group in groups]))
+
+  return summaries[0]
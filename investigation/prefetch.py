@@ -0,0 +1,143 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Tuple
+
+from alxai.base.cli import CliError
+from investigation.aws_command import cache_key, command_ttl, is_cacheable, option_value, service_operation
+from investigation.command_cache import CommandOutput, get_command_cache
+
+MAX_FOLLOW_UPS = 5
+MAX_DEPTH = 2
+
+type FollowUps = Callable[[Any, List[str]], List[List[str]]]
+
+
+def _instance_security_groups(data: Any, args: List[str]) -> List[List[str]]:
+  ids = sorted({g['GroupId'] for r in data.get('Reservations', []) for i in r.get('Instances', []) for g in i.get('SecurityGroups', []) if 'GroupId' in g})
+  return [['aws', 'ec2', 'describe-security-groups', '--group-ids', *ids]] if ids else []
+
+
+def _load_balancer_listeners(data: Any, args: List[str]) -> List[List[str]]:
+  arns = [lb['LoadBalancerArn'] for lb in data.get('LoadBalancers', []) if 'LoadBalancerArn' in lb]
+  return [['aws', 'elbv2', 'describe-listeners', '--load-balancer-arn', arn] for arn in arns]
+
+
+def _listener_certificates(data: Any, args: List[str]) -> List[List[str]]:
+  arns = sorted({c['CertificateArn'] for listener in data.get('Listeners', []) for c in listener.get('Certificates', []) if ':acm:' in c.get('CertificateArn', '')})
+  return [['aws', 'acm', 'describe-certificate', '--certificate-arn', arn] for arn in arns]
+
+
+def _ecs_clusters(data: Any, args: List[str]) -> List[List[str]]:
+  arns = data.get('clusterArns', [])
+  return [['aws', 'ecs', 'describe-clusters', '--clusters', *arns]] if arns else []
+
+
+def _ecs_services(data: Any, args: List[str]) -> List[List[str]]:
+  cluster = option_value(args, '--cluster')
+  arns = data.get('serviceArns', [])
+  if not arns:
+    return []
+  # describe-services accepts at most 10 services per call.
+  cluster_args = ['--cluster', cluster] if cluster else []
+  return [['aws', 'ecs', 'describe-services', *cluster_args, '--services', *arns[i : i + 10]] for i in range(0, len(arns), 10)]
+
+
+# The read-only commands an investigation almost always runs next after each command.
+RULES: Dict[Tuple[str, str], FollowUps] = {
+  ('ec2', 'describe-instances'): _instance_security_groups,
+  ('elbv2', 'describe-load-balancers'): _load_balancer_listeners,
+  ('elbv2', 'describe-listeners'): _listener_certificates,
+  ('ecs', 'list-clusters'): _ecs_clusters,
+  ('ecs', 'list-services'): _ecs_services,
+}
+
+
+def _scoped(args: List[str], follow_up: List[str]) -> List[str]:
+  # Follow-ups target the same account and region as the command that prompted them.
+  for name in ('--profile', '--region'):
+    value = option_value(args, name)
+    if value:
+      follow_up += [name, value]
+  return follow_up + ['--output', 'json']
+
+
+@dataclass(kw_only=True)
+class Prefetched:
+  task: asyncio.Task[CommandOutput]
+  started_at: float
+  ttl: float
+  used: bool = False
+
+
+@dataclass(kw_only=True)
+class Prefetcher:
+  """Speculatively runs likely follow-up commands after each command, so GatherData finds their output ready."""
+
+  rules: Dict[Tuple[str, str], FollowUps] = field(default_factory=lambda: dict(RULES))
+  concurrency: int = 4
+  issued: int = 0
+  hits: int = 0
+  misses: int = 0
+  _cache: Dict[str, Prefetched] = field(default_factory=dict)
+  _semaphore: asyncio.Semaphore | None = None
+
+  def observe(self, args: List[str], stdout: str, depth: int = 0):
+    rule = self.rules.get(service_operation(args))
+    if rule is None or depth >= MAX_DEPTH:
+      return
+    try:
+      follow_ups = rule(json.loads(stdout), args)
+    except (json.JSONDecodeError, AttributeError, TypeError):
+      return
+
+    for follow_up in follow_ups[:MAX_FOLLOW_UPS]:
+      follow_up = _scoped(args, follow_up)
+      key = cache_key(follow_up)
+      if key in self._cache or not is_cacheable(follow_up):
+        continue
+      task = asyncio.create_task(self._run(follow_up, depth + 1))
+      # Failures only matter if the command is fetched, fetch() falls back to running it for the real error.
+      task.add_done_callback(lambda t: t.cancelled() or t.exception())
+      self._cache[key] = Prefetched(task=task, started_at=time.monotonic(), ttl=command_ttl(follow_up))
+      self.issued += 1
+
+  async def _run(self, args: List[str], depth: int) -> CommandOutput:
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self.concurrency)
+    async with self._semaphore:
+      # Through the command cache, so another investigation's prefetch or run of the same command is reused.
+      stdout, _ = await get_command_cache().run_streamed(args)
+    # Follow-ups are only looked for in outputs small enough to parse in memory.
+    if isinstance(stdout, str):
+      self.observe(args, stdout, depth)
+    return stdout
+
+  async def fetch(self, args: List[str]) -> CommandOutput | None:
+    """The prefetched output of args, waiting for it if it is still running, or None if it wasn't prefetched or failed."""
+    if option_value(args, '--output') is None:
+      # Follow-ups always ask for json, which is also what the cli returns by default.
+      args = args + ['--output', 'json']
+    entry = self._cache.get(cache_key(args))
+    if entry is None or time.monotonic() - entry.started_at > entry.ttl:
+      self.misses += 1
+      return None
+    try:
+      stdout = await entry.task
+    except CliError:
+      self.misses += 1
+      return None
+    entry.used = True
+    self.hits += 1
+    print(f'⚡ Prefetched {" ".join(args)}')
+    return stdout
+
+  def cancel(self):
+    for entry in self._cache.values():
+      entry.task.cancel()
+
+  def report(self) -> str:
+    used = sum(entry.used for entry in self._cache.values())
+    hit_rate = self.hits / (self.hits + self.misses) if self.hits + self.misses else 0
+    return f'prefetched {self.issued} commands, {used} used ({used / max(self.issued, 1):.0%} of speculative work), command hit rate {hit_rate:.0%}'
@@ -0,0 +1,39 @@
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+
+@dataclass(kw_only=True)
+class PromptSection:
+  """A prompt section kept rendered between prompts, one line per key in insertion order.
+
+  Adding a key appends to the rendered text, changing an existing line re-renders it once on the next read. version
+  changes whenever the text does, so callers can cache anything built on top of it."""
+
+  lines: Dict[str, str] = field(default_factory=dict)
+  version: int = 0
+  _text: Optional[str] = ''
+
+  def set(self, key: str, line: Optional[str]):
+    if line is None:
+      if self.lines.pop(key, None) is not None:
+        self._text = None
+        self.version += 1
+      return
+    if self.lines.get(key) == line:
+      return
+
+    if key not in self.lines and self._text is not None:
+      self._text = f'{self._text}\n{line}' if self.lines else line
+    else:
+      self._text = None
+    self.lines[key] = line
+    self.version += 1
+
+  @property
+  def text(self) -> str:
+    if self._text is None:
+      self._text = '\n'.join(self.lines.values())
+    return self._text
+
+  def __len__(self) -> int:
+    return len(self.lines)
@@ -0,0 +1,111 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+from alxai.base.cli import CliError
+from investigation.blob_store import digest_of
+from investigation.command_cache import STREAM_BYTES, CommandOutput, LargeOutput
+from investigation.gather_data import add_cli_output, run_aws
+from investigation.investigation import FileMetadata, Investigation
+from investigation.json_diff import output_diff
+
+RERUN_CONCURRENCY = 8
+
+
+@dataclass(kw_only=True)
+class RerunCommand:
+  args: List[str]
+  # The outputs the command produced last time, one file or the data frames extracted from it.
+  outputs: List[Tuple[str, FileMetadata]] = field(default_factory=list)
+  previous_digest: str | None = None
+
+
+@dataclass(kw_only=True)
+class RerunStats:
+  unchanged: int = 0
+  changed: int = 0
+  failed: int = 0
+
+  def report(self) -> str:
+    total = self.unchanged + self.changed + self.failed
+    return f're-ran {total} commands: {self.unchanged} unchanged, {self.changed} changed, {self.failed} failed'
+
+
+def command_history(prior: Investigation) -> List[RerunCommand]:
+  commands: List[RerunCommand] = []
+  frames: Dict[str, RerunCommand] = {}
+  for metadata in prior.files.values():
+    if metadata.command_args:
+      commands.append(RerunCommand(args=metadata.command_args, outputs=[(metadata.filename, metadata)], previous_digest=metadata.digest))
+  for name, metadata in prior.data_frames.items():
+    if metadata.command_args and metadata.source_digest:
+      if metadata.source_digest not in frames:
+        frames[metadata.source_digest] = RerunCommand(args=metadata.command_args, previous_digest=metadata.source_digest)
+        commands.append(frames[metadata.source_digest])
+      frames[metadata.source_digest].outputs.append((name, metadata))
+  return commands
+
+
+async def rerun_history(client, investigation: Investigation, prior: Investigation) -> RerunStats:
+  """Seed investigation from a previous run of the same question and re-run its commands.
+
+  Unchanged outputs are carried over with their summaries, facts and assets and never reach the listeners. Changed
+  outputs are added normally, so only they are summarized and go through fact and asset extraction, and their
+  differences are recorded as investigation changes for the final summary. Listeners must be added first."""
+  commands = command_history(prior)
+  semaphore = asyncio.Semaphore(RERUN_CONCURRENCY)
+
+  async def run(command: RerunCommand) -> CommandOutput | CliError:
+    async with semaphore:
+      try:
+        # A re-run is looking for changes, so a cached output is never good enough. It fans out like the original run did, but
+        # only re-runs what the previous run ran, so there are no follow-ups to prefetch.
+        stdout, _ = await run_aws(investigation, command.args, bypass=True, prefetch=False)
+        return stdout
+      except CliError as e:
+        return e
+
+  results = await asyncio.gather(*[run(command) for command in commands])
+
+  stats = RerunStats()
+  unchanged_sources: Set[str] = set()
+  stale_sources: Set[str] = set()
+  changed: List[Tuple[RerunCommand, CommandOutput]] = []
+  for command, result in zip(commands, results, strict=True):
+    if isinstance(result, CliError):
+      stats.failed += 1
+      stale_sources.update(metadata.reason_created for _, metadata in command.outputs)
+      investigation.add_changes([f'{" ".join(command.args)} now fails: {result}'])
+    elif command.previous_digest == (result.digest if isinstance(result, LargeOutput) else digest_of(result.encode())):
+      stats.unchanged += 1
+      for name, metadata in command.outputs:
+        unchanged_sources.add(metadata.reason_created)
+        if metadata.file_type == 'parquet':
+          investigation.seed_data_frame(name, metadata.model_copy())
+        else:
+          investigation.seed_file(metadata.model_copy())
+    else:
+      stale_sources.update(metadata.reason_created for _, metadata in command.outputs)
+      changed.append((command, result))
+
+  # What changed or failing outputs said may no longer hold, the changed outputs re-derive it through the listeners.
+  for source in unchanged_sources - stale_sources - {''}:
+    investigation.add_facts([fact for fact in prior.facts if prior.fact_sources.get(fact) == source], source)
+    if source in prior.asset_sources:
+      investigation.add_assets(prior.asset_sources[source].model_copy(deep=True), source)
+  if not prior.asset_sources:
+    # Investigations from before assets were tracked by source can only be carried over whole.
+    investigation.add_assets(prior.assets.model_copy(deep=True))
+
+  for command, result in changed:
+    command_str = ' '.join(command.args)
+    stats.changed += 1
+    diff = []
+    # Outputs too large to hold in memory are only reported as changed, the listeners still see what they now say.
+    if isinstance(result, str) and (command.previous_digest is None or prior.blobs.size(command.previous_digest) <= STREAM_BYTES):
+      diff = output_diff(prior.blobs.read_text(command.previous_digest) if command.previous_digest else '', result)
+    investigation.add_changes([f'{command_str}: {line}' for line in diff] or [f'{command_str}: output changed'])
+    await add_cli_output(client, investigation, command.args, result)
+
+  print(f'🗄️ {stats.report()}')
+  return stats
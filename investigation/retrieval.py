@@ -0,0 +1,124 @@
+import asyncio
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from alxai.openai.client import count_tokens, get_embedding
+from investigation.map_reduce import iter_chunks
+
+RETRIEVAL_CHUNK_TOKENS = 400
+TOP_K = 20
+TOKEN_BUDGET = 12000
+# BM25 term saturation and length normalization, plus the reciprocal rank fusion constant.
+K1 = 1.5
+B = 0.75
+RRF_K = 60
+
+TOKEN_RE = re.compile(r'[a-z0-9][a-z0-9_\-]*')
+
+
+def tokenize(text: str) -> List[str]:
+  # ARNs and paths split on ':' and '/', so their IDs match on their own.
+  return TOKEN_RE.findall(text.lower())
+
+
+@dataclass(kw_only=True)
+class Chunk:
+  filename: str
+  index: int
+  text: str
+  tokens: int
+  terms: Counter[str]
+  length: int
+
+
+def make_chunks(filename: str, content: str) -> List[Chunk]:
+  chunks = []
+  for i, text in enumerate(iter_chunks(content.encode(), RETRIEVAL_CHUNK_TOKENS)):
+    terms = Counter(tokenize(text))
+    chunks.append(Chunk(filename=filename, index=i, text=text, tokens=count_tokens(text), terms=terms, length=sum(terms.values())))
+  return chunks
+
+
+@dataclass(kw_only=True)
+class RetrievalIndex:
+  """BM25 index over chunks of investigation files, optionally fused with embedding similarity."""
+
+  use_embeddings: bool = False
+  chunks: List[Chunk] = field(default_factory=list)
+  filenames: Set[str] = field(default_factory=set)
+  doc_freq: Counter[str] = field(default_factory=Counter)
+  total_length: int = 0
+  embeddings: Dict[int, np.ndarray] = field(default_factory=dict)
+
+  def add(self, filename: str, chunks: List[Chunk]):
+    if filename in self.filenames:
+      return
+    self.filenames.add(filename)
+    for chunk in chunks:
+      self.chunks.append(chunk)
+      self.doc_freq.update(chunk.terms.keys())
+      self.total_length += chunk.length
+
+  async def add_file(self, filename: str, content: str):
+    # Chunking and token counting run off the event loop, the index itself is only touched from it.
+    self.add(filename, await asyncio.to_thread(make_chunks, filename, content))
+
+  def bm25(self, query: str) -> List[Tuple[int, float]]:
+    if not self.chunks:
+      return []
+    n = len(self.chunks)
+    avg_length = self.total_length / n or 1
+    query_terms = set(tokenize(query))
+    idf = {t: math.log(1 + (n - self.doc_freq[t] + 0.5) / (self.doc_freq[t] + 0.5)) for t in query_terms if self.doc_freq[t]}
+
+    scores = []
+    for i, chunk in enumerate(self.chunks):
+      score = 0.0
+      for t, weight in idf.items():
+        tf = chunk.terms.get(t, 0)
+        if tf:
+          score += weight * tf * (K1 + 1) / (tf + K1 * (1 - B + B * chunk.length / avg_length))
+      if score > 0:
+        scores.append((i, score))
+    return sorted(scores, key=lambda s: s[1], reverse=True)
+
+  async def _embed(self, client, text: str) -> np.ndarray:
+    response = await get_embedding(client, text)
+    vector = np.array(response.data[0].embedding)
+    return vector / np.linalg.norm(vector)
+
+  async def similar(self, client, query: str) -> List[Tuple[int, float]]:
+    missing = [i for i in range(len(self.chunks)) if i not in self.embeddings]
+    vectors = await asyncio.gather(*[self._embed(client, self.chunks[i].text) for i in missing])
+    self.embeddings.update(zip(missing, vectors))
+
+    query_vector = await self._embed(client, query)
+    scores = [(i, float(vector @ query_vector)) for i, vector in self.embeddings.items()]
+    return sorted(scores, key=lambda s: s[1], reverse=True)
+
+  async def search(self, query: str, client=None, k: int = TOP_K, token_budget: int = TOKEN_BUDGET) -> List[Chunk]:
+    """Return up to k of the most relevant chunks that fit in token_budget, in file order."""
+    rankings = [self.bm25(query)]
+    if self.use_embeddings and client is not None:
+      rankings.append(await self.similar(client, query))
+
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+      for rank, (i, _) in enumerate(ranking):
+        fused[i] = fused.get(i, 0) + 1 / (RRF_K + rank + 1)
+
+    selected = []
+    tokens = 0
+    for i in sorted(fused, key=lambda i: fused[i], reverse=True):
+      if len(selected) >= k:
+        break
+      if tokens + self.chunks[i].tokens > token_budget:
+        continue
+      selected.append(i)
+      tokens += self.chunks[i].tokens
+    return [self.chunks[i] for i in sorted(selected)]
@@ -0,0 +1,195 @@
+import codecs
+import json
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Literal, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from alxai.openai.client import count_tokens
+from investigation.json_to_parquet import RecordFlattener, Shape, conform_table, records_shape
+
+READ_CHUNK = 1024 * 1024
+BATCH_ROWS = 10000
+TOKEN_SAMPLE_CHARS = 64 * 1024
+WHITESPACE = ' \t\r\n'
+
+
+def estimate_tokens(text: str, model: str, sample_chars: int = TOKEN_SAMPLE_CHARS) -> int:
+  """count_tokens of a prefix scaled up to the whole text, exact for texts shorter than the sample."""
+  if len(text) <= sample_chars:
+    return count_tokens(text, model)
+  return int(count_tokens(text[:sample_chars], model) * len(text) / sample_chars)
+
+
+class JsonStream:
+  """Incremental reader for one JSON document, decoding values one at a time from a bounded window of the input."""
+
+  def __init__(self, stream: BinaryIO, chunk_size: int = READ_CHUNK):
+    self.stream = stream
+    self.chunk_size = chunk_size
+    self.decoder = json.JSONDecoder()
+    self.utf8 = codecs.getincrementaldecoder('utf-8')()
+    self.buf = ''
+    self.pos = 0
+    self.eof = False
+
+  def fill(self) -> bool:
+    if self.eof:
+      return False
+    # Drop what was already consumed so the window only holds the value being decoded.
+    self.buf = self.buf[self.pos :]
+    self.pos = 0
+    chunk = self.stream.read(self.chunk_size)
+    self.eof = not chunk
+    self.buf += self.utf8.decode(chunk, final=self.eof)
+    return True
+
+  def peek(self) -> str:
+    while True:
+      while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+        self.pos += 1
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self.fill():
+        return ''
+
+  def expect(self, char: str):
+    if self.peek() != char:
+      raise ValueError(f'Expected {char!r} at offset {self.pos}, got {self.peek()!r}')
+    self.pos += 1
+
+  def value(self) -> Any:
+    self.peek()
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.buf, self.pos)
+        # A number at the end of the window may continue in the next chunk.
+        if end < len(self.buf) or self.eof:
+          self.pos = end
+          return value
+      except json.JSONDecodeError:
+        if self.eof:
+          raise
+      self.fill()
+
+
+type TopLevelKind = Literal['list', 'item', 'value']
+
+
+def iter_top_level(stream: BinaryIO) -> Iterator[Tuple[str, Any, TopLevelKind]]:
+  """Yield (key, value, kind) for the document's top-level values, lists as a ('list') event followed by their items one at a time.
+
+  A document that is itself a list is a list under '', one that is a string or number is a value under ''."""
+  reader = JsonStream(stream)
+  if reader.peek() == '[':
+    yield '', None, 'list'
+    for key, item in _iter_list(reader, ''):
+      yield key, item, 'item'
+    return
+  if reader.peek() != '{':
+    yield '', reader.value(), 'value'
+    return
+
+  reader.expect('{')
+  while (char := reader.peek()) != '}':
+    if char == ',':
+      reader.pos += 1
+      continue
+    if char == '':
+      raise ValueError('Unexpected end of document')
+    key = reader.value()
+    reader.expect(':')
+    if reader.peek() == '[':
+      yield key, None, 'list'
+      for _, item in _iter_list(reader, key):
+        yield key, item, 'item'
+    else:
+      yield key, reader.value(), 'value'
+
+
+def iter_records(stream: BinaryIO) -> Iterator[Tuple[str, Any]]:
+  """Yield (collection, item) for every item of the document's top-level lists, e.g. ('Reservations', {...}).
+
+  Other top-level values, like NextToken, are skipped. A document that is itself a list yields its items under ''."""
+  for key, value, kind in iter_top_level(stream):
+    if kind == 'item':
+      yield key, value
+
+
+def _iter_list(reader: JsonStream, key: str) -> Iterator[Tuple[str, Any]]:
+  reader.expect('[')
+  while (char := reader.peek()) != ']':
+    if char == ',':
+      reader.pos += 1
+      continue
+    if char == '':
+      raise ValueError('Unexpected end of document')
+    yield key, reader.value()
+  reader.pos += 1
+
+
+def first_record(open_stream: Callable[[], BinaryIO]) -> Optional[Tuple[str, Any]]:
+  with open_stream() as stream:
+    return next(iter_records(stream), None)
+
+
+def _batches(open_stream: Callable[[], BinaryIO], batch_rows: int) -> Iterator[Dict[str, List[Any]]]:
+  batch: Dict[str, List[Any]] = {}
+  rows = 0
+  with open_stream() as stream:
+    for collection, record in iter_records(stream):
+      batch.setdefault(collection, []).append(record)
+      rows += 1
+      if rows >= batch_rows:
+        yield batch
+        batch = {}
+        rows = 0
+  if batch:
+    yield batch
+
+
+def _shapes(open_stream: Callable[[], BinaryIO]) -> Dict[str, Shape]:
+  shapes: Dict[str, Shape] = {}
+  with open_stream() as stream:
+    for collection, record in iter_records(stream):
+      shapes[collection] = records_shape([record], shapes.get(collection))
+  return shapes
+
+
+def _tables(open_stream: Callable[[], BinaryIO], name: str, id_key: Callable[[str, Dict[str, Any]], Optional[str]], batch_rows: int, shapes: Dict[str, Shape]) -> Iterator[Tuple[str, pa.Table]]:
+  """(table name, table) for every batch, flattened exactly like records_to_tables does an output held in memory."""
+  flatteners: Dict[str, RecordFlattener] = {}
+  owners: Dict[str, str] = {}
+  for batch in _batches(open_stream, batch_rows):
+    for collection, records in batch.items():
+      if collection not in flatteners:
+        flatteners[collection] = RecordFlattener(id_key=id_key(collection, records[0]) if isinstance(records[0], dict) else None, shape=shapes[collection])
+      for table_name, table in flatteners[collection].flatten(records).items():
+        table_name = (collection or name) if table_name == '' else table_name
+        # A document with several top-level lists could have the same list field in each.
+        if owners.setdefault(table_name, collection) != collection:
+          table_name = f'{collection}_{table_name}'
+        yield table_name, table
+
+
+def stream_to_parquet(open_stream: Callable[[], BinaryIO], out_dir: Path, name: str, id_key: Callable[[str, Dict[str, Any]], Optional[str]], batch_rows: int = BATCH_ROWS) -> Dict[str, Path]:
+  """Write a JSON document's top-level lists to parquet files, one per collection and one per list field at any depth.
+
+  Memory is bounded by batch_rows rather than the document's size. The document is read twice, first to find the shape
+  of each collection's records, with fields whose type differs anywhere in it as text, then to write a row group per
+  batch. Every batch is flattened with that shape, so the tables match what records_to_tables makes of the same records
+  in memory whatever the batch boundaries."""
+  shapes = _shapes(open_stream)
+  paths: Dict[str, Path] = {}
+  writers: Dict[str, pq.ParquetWriter] = {}
+  try:
+    for table_name, table in _tables(open_stream, name, id_key, batch_rows, shapes):
+      if table_name not in writers:
+        paths[table_name] = out_dir / f'{table_name}.parquet'
+        writers[table_name] = pq.ParquetWriter(paths[table_name], table.schema, compression='zstd')
+      writers[table_name].write_table(conform_table(table, writers[table_name].schema))
+  finally:
+    for writer in writers.values():
+      writer.close()
+  return paths
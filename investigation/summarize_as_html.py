@@ -2,6 +2,7 @@ from pathlib import Path
 
 import pandas as pd
 
+from alxai.trace import span
 from investigation.investigation import Investigation
 
 
@@ -107,8 +108,7 @@ def generate_investigation_html(investigation: Investigation) -> str:
     html_content.append('<div class="p-4 border rounded-lg shadow bg-white">')
     html_content.append(f'<p class="font-bold">{entry.reason_created}</p>')
     # html_content.append(f'<p class="text-sm text-gray-500 whitespace-pre-wrap">{entry.file_summary}</p>')
-    filepath = investigation.dir / entry.filename
-    df = pd.read_parquet(filepath)
+    df = investigation.read_data_frame(entry)
     html_content.extend(generate_dataframe_html(df))
     html_content.append('</div>')
 
@@ -138,8 +138,9 @@ def generate_investigation_html(investigation: Investigation) -> str:
 
 def save_investigation_html(investigation: Investigation, output_path: Path) -> None:
   """Generate and save complete HTML document for an investigation."""
-  html_parts = ['<!DOCTYPE html>', '<html lang="en">', '<meta charset="UTF-8">', generate_investigation_html(investigation), '</html>']
+  with span('save_investigation_html', cat='render'):
+    html_parts = ['<!DOCTYPE html>', '<html lang="en">', '<meta charset="UTF-8">', generate_investigation_html(investigation), '</html>']
 
-  output_html = '\n'.join(html_parts)
-  with open(output_path, 'w') as f:
-    f.write(output_html)
+    output_html = '\n'.join(html_parts)
+    with open(output_path, 'w') as f:
+      f.write(output_html)
@@ -0,0 +1,133 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+PAGINATION_KEYS = {'NextToken', 'nextToken', 'Marker', 'NextMarker', 'IsTruncated', 'MaxItems', 'MaxResults', 'ResponseMetadata'}
+ATTRIBUTE_KEYS = {'State', 'Status', 'Type', 'InstanceType', 'Engine', 'EngineVersion', 'Runtime', 'Scheme', 'VpcId', 'SubnetId', 'AvailabilityZone', 'Region', 'CreationDate', 'CreatedAt'}
+MAX_ITEMS = 25
+MAX_ATTRIBUTES = 4
+MAX_SCALAR_FIELDS = 10
+# Lists whose items only group the real resources, e.g. describe-instances returns Reservations[].Instances[]
+WRAPPER_KEYS = {'Reservations'}
+
+
+def _singular(name: str) -> str:
+  if name.endswith('ies'):
+    return name[:-3] + 'y'
+  if name.endswith('ses'):
+    return name[:-2]
+  if name.endswith('s'):
+    return name[:-1]
+  return name
+
+
+def _find_collection(obj: Any) -> Optional[Tuple[str, List[Any]]]:
+  if isinstance(obj, list):
+    return 'items', obj
+  if not isinstance(obj, dict):
+    return None
+
+  keys = [k for k in obj if k not in PAGINATION_KEYS]
+  list_keys = [k for k in keys if isinstance(obj[k], list)]
+  if len(list_keys) == 1:
+    return list_keys[0], obj[list_keys[0]]
+  if len(keys) == 1 and isinstance(obj[keys[0]], dict):
+    return _find_collection(obj[keys[0]])
+  return None
+
+
+def _nested_collection(name: str, items: List[Any]) -> Optional[Tuple[str, List[Any]]]:
+  if not items or not all(isinstance(item, dict) for item in items):
+    return None
+  # Items with an id of their own are the resources, their lists (Layers, AvailabilityZones, IpPermissions) are attributes.
+  if name not in WRAPPER_KEYS and find_id_key(name, items[0]) is not None:
+    return None
+  list_keys = {k for k, v in items[0].items() if isinstance(v, list) and v and isinstance(v[0], dict)}
+  if len(list_keys) != 1:
+    return None
+  key = list_keys.pop()
+  if not all(isinstance(item.get(key), list) for item in items):
+    return None
+  return key, [child for item in items for child in item[key]]
+
+
+def find_id_key(collection: str, item: Dict[str, Any]) -> Optional[str]:
+  singular = _singular(collection)
+  for candidate in (f'{singular}Arn', f'{singular}ARN', f'{singular}Id', f'{singular}Name', 'Arn', 'ARN', 'Id', 'Name'):
+    if isinstance(item.get(candidate), (str, int)):
+      return candidate
+  # e.g. SecurityGroups items are keyed by GroupId, which should win over OwnerId.
+  for k, v in item.items():
+    stem = k.removesuffix('Arn').removesuffix('ARN').removesuffix('Id')
+    if isinstance(v, str) and stem != k and stem and singular.endswith(stem):
+      return k
+  for k, v in item.items():
+    if isinstance(v, str) and (k.endswith('Arn') or k.endswith('ARN') or k.endswith('Id')):
+      return k
+  return None
+
+
+def _attributes(item: Dict[str, Any], id_key: str) -> List[str]:
+  attributes = []
+  name_key = next((k for k, v in item.items() if k != id_key and k.endswith('Name') and isinstance(v, str)), None)
+  if name_key:
+    attributes.append(f'{name_key}: {item[name_key]}')
+  for tag in item.get('Tags') or []:
+    if isinstance(tag, dict) and tag.get('Key') == 'Name':
+      attributes.append(f'Name: {tag.get("Value")}')
+  for k, v in item.items():
+    if k == id_key or not (k in ATTRIBUTE_KEYS or k.endswith('State') or k.endswith('Status')):
+      continue
+    if isinstance(v, dict) and isinstance(v.get('Name'), str):
+      v = v['Name']
+    if isinstance(v, (str, int, float, bool)):
+      attributes.append(f'{k}: {v}')
+  return attributes[:MAX_ATTRIBUTES]
+
+
+def _describe(item: Any, collection: str) -> Optional[str]:
+  if isinstance(item, (str, int, float)):
+    return str(item)
+  if not isinstance(item, dict):
+    return None
+
+  id_key = find_id_key(collection, item)
+  if id_key is None:
+    return None
+  attributes = _attributes(item, id_key)
+  return f'{item[id_key]} ({", ".join(attributes)})' if attributes else str(item[id_key])
+
+
+def summarize_json(reason: str, content: str) -> Optional[str]:
+  """Summarize structured CLI output without an LLM, or return None when the structure is ambiguous."""
+  try:
+    obj = json.loads(content)
+  except json.JSONDecodeError:
+    return None
+
+  if isinstance(obj, dict) and 0 < len(obj) <= MAX_SCALAR_FIELDS and all(isinstance(v, (str, int, float, bool)) for v in obj.values()):
+    return f'{reason} returned ' + ', '.join(f'{k}: {v}' for k, v in obj.items()) + '.'
+
+  found = _find_collection(obj)
+  if found is None:
+    return None
+  collection, items = found
+
+  container = ''
+  nested = _nested_collection(collection, items)
+  if nested is not None:
+    container = f' across {len(items)} {collection}'
+    collection, items = nested
+
+  if not items:
+    return f'{reason} returned no {collection}.'
+
+  descriptions = []
+  for item in items:
+    description = _describe(item, collection)
+    if description is None:
+      return None
+    descriptions.append(description)
+
+  listed = '; '.join(descriptions[:MAX_ITEMS])
+  more = f'; and {len(descriptions) - MAX_ITEMS} more' if len(descriptions) > MAX_ITEMS else ''
+  return f'{reason} returned {len(items)} {collection}{container}: {listed}{more}.'
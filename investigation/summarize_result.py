@@ -1,12 +1,61 @@
+import time
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Dict, Literal, Tuple
 
 from alxai.listener_queue import ListenerQueue
+from alxai.openai.client import count_tokens
 from alxai.openai.conv import oneshot_conv, usermsg
 from investigation.investigation import FileMetadata, Investigation
 
+type SummaryMode = Literal['retrieval', 'file_dump']
+
+
+@dataclass(kw_only=True)
+class SummaryStats:
+  calls: int = 0
+  prompt_tokens: int = 0
+  # What file_dump would have sent, estimated from file sizes, for comparison with retrieval.
+  full_tokens: int = 0
+  total_latency: float = 0
+
+  def report(self, mode: str) -> str:
+    if not self.calls:
+      return f'{mode}: no calls'
+    line = f'{mode}: calls={self.calls} avg prompt tokens={self.prompt_tokens // self.calls} avg latency={self.total_latency / self.calls:.2f}s'
+    if self.full_tokens:
+      line += f' (file_dump would be ~{self.full_tokens // self.calls} tokens)'
+    return line
+
+
+summary_stats: Dict[SummaryMode, SummaryStats] = {'retrieval': SummaryStats(), 'file_dump': SummaryStats()}
+
+
+def summary_report() -> str:
+  return '\n'.join(stats.report(mode) for mode, stats in summary_stats.items())
+
+
+async def summarize_result(client, investigation: Investigation, mode: SummaryMode = 'retrieval') -> str:
+  start = time.monotonic()
+  stats = summary_stats[mode]
+  if mode == 'retrieval':
+    data = f"""# Facts extracted so far
+{investigation.summarize_facts(investigation.prompt)}
+
+# Relevant excerpts of previously run commands
+{await investigation.relevant_context(client)}"""
+    stats.full_tokens += sum(investigation.estimate_tokens(fm) for fm in investigation.files.values())
+  else:
+    data = f"""# Previously run commands
+{await investigation.file_dump()}"""
+
+  if investigation.changes:
+    changes = '\n'.join(f'- {change}' for change in investigation.changes)
+    data += f"""
+
+# Changes since the previous investigation of this question
+These command outputs changed since the last time this question was answered, highlight what changed in your answer.
+{changes}"""
 
-async def summarize_result(client, investigation: Investigation) -> str:
   prompt = f"""You are a cyber security expert who focuses on conducting investigations of potential security incidents. 
 You have broad and deep expertise in security and IT tools that are useful in investigations, such as SIEMs, EDR, MDM, IdP. 
 You have successfully conducted numerous investigations in areas including (but not limited to):
@@ -22,8 +71,7 @@ You are tasked with answering the following question from a user based on all of
 
 "{investigation.prompt}"
 
-# Previously run commands
-{investigation.file_dump()}"""
+{data}"""
 
   response = await oneshot_conv(
     client,
@@ -31,9 +79,11 @@ You are tasked with answering the following question from a user based on all of
     model='o3-mini',
   )
   assert response is not None
-  investigation.summary = response
-  investigation._save_master_index()
+  investigation.set_summary(response)
 
+  stats.calls += 1
+  stats.prompt_tokens += count_tokens(prompt)
+  stats.total_latency += time.monotonic() - start
   return response
 
 
@@ -41,6 +91,11 @@ You are tasked with answering the following question from a user based on all of
 class SummarizeResultListener(ListenerQueue[FileMetadata]):
   investigation: Investigation
   client: Any
+  latest_only: bool = True
+  debounce: float = 1.0
+  min_interval: float = 30.0
+  outputs: Tuple[str, ...] = ('summary',)
+  mode: SummaryMode = 'retrieval'
 
   async def process(self, fm: FileMetadata):
-    await summarize_result(self.client, self.investigation)
+    await summarize_result(self.client, self.investigation, self.mode)
@@ -1,37 +1,61 @@
+import argparse
 import asyncio
 import logging
 import sys
+from pathlib import Path
 
+from alxai.base.aws_driver import AwsDriverPool
+from alxai.base.cli import CliRunner, get_cli_runner, set_cli_runner
 from alxai.base.context import ConvContext, set_conv_context
 from alxai.openai.client import get_openai_client
+from alxai.scheduler import get_scheduler
+from alxai.trace import save_trace, trace_summary, tracing_enabled
 from investigation.are_we_done import AreWeDoneListener
+from investigation.command_cache import CommandCache, get_command_cache, set_command_cache
 from investigation.extract_asset_graph import AssetGraphListener
 from investigation.extract_facts import ExtractFactsListener
-from investigation.gather_data import gather_data
+from investigation.fan_out import FanOut, get_fan_out, set_fan_out
+from investigation.gather_data import gather_data, step_report
 from investigation.investigation import Investigation
+from investigation.knowledge import load_account_knowledge
+from investigation.reinvestigate import rerun_history
 from investigation.summarize_as_html import save_investigation_html
-from investigation.summarize_result import SummarizeResultListener, summarize_result
+from investigation.summarize_result import SummarizeResultListener, summarize_result, summary_report
 
 
-async def gather_data_loop(client, investigation):
+async def gather_data_loop(client, investigation, batch: bool = False) -> int:
+  rounds = 0
   while not investigation.done.is_set():
+    rounds += 1
     try:
-      await gather_data(client, investigation)
+      await gather_data(client, investigation, batch)
     except RuntimeError:
       continue
+  return rounds
 
 
-async def prototype_aws(client, log):
+async def prototype_aws(client, log, resume: Path | None = None, rerun: Path | None = None, batch: bool = False):
   prompt = 'Which ec2 instances can receive inbound SSH traffic from other hosts?'
   # prompt = 'list all of the certificates used by my load balancers and show me when they expire'
   # prompt = 'I have an ECS service called "cooltrans" that isn\'t working. What\'s wrong with it?'
   # prompt = 'list all my securityhub findings with a createdat in the last 10 days and summarize the high severity ones'
-  investigation = Investigation.create(client=client, prompt=prompt)
-
-  extract_facts_listener = ExtractFactsListener(investigation=investigation, client=client, done=investigation.done)
+  prior = None
+  if resume:
+    investigation = Investigation.load(resume, client)
+  elif rerun:
+    prior = Investigation.load(rerun, client)
+    investigation = Investigation.create(client=client, prompt=prior.prompt)
+  else:
+    investigation = Investigation.create(client=client, prompt=prompt)
+
+  knowledge = await load_account_knowledge()
+  if knowledge and not resume and not prior:
+    print(knowledge.warm_start(investigation))
+
+  extract_facts_listener = ExtractFactsListener(investigation=investigation, client=client, done=investigation.done, workers=4, maxsize=32, batch_max_tokens=8000, batch_window=2.0)
   investigation.add_listener(extract_facts_listener)
 
-  asset_graph_listener = AssetGraphListener(investigation=investigation, client=client, done=investigation.done)
+  asset_graph_listener = AssetGraphListener(investigation=investigation, client=client, done=investigation.done, workers=4, maxsize=32, batch_max_tokens=8000, batch_window=2.0)
   investigation.add_listener(asset_graph_listener)
 
   summarize_result_listener = SummarizeResultListener(investigation=investigation, client=client, done=investigation.done)
@@ -40,19 +64,73 @@ async def prototype_aws(client, log):
   are_we_done_listener = AreWeDoneListener(investigation=investigation, client=client, done=investigation.done)
   investigation.add_listener(are_we_done_listener)
 
+  if resume:
+    await investigation.resume()
+    if investigation.completed:
+      investigation.done.set()
+
+  if prior:
+    # Only changed outputs are processed, the question was already answered with the rest.
+    await rerun_history(client, investigation, prior)
+    investigation.mark_done()
+
   # await gather_intel(client, investigation)
 
-  await gather_data_loop(client, investigation)
+  rounds = await gather_data_loop(client, investigation, batch)
   await investigation.shutdown()
-
-  result = await summarize_result(client, investigation)
+  if knowledge:
+    knowledge.merge(investigation)
+    knowledge.save()
+
+  for listener in investigation.listeners:
+    print(f'📊 {listener.report()}')
+  print(f'📊 {investigation.dag.report()}')
+  print(f'📊 {investigation.summary_ratio()}')
+  print(f'📊 {rounds} gather rounds, {step_report()}')
+  print(f'📊 {investigation.prefetcher.report()}')
+  print(f'📊 CLI {get_cli_runner().metrics.report()}')
+  print(f'📊 {get_command_cache().report()}')
+  if get_fan_out():
+    print(f'📊 {get_fan_out().report()}')
+  print(f'📊 LLM queue wait by priority:\n{get_scheduler().report()}')
+
+  if prior and not investigation.changes and prior.summary:
+    result = prior.summary
+    investigation.set_summary(result)
+  else:
+    result = await summarize_result(client, investigation)
   print(f'\n\n\n### Final Summary:\n{result}')
+  print(f'📊 Final summary prompts:\n{summary_report()}')
 
   output_path = investigation.dir / 'index.html'
   save_investigation_html(investigation, output_path)
 
+  if tracing_enabled():
+    trace_path = investigation.dir / 'trace.json'
+    save_trace(trace_path)
+    print(f'\n### Trace written to {trace_path}\n{trace_summary()}')
+
 
 async def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--resume', type=Path, help='investigation directory to resume after a crash or interrupt')
+  parser.add_argument('--rerun', type=Path, help='previous investigation to re-run, only processing command outputs that changed')
+  parser.add_argument('--batch', action='store_true', help='ask for batches of independent commands and run them concurrently')
+  parser.add_argument('--in-process-aws', action='store_true', help='run aws commands in long-lived awscli workers instead of a process per command')
+  parser.add_argument('--no-cache', action='store_true', help='always run aws commands instead of reusing recent read-only outputs')
+  parser.add_argument('--regions', help="comma separated regions to run read-only commands in, when they don't name one")
+  parser.add_argument('--profiles', help="comma separated aws profiles (accounts) to run read-only commands in, when they don't name one")
+  args = parser.parse_args()
+
+  if args.regions or args.profiles:
+    set_fan_out(FanOut(regions=args.regions.split(',') if args.regions else [], profiles=args.profiles.split(',') if args.profiles else []))
+
+  if args.no_cache:
+    set_command_cache(CommandCache(enabled=False))
+
+  if args.in_process_aws:
+    set_cli_runner(CliRunner(aws_driver=AwsDriverPool()))
+
   logging.basicConfig(stream=sys.stdout, level=logging.INFO)
   httpx_log = logging.getLogger('httpx')
   httpx_log.setLevel(logging.WARNING)
@@ -66,7 +144,10 @@ async def main():
         oai_client=client,
       )
     )
-    await prototype_aws(client, log)
+    await prototype_aws(client, log, args.resume, args.rerun, args.batch)
+
+  if get_cli_runner().aws_driver:
+    get_cli_runner().aws_driver.shutdown()
 
 
 if __name__ == '__main__':
@@ -11,10 +11,8 @@ def main():
   # Process each investigation directory
   for investigation_dir in base_dir.iterdir():
     if investigation_dir.is_dir():
-      # Read master index and parse with Pydantic
-      with open(investigation_dir / 'master_index.json', 'r') as f:
-        investigation = Investigation.model_validate_json(f.read(), strict=False)
-        investigation.dir = investigation_dir
+      # Read the master index snapshot and replay the journal on top of it
+      investigation = Investigation.load(investigation_dir)
 
       # Generate and save HTML
       output_path = investigation_dir / 'index.html'
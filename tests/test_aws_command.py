@@ -0,0 +1,48 @@
+from investigation.aws_command import cache_key, command_ttl, is_cacheable, normalize_args
+
+
+def test_describe_and_list_are_cacheable():
+  assert is_cacheable(['aws', 'ec2', 'describe-instances'])
+  assert is_cacheable(['aws', 'lambda', 'list-functions', '--region', 'us-east-1'])
+  assert is_cacheable(['aws', 'iam', 'get-role', '--role-name', 'admin'])
+
+
+def test_writes_are_not_cacheable():
+  assert not is_cacheable(['aws', 'ec2', 'terminate-instances', '--instance-ids', 'i-1'])
+  assert not is_cacheable(['aws', 's3', 'cp', 'a', 's3://b/a'])
+
+
+def test_secrets_are_not_cacheable():
+  for service, operation in [
+    ('secretsmanager', 'get-secret-value'),
+    ('secretsmanager', 'batch-get-secret-value'),
+    ('ssm', 'get-parameter-history'),
+    ('sso', 'get-role-credentials'),
+    ('redshift', 'get-cluster-credentials'),
+    ('ecr-public', 'get-login-password'),
+    ('cognito-identity', 'get-credentials-for-identity'),
+    ('lightsail', 'get-relational-database-master-user-password'),
+  ]:
+    assert not is_cacheable(['aws', service, operation]), operation
+
+
+def test_unknown_get_operations_are_not_cacheable():
+  # A new secret api is safe by default, get operations are only cached once they are known not to return one.
+  assert not is_cacheable(['aws', 'newservice', 'get-api-key'])
+  assert not is_cacheable(['aws', 'dynamodb', 'batch-get-item'])
+
+
+def test_cache_key_ignores_option_and_value_order():
+  a = cache_key(['aws', 'ec2', 'describe-security-groups', '--group-ids', 'sg-2', 'sg-1', '--region', 'us-east-1'])
+  b = cache_key(['ec2', 'describe-security-groups', '--region', "'us-east-1'", '--group-ids', 'sg-1', 'sg-2', '--no-cli-pager'])
+  assert a == b
+
+
+def test_normalize_args_keeps_value_order():
+  assert normalize_args(['ec2', 'describe-instances', '--instance-ids', 'i-2', 'i-1']) == ['aws', 'ec2', 'describe-instances', '--instance-ids', 'i-2', 'i-1']
+
+
+def test_command_ttl_by_service():
+  assert command_ttl(['aws', 'iam', 'list-roles']) == 3600
+  assert command_ttl(['aws', 'logs', 'filter-log-events']) == 60
+  assert command_ttl(['aws', 'unknown', 'list-things']) == 600
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from investigation.blob_store import HEADER, FileBlobStore, MemoryBlobStore, digest_of
+
+DATA = b'{"Reservations": []}\n' * 1000
+
+
+def _stores(tmp_path):
+  return [MemoryBlobStore(), FileBlobStore(root=tmp_path)]
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_put_and_read_round_trip(tmp_path, compress):
+  for store in _stores(tmp_path):
+    digest = asyncio.run(store.put(DATA, compress=compress))
+    assert digest == digest_of(DATA)
+    assert bytes(store.read(digest)) == DATA
+    assert bytes(asyncio.run(store.get(digest))) == DATA
+    assert store.size(digest) == len(DATA)
+    assert store.read_text(digest) == DATA.decode()
+    with store.open_stream(digest) as f:
+      assert f.read() == DATA
+
+
+def test_compressed_blobs_are_smaller_on_disk(tmp_path):
+  store = FileBlobStore(root=tmp_path)
+  digest = asyncio.run(store.put(DATA))
+  assert store.path(digest).stat().st_size < len(DATA)
+
+
+def test_the_same_content_is_stored_once(tmp_path):
+  store = FileBlobStore(root=tmp_path)
+  first = asyncio.run(store.put(DATA))
+  second = asyncio.run(store.put(DATA, compress=False))
+  assert first == second
+  assert [p for p in tmp_path.rglob('*') if p.is_file()] == [store.path(first)]
+
+
+def test_put_file_stores_the_file_uncompressed(tmp_path):
+  source = tmp_path / 'output.json'
+  source.write_bytes(DATA)
+  store = FileBlobStore(root=tmp_path / 'blobs')
+  digest = asyncio.run(store.put_file(source))
+  assert digest == digest_of(DATA)
+  assert store.path(digest).stat().st_size == HEADER.size + len(DATA)
+  with store.open_stream(digest) as f:
+    assert f.read() == DATA
+  assert asyncio.run(MemoryBlobStore().put_file(source)) == digest
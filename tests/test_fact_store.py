@@ -0,0 +1,42 @@
+from investigation.fact_store import FactStore
+
+
+def test_exact_duplicates_are_dropped():
+  store = FactStore()
+  assert store.add(['Bucket logs-prod is public.', 'bucket  logs-prod is public']) == ['Bucket logs-prod is public']
+  assert store.duplicates == 1
+
+
+def test_near_duplicates_about_the_same_resource_are_dropped():
+  store = FactStore()
+  accepted = store.add(
+    [
+      'Security group sg-0123456789abcdef0 allows inbound SSH on port 22 from 0.0.0.0/0 for the bastion hosts in the production VPC',
+      'Security group sg-0123456789abcdef0 allows inbound SSH on port 22 from 0.0.0.0/0 for the bastion hosts in the production VPC today',
+    ]
+  )
+  assert len(accepted) == 1
+  assert store.duplicates == 1
+
+
+def test_statements_about_different_resources_are_kept():
+  store = FactStore()
+  accepted = store.add(['sg-0123456789abcdef0 allows port 22 from anywhere', 'sg-0fedcba9876543210 allows port 22 from anywhere'])
+  assert len(accepted) == 2
+  assert store.about('sg-0123456789abcdef0') == ['sg-0123456789abcdef0 allows port 22 from anywhere']
+  assert store.about('sg-0000000000000000f') == []
+
+
+def test_relevant_prefers_facts_about_the_query_and_respects_the_budget():
+  store = FactStore()
+  store.add([f'Instance i-{n:017x} runs an outdated AMI with no patch baseline attached to it' for n in range(20)])
+  store.add(['Instance i-00000000000000abc has an instance profile with admin access'])
+
+  assert store.relevant('what can i-00000000000000abc reach?', max_facts=1) == ['Instance i-00000000000000abc has an instance profile with admin access']
+
+  budget = 3 * store.facts[0].tokens
+  selected = store.relevant('outdated AMI', token_budget=budget)
+  assert 0 < len(selected) <= 3
+  assert sum(fact.tokens for fact in store.facts if fact.text in selected) <= budget
+  # Results keep the order the facts were added in.
+  assert selected == [fact.text for fact in store.facts if fact.text in selected]
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+from investigation.asset_graph import AssetGraph, AssetNode
+from investigation.investigation import JOURNAL, MASTER_INDEX, Investigation
+from investigation.journal import Journal
+
+
+def _investigation(dir: Path, snapshot_every: int = 100) -> Investigation:
+  investigation = Investigation(prompt='which buckets are public?', dir=dir, snapshot_every=snapshot_every)
+  investigation.journal = Journal(path=dir / JOURNAL)
+  investigation.save_snapshot()
+  return investigation
+
+
+def _graph(*ids: str) -> AssetGraph:
+  return AssetGraph(nodes={i: AssetNode(asset_id=i, asset_name=i, asset_type='bucket') for i in ids}, edges={})
+
+
+def _events(dir: Path) -> int:
+  return len((dir / JOURNAL).read_text().splitlines())
+
+
+def test_load_replays_events_after_the_snapshot(tmp_path):
+  investigation = _investigation(tmp_path)
+  investigation.set_summary('two public buckets')
+  investigation.add_assets(_graph('logs', 'site'), 'list-buckets')
+  investigation.set_conversation([{'role': 'user', 'content': 'hi'}])
+  investigation.set_conversation([{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'aws s3 ls'}])
+  investigation.add_changes(['site is now public'])
+  investigation.mark_done()
+  assert _events(tmp_path) == 6
+
+  loaded = Investigation.load(tmp_path)
+  assert loaded.summary == 'two public buckets'
+  assert set(loaded.assets.nodes) == {'logs', 'site'}
+  assert set(loaded.asset_sources['list-buckets'].nodes) == {'logs', 'site'}
+  assert loaded.conversation == investigation.conversation
+  assert loaded.changes == ['site is now public']
+  assert loaded.completed
+  assert loaded.journal_seq == investigation.journal_seq
+
+
+def test_snapshots_compact_the_journal(tmp_path):
+  investigation = _investigation(tmp_path, snapshot_every=3)
+  for i in range(4):
+    investigation.add_changes([f'change {i}'])
+  # The third event wrote a snapshot and emptied the journal, only the fourth is left in it.
+  assert _events(tmp_path) == 1
+  assert (tmp_path / MASTER_INDEX).exists()
+
+  loaded = Investigation.load(tmp_path)
+  assert loaded.changes == [f'change {i}' for i in range(4)]
+  assert loaded.events_since_snapshot == 1
+
+
+def test_events_already_in_the_snapshot_are_not_replayed_twice(tmp_path):
+  investigation = _investigation(tmp_path)
+  investigation.add_changes(['once'])
+  journal = (tmp_path / JOURNAL).read_text()
+  # A crash after the snapshot was written but before the journal was truncated leaves covered events behind.
+  investigation.save_snapshot()
+  (tmp_path / JOURNAL).write_text(journal)
+
+  assert Investigation.load(tmp_path).changes == ['once']
+
+
+def test_a_torn_final_line_is_ignored(tmp_path):
+  investigation = _investigation(tmp_path)
+  investigation.add_changes(['kept'])
+  with open(tmp_path / JOURNAL, 'a') as f:
+    f.write('{"seq": 2, "type": "changes_detec')
+
+  assert Investigation.load(tmp_path).changes == ['kept']
@@ -0,0 +1,107 @@
+import asyncio
+import io
+import json
+from pathlib import Path
+
+import pyarrow.parquet as pq
+import pytest
+
+from investigation.json_to_parquet import RecordFlattener, extract_tables_from_json, records_shape, records_to_tables
+from investigation.stream_ingest import stream_to_parquet
+
+
+async def _no_llm(record):
+  raise AssertionError('the id key should be found without asking')
+
+
+def test_outputs_with_metadata_keys():
+  output = {
+    'Buckets': [{'Name': 'logs', 'CreationDate': '2024-01-01'}, {'Name': 'site', 'CreationDate': '2024-02-01'}],
+    'Owner': {'DisplayName': 'ops', 'ID': 'abc'},
+    'NextToken': None,
+  }
+  tables = asyncio.run(extract_tables_from_json(output, 'aws_cli_output', _no_llm))
+  assert list(tables) == ['Buckets']
+  assert tables['Buckets'].column('Name').to_pylist() == ['logs', 'site']
+
+
+def test_several_top_level_lists():
+  output = {
+    'UserDetailList': [{'UserId': 'u-1', 'Tags': [{'Key': 'team', 'Value': 'ops'}]}],
+    'RoleDetailList': [{'RoleId': 'r-1', 'Tags': [{'Key': 'team', 'Value': 'dev'}]}],
+  }
+  tables = asyncio.run(extract_tables_from_json(output, 'aws_cli_output', _no_llm))
+  assert sorted(tables) == ['RoleDetailList', 'RoleDetailList_Tags', 'Tags', 'UserDetailList']
+  assert tables['Tags'].column('UserId').to_pylist() == ['u-1']
+  assert tables['RoleDetailList_Tags'].column('RoleId').to_pylist() == ['r-1']
+
+
+def test_list_documents_and_scalars():
+  async def queue_url(record):
+    return 'QueueUrl'
+
+  assert list(asyncio.run(extract_tables_from_json([{'QueueUrl': 'a'}], 'queues', queue_url))) == ['queues']
+  assert asyncio.run(extract_tables_from_json('text', 'aws_cli_output', _no_llm)) == {}
+
+
+def _streamed(output, out_dir: Path, batch_rows: int):
+  out_dir.mkdir()
+  data = json.dumps(output).encode()
+  paths = stream_to_parquet(lambda: io.BytesIO(data), out_dir, 'aws_cli_output', lambda collection, record: 'Id', batch_rows)
+  return {name: pq.read_table(path) for name, path in paths.items()}
+
+
+def test_stream_matches_memory_when_types_differ(tmp_path):
+  records = [
+    {'Id': 'a', 'X': {'z': 1, 'L': [{'q': 1}]}, 'Count': 1},
+    {'Id': 'b', 'X': 5, 'Count': 2.5},
+    {'Id': 'c', 'X': None, 'Count': None},
+  ]
+  expected = records_to_tables(records, 'Items', 'Id')
+  assert list(expected) == ['Items']
+  assert expected['Items'].column('X').to_pylist() == ['{"z": 1, "L": [{"q": 1}]}', '5', None]
+  for batch_rows in (1, 2, 1000):
+    streamed = _streamed({'Items': records}, tmp_path / str(batch_rows), batch_rows)
+    assert list(streamed) == ['Items']
+    assert streamed['Items'].schema.equals(expected['Items'].schema)
+    assert streamed['Items'].to_pylist() == expected['Items'].to_pylist()
+    assert records_to_tables(records, 'Items', 'Id', batch_size=batch_rows)['Items'].to_pylist() == expected['Items'].to_pylist()
+
+
+def test_grandchild_tables_are_keyed_by_their_parent():
+  reservations = [
+    {'ReservationId': 'r-1', 'Instances': [{'InstanceId': 'i-1', 'Tags': [{'Key': 'team', 'Value': 'ops'}], 'SecurityGroups': ['sg-1', 'sg-2']}]},
+    {'ReservationId': 'r-2', 'Instances': [{'InstanceId': 'i-2', 'Tags': [{'Key': 'team', 'Value': 'dev'}]}]},
+  ]
+  tables = RecordFlattener(id_key='ReservationId').flatten(reservations)
+  assert sorted(tables) == ['', 'Instances', 'Instances_SecurityGroups', 'Instances_Tags']
+  assert tables['Instances_Tags'].select(['Value', 'ReservationId', 'InstanceId']).to_pylist() == [
+    {'Value': 'ops', 'ReservationId': 'r-1', 'InstanceId': 'i-1'},
+    {'Value': 'dev', 'ReservationId': 'r-2', 'InstanceId': 'i-2'},
+  ]
+  # Lists of scalars become a value column.
+  assert tables['Instances_SecurityGroups'].column('value').to_pylist() == ['sg-1', 'sg-2']
+  assert tables['Instances_SecurityGroups'].column('InstanceId').to_pylist() == ['i-1', 'i-1']
+
+
+def test_parents_without_an_id_are_keyed_by_row_index_across_batches():
+  flattener = RecordFlattener(id_key='GroupId')
+  first = flattener.flatten([{'GroupId': 'sg-1', 'Rules': [{'Ports': [22, 80]}]}])
+  second = flattener.flatten([{'GroupId': 'sg-2', 'Rules': [{'Ports': [443]}]}])
+  assert first['Rules_Ports'].column('Rules_index').to_pylist() == [0, 0]
+  assert second['Rules'].column('Rules_index').to_pylist() == [1]
+  assert second['Rules_Ports'].select(['value', 'GroupId', 'Rules_index']).to_pylist() == [{'value': 443, 'GroupId': 'sg-2', 'Rules_index': 1}]
+
+
+def test_conflicting_types_become_text_in_every_batch():
+  rules = [{'Id': 'a', 'Port': 22}, {'Id': 'b', 'Port': 'any'}]
+  assert RecordFlattener(id_key='Id').flatten(rules)[''].column('Port').to_pylist() == ['22', 'any']
+
+  flattener = RecordFlattener(id_key='Id', shape=records_shape(rules))
+  assert flattener.flatten(rules[:1])[''].column('Port').to_pylist() == ['22']
+  assert flattener.flatten(rules[1:])[''].column('Port').to_pylist() == ['any']
+
+
+def test_missing_id_key_is_an_error():
+  with pytest.raises(ValueError):
+    RecordFlattener(id_key='InstanceId').flatten([{'Name': 'web'}])
@@ -0,0 +1,97 @@
+import asyncio
+import random
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import pytest
+
+from alxai.listener_queue import ListenerQueue
+
+
+@dataclass(kw_only=True)
+class Recorder(ListenerQueue[Tuple[str, int]]):
+  seen: List[Tuple[str, int]] = field(default_factory=list)
+  completed: List[Tuple[Tuple[str, int], bool]] = field(default_factory=list)
+  delay: float = 0
+
+  def __post_init__(self):
+    super().__post_init__()
+    self.on_complete = self._record_completion
+
+  async def _record_completion(self, queue, msg, processed):
+    self.completed.append((msg, processed))
+
+  async def process(self, msg):
+    if self.delay:
+      await asyncio.sleep(random.random() * self.delay)
+    if msg[0] == 'fail':
+      raise ValueError('boom')
+    self.seen.append(msg)
+
+
+@dataclass(kw_only=True)
+class Summing(Recorder):
+  def coalesce(self, pending, msg):
+    return (pending[0], pending[1] + msg[1])
+
+
+async def _drain(queue: ListenerQueue, msgs) -> None:
+  for msg in msgs:
+    await queue.put(msg)
+  queue.done.set()
+  await queue.run()
+
+
+def test_drop_oldest_completes_dropped_messages_as_unprocessed():
+  queue = Recorder(done=asyncio.Event(), maxsize=2, overflow='drop_oldest')
+  asyncio.run(_drain(queue, [('a', 1), ('a', 2), ('a', 3)]))
+  assert queue.seen == [('a', 2), ('a', 3)]
+  assert queue.metrics.dropped == 1
+  assert (('a', 1), False) in queue.completed
+  assert (('a', 3), True) in queue.completed
+
+
+def test_coalesce_merges_into_the_newest_pending_message():
+  queue = Summing(done=asyncio.Event(), maxsize=1, overflow='coalesce')
+  asyncio.run(_drain(queue, [('a', 1), ('a', 2), ('a', 3)]))
+  assert queue.seen == [('a', 6)]
+  assert queue.metrics.coalesced == 2
+  # Every message folded into the merged one completes with it.
+  assert len(queue.completed) == 3
+
+
+def test_coalesce_must_be_implemented():
+  with pytest.raises(ValueError):
+    Recorder(done=asyncio.Event(), overflow='coalesce')
+
+
+def test_order_key_keeps_arrival_order_per_key():
+  random.seed(0)
+  queue = Recorder(done=asyncio.Event(), workers=4, order_key=lambda msg: msg[0], delay=0.005)
+  msgs = [(key, i) for i in range(10) for key in 'abc']
+  asyncio.run(_drain(queue, msgs))
+  for key in 'abc':
+    assert [i for k, i in queue.seen if k == key] == list(range(10))
+
+
+def test_latest_only_runs_once_for_the_newest_message():
+  queue = Recorder(done=asyncio.Event(), latest_only=True)
+  asyncio.run(_drain(queue, [('a', i) for i in range(5)]))
+  assert queue.seen == [('a', 4)]
+  assert queue.metrics.skipped == 4
+  assert sorted(msg for msg, _ in queue.completed) == [('a', i) for i in range(5)]
+
+
+def test_failures_are_counted_and_not_completed_as_processed():
+  queue = Recorder(done=asyncio.Event())
+  asyncio.run(_drain(queue, [('fail', 1), ('a', 2)]))
+  assert queue.metrics.failed == 1
+  assert queue.metrics.last_error == 'ValueError: boom'
+  assert queue.completed == [(('fail', 1), False), (('a', 2), True)]
+
+
+def test_batches_only_fail_the_messages_that_failed():
+  queue = Recorder(done=asyncio.Event(), batch_window=0.01)
+  asyncio.run(_drain(queue, [('a', 1), ('fail', 2), ('a', 3)]))
+  assert queue.seen == [('a', 1), ('a', 3)]
+  assert dict(queue.completed) == {('a', 1): True, ('fail', 2): False, ('a', 3): True}
@@ -0,0 +1,51 @@
+import asyncio
+import time
+from typing import List
+
+from alxai.scheduler import Priority, RequestScheduler
+
+
+async def _served(scheduler: RequestScheduler, waiting: List[Priority], stagger: float = 0) -> List[Priority]:
+  """The order waiting requests are served in once a request holding the only slot finishes."""
+  served: List[Priority] = []
+
+  async def request(p: Priority):
+    async with scheduler.slot(p):
+      served.append(p)
+
+  async with scheduler.slot('critical'):
+    tasks = []
+    for p in waiting:
+      tasks.append(asyncio.create_task(request(p)))
+      await asyncio.sleep(stagger)
+    await asyncio.sleep(0)
+  await asyncio.gather(*tasks)
+  return served
+
+
+def test_classes_share_capacity_by_weight():
+  scheduler = RequestScheduler(capacity=1, weights={'critical': 8, 'interactive': 4, 'background': 1})
+  served = asyncio.run(_served(scheduler, ['background'] * 4 + ['critical'] * 16))
+  # Background isn't starved, but gets about one slot for every eight critical ones.
+  assert served[:10].count('background') == 1
+  assert served[:19].count('background') == 3
+
+
+def test_requests_waiting_longer_than_max_wait_go_first():
+  scheduler = RequestScheduler(capacity=1, max_wait=0.02)
+  served = asyncio.run(_served(scheduler, ['background', 'critical', 'critical'], stagger=0.03))
+  assert served[0] == 'background'
+
+
+def test_uncontended_requests_do_not_wait():
+  scheduler = RequestScheduler(capacity=2)
+
+  async def run():
+    start = time.monotonic()
+    async with scheduler.slot('background'):
+      async with scheduler.slot('interactive'):
+        return time.monotonic() - start
+
+  assert asyncio.run(run()) < 0.01
+  assert scheduler.stats['background'].requests == 1
+  assert scheduler.stats['interactive'].requests == 1
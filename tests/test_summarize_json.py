@@ -0,0 +1,58 @@
+import json
+
+from investigation.summarize_json import summarize_json
+
+
+def test_nested_wrapper():
+  content = json.dumps({'Reservations': [{'ReservationId': 'r-1', 'Instances': [{'InstanceId': 'i-1', 'State': {'Name': 'running'}}, {'InstanceId': 'i-2'}]}]})
+  assert summarize_json('describe-instances', content) == 'describe-instances returned 2 Instances across 1 Reservations: i-1 (State: running); i-2.'
+
+
+def test_load_balancers_keep_their_own_level():
+  content = json.dumps(
+    {
+      'LoadBalancers': [
+        {
+          'LoadBalancerArn': 'arn:aws:elasticloadbalancing:us-east-1:123:loadbalancer/app/web/1',
+          'LoadBalancerName': 'web',
+          'Scheme': 'internet-facing',
+          'AvailabilityZones': [{'ZoneName': 'us-east-1a', 'SubnetId': 'subnet-1'}, {'ZoneName': 'us-east-1b', 'SubnetId': 'subnet-2'}],
+        }
+      ]
+    }
+  )
+  summary = summarize_json('describe-load-balancers', content)
+  assert summary is not None
+  assert summary.startswith('describe-load-balancers returned 1 LoadBalancers: arn:aws:elasticloadbalancing')
+  assert 'subnet-1' not in summary
+
+
+def test_functions_keep_their_own_level():
+  content = json.dumps(
+    {
+      'Functions': [
+        {'FunctionName': 'handler', 'FunctionArn': 'arn:aws:lambda:us-east-1:123:function:handler', 'Runtime': 'python3.12', 'Layers': [{'Arn': 'arn:aws:lambda:us-east-1:123:layer:deps:1'}]}
+      ]
+    }
+  )
+  summary = summarize_json('list-functions', content)
+  assert summary == 'list-functions returned 1 Functions: arn:aws:lambda:us-east-1:123:function:handler (FunctionName: handler, Runtime: python3.12).'
+
+
+def test_security_groups_with_ip_permissions():
+  content = json.dumps(
+    {
+      'SecurityGroups': [
+        {
+          'Description': 'web',
+          'GroupName': 'web',
+          'IpPermissions': [{'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}],
+          'OwnerId': '123456789012',
+          'GroupId': 'sg-1',
+          'VpcId': 'vpc-1',
+        }
+      ]
+    }
+  )
+  summary = summarize_json('describe-security-groups', content)
+  assert summary == 'describe-security-groups returned 1 SecurityGroups: sg-1 (GroupName: web, VpcId: vpc-1).'